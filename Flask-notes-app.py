@@ -1,5 +1,5 @@
 """
-This is a secure, eye-friendly note-taking web application developed with the Flask framework. It features user registration and login with usernames restricted strictly to alphanumeric characters and passwords securely hashed for protection. Users can create, edit, delete, rename, and manage their personal notes online with ease. The notes support full Markdown syntax, including the direct embedding of video and audio elements via HTML tags, enabling rich multimedia content. The interface employs a dark mode with a black background and red text to minimize eye strain. To enhance security, a dynamically generated numeric captcha protects against unauthorized access, and all user sessions are stored securely on the server using Flask-Session. Additionally, users can toggle extended functionalities—such as mathematical formula rendering and special symbols—at any time directly from the frontend, ensuring that the editing and display formats remain consistent. This application delivers a minimalist yet powerful platform for comprehensive personal note management.
+This is a secure, eye-friendly note-taking web application developed with the Flask framework. It features user registration and login with usernames restricted strictly to alphanumeric characters and passwords securely hashed for protection. Users can create, edit, delete, rename, and manage their personal notes online with ease. The notes support full Markdown syntax, including the direct embedding of video and audio elements via HTML tags, enabling rich multimedia content. The interface employs a dark mode with a black background and red text to minimize eye strain. To enhance security, a dynamically generated numeric captcha protects against unauthorized access, and all user sessions are stored securely on the server in an SQLite session store. Additionally, users can toggle extended functionalities—such as mathematical formula rendering and special symbols—at any time directly from the frontend, ensuring that the editing and display formats remain consistent. This application delivers a minimalist yet powerful platform for comprehensive personal note management.
 """
 
 import os
@@ -7,30 +7,73 @@ import random
 import io
 import re
 import sqlite3
+import hashlib
+import hmac
+import time
 from flask import (
-    Flask, render_template_string, redirect, url_for, request, flash, session, send_file, g
+    Flask, render_template, redirect, url_for, request, flash, session, send_file, g, abort
 )
-from flask_session import Session
+from markupsafe import Markup, escape
 from werkzeug.security import generate_password_hash, check_password_hash
 from PIL import Image, ImageDraw, ImageFont
 from markdown2 import markdown
+import caching
+import captcha as captcha_pool
+import sqlite_session
+import perf
+import metrics
+import template_registry
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'replace-this-with-a-strong-secret-key'
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SESSION_FILE_DIR'] = './flask_session_dir'
+# 会话保存在服务器端的 SQLite 库中，Cookie 里只有会话 ID
+app.config['SESSION_DATABASE'] = './sessions.db'
 app.config['SESSION_PERMANENT'] = False
-os.makedirs(app.config['SESSION_FILE_DIR'], exist_ok=True)
-Session(app)
+app.config['SESSION_LIFETIME'] = 7 * 24 * 3600   # 服务器端空闲多久后过期（秒）
+app.config['SESSION_SWEEP_INTERVAL'] = 300       # 后台清理过期会话的间隔（秒）
+app.config['SESSION_CACHE_SIZE'] = 1024          # 进程内读缓存容量，0 表示不缓存
+# 模板字节码缓存目录，非空时加快新 worker 的冷启动
+app.config['TEMPLATE_BYTECODE_DIR'] = None
+app.session_interface = sqlite_session.SQLiteSessionInterface(
+    app.config['SESSION_DATABASE'],
+    lifetime=app.config['SESSION_LIFETIME'],
+    sweep_interval=app.config['SESSION_SWEEP_INTERVAL'],
+    cache_size=app.config['SESSION_CACHE_SIZE'],
+)
+
+# 请求级性能采样（见 perf.py）：关闭时不注册任何钩子
+app.config['PERF_ENABLED'] = False
+# 耗时超过 PERF_SLOW_MS 毫秒或 SQL 超过 PERF_SLOW_QUERIES 条的请求记入慢请求日志
+app.config['PERF_SLOW_MS'] = 500
+app.config['PERF_SLOW_QUERIES'] = 50
+# 单条 SQL 超过 PERF_SLOW_QUERY_MS 毫秒时记入慢查询日志（语句与参数）
+app.config['PERF_SLOW_QUERY_MS'] = 100
+# 在响应头 Server-Timing 中附带分项耗时，只应在调试时打开
+app.config['PERF_SERVER_TIMING'] = False
+perf.install(app)
+
+# Prometheus 指标（见 metrics.py）：/metrics 输出所有 worker 合计的请求数、延迟直方图、SQL 条数与缓存命中率
+app.config['METRICS_ENABLED'] = False
+# 各 worker 定期把增量合并进这个共享的 SQLite 文件
+app.config['METRICS_DATABASE'] = './metrics.db'
+app.config['METRICS_FLUSH_INTERVAL'] = 5
+# 抓取时须带 "Authorization: Bearer <令牌>"；为 None 时只允许本机直接访问
+app.config['METRICS_TOKEN'] = None
+metrics.install(app)
+if app.session_interface.cache is not None:
+    metrics.watch_cache('session', app.session_interface.cache.stats)
 
 DATABASE = './notes.db'
 USERNAME_RE = re.compile(r'^[a-zA-Z0-9]+$')
+# 笔记列表分页：每页条数与预览字符数（0 表示只取标题，列表查询完全由索引覆盖）
+app.config['NOTES_PAGE_SIZE'] = 50
+app.config['NOTE_PREVIEW_CHARS'] = 0
 
 # --------- 数据库相关 ---------
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
+        db = g._database = perf.connect(DATABASE)
         db.row_factory = sqlite3.Row
     return db
 
@@ -55,37 +98,247 @@ def init_db():
         content TEXT,
         FOREIGN KEY(user_id) REFERENCES users(id)
     );
+    -- 列表按 (user_id, id DESC) 定位翻页；带上 title 后只取标题的列表查询不必回表
+    CREATE INDEX IF NOT EXISTS idx_notes_user_id ON notes(user_id, id DESC, title);
+    CREATE TABLE IF NOT EXISTS rendered_html (
+        note_id INTEGER NOT NULL,
+        extras TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        html TEXT NOT NULL,
+        PRIMARY KEY (note_id, extras)
+    );
     ''')
     db.commit()
+    init_fts(db)
+
+# --------- 全文搜索 ---------
+# SQLite 3.34 起内置 trigram 分词器，对中文等不以空格分词的文字同样有效；
+# 更早的版本退回 unicode61，此时含中文的查询改走 LIKE 扫描
+FTS_TOKENIZER = 'trigram' if sqlite3.sqlite_version_info >= (3, 34, 0) else 'unicode61'
+SEARCH_LIMIT = 50
+# snippet() 用控制字符标出命中位置，先转义正文再替换成 <mark>，避免笔记内容中的 HTML 被执行
+MARK_START, MARK_END = '\x02', '\x03'
+CJK_RE = re.compile('[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]')
+
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+    title, content, content='notes', content_rowid='id', tokenize='%s'
+);
+CREATE TRIGGER IF NOT EXISTS notes_fts_ai AFTER INSERT ON notes BEGIN
+    INSERT INTO notes_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_ad AFTER DELETE ON notes BEGIN
+    INSERT INTO notes_fts(notes_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_au AFTER UPDATE OF title, content ON notes BEGIN
+    INSERT INTO notes_fts(notes_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    INSERT INTO notes_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+END;
+'''
+
+def init_fts(db):
+    exists = db.execute("SELECT 1 FROM sqlite_master WHERE name='notes_fts'").fetchone()
+    db.executescript(FTS_SCHEMA % FTS_TOKENIZER)
+    if not exists:
+        # 已有数据库首次创建索引时，把现存笔记一次性导入
+        rebuild_fts(db)
+
+def rebuild_fts(db):
+    db.execute("INSERT INTO notes_fts(notes_fts) VALUES('rebuild')")
+    db.commit()
+
+def render_snippet(text):
+    return Markup(str(escape(text)).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+def like_snippet(content, term, width=40):
+    pos = content.lower().find(term.lower())
+    if pos < 0:
+        return render_snippet(content[:width * 2])
+    start = max(pos - width, 0)
+    end = pos + len(term)
+    text = content[start:pos] + MARK_START + content[pos:end] + MARK_END + content[end:end + width]
+    return render_snippet(('…' if start else '') + text + ('…' if end + width < len(content) else ''))
+
+def search_notes(user_id, query):
+    """在当前用户的笔记中全文搜索，按 BM25 排序（标题权重更高），返回带高亮摘要的结果"""
+    terms = query.split()
+    if not terms:
+        return []
+    db = get_db()
+    if FTS_TOKENIZER == 'trigram':
+        # trigram 无法匹配少于 3 个字符的词
+        use_fts = all(len(t) >= 3 for t in terms)
+    else:
+        use_fts = not CJK_RE.search(query)
+    if use_fts:
+        match = ' '.join('"%s"' % t.replace('"', '""') for t in terms)
+        rows = db.execute('''SELECT n.id, n.title, snippet(notes_fts, 1, ?, ?, '…', 16) AS snippet
+                             FROM notes_fts JOIN notes n ON n.id = notes_fts.rowid
+                             WHERE notes_fts MATCH ? AND n.user_id = ?
+                             ORDER BY bm25(notes_fts, 10.0, 1.0) LIMIT ?''',
+                          (MARK_START, MARK_END, match, user_id, SEARCH_LIMIT)).fetchall()
+        return [dict(id=r['id'], title=r['title'], snippet=render_snippet(r['snippet'] or '')) for r in rows]
+    # 分词器处理不了的查询退回 LIKE 扫描，只扫描当前用户的笔记
+    clauses = []
+    params = [user_id]
+    for t in terms:
+        pattern = '%' + t.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        clauses.append("(title LIKE ? ESCAPE '\\' OR content LIKE ? ESCAPE '\\')")
+        params += [pattern, pattern]
+    rows = db.execute('SELECT id, title, content FROM notes WHERE user_id=? AND ' + ' AND '.join(clauses) +
+                      ' ORDER BY id DESC LIMIT ?', params + [SEARCH_LIMIT]).fetchall()
+    return [dict(id=r['id'], title=r['title'], snippet=like_snippet(r['content'] or '', terms[0])) for r in rows]
+
+@app.cli.command('rebuild-fts')
+def rebuild_fts_command():
+    """重建笔记全文索引，用于升级前已存在的数据库或索引损坏时"""
+    init_db()
+    rebuild_fts(get_db())
+    print('全文索引已重建')
+
+# --------- Markdown 渲染缓存 ---------
+MARKDOWN_EXTRAS = ['fenced-code-blocks', 'tables', 'strike', 'math', 'footnotes']
+app.config['MARKDOWN_CACHE_ENTRIES'] = 2048
+app.config['MARKDOWN_CACHE_CHARS'] = 32 * 1024 * 1024   # 内存层按 HTML 字符数限制总量
+app.config['MARKDOWN_PERSIST'] = True                   # 是否把渲染结果持久化到 rendered_html 表
+
+# 内存层：(笔记 ID, 扩展集合) -> (内容哈希, HTML)；内容哈希不一致即视为过期
+render_cache = caching.LRUCache(maxsize=app.config['MARKDOWN_CACHE_ENTRIES'],
+                                maxweight=app.config['MARKDOWN_CACHE_CHARS'],
+                                weigh=lambda entry: len(entry[1]))
+metrics.watch_cache('markdown', render_cache.stats)
+# 命中与未命中只统计查看笔记时的查找；保存时预先渲染只计入 renders
+render_stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'renders': 0}
+
+def current_extras():
+    return MARKDOWN_EXTRAS if session.get('enable_extensions', True) else []
+
+def content_hash(content):
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def store_rendered(note_id, extras, content):
+    """渲染并写入两级缓存，返回 HTML"""
+    extras_key = ','.join(extras)
+    digest = content_hash(content)
+    with perf.timer('markdown'):
+        html = markdown(content, extras=extras)
+    render_stats['renders'] += 1
+    render_cache.set((note_id, extras_key), (digest, html))
+    if app.config['MARKDOWN_PERSIST']:
+        db = get_db()
+        db.execute('INSERT OR REPLACE INTO rendered_html (note_id, extras, content_hash, html) VALUES (?,?,?,?)',
+                   (note_id, extras_key, digest, str(html)))
+        db.commit()
+    return html
+
+def render_note(note, extras):
+    """返回笔记渲染后的 HTML：依次查内存层、rendered_html 表，都未命中才调用 markdown"""
+    content = note['content'] or ''
+    extras_key = ','.join(extras)
+    digest = content_hash(content)
+    cached = render_cache.get((note['id'], extras_key))
+    if cached is not None and cached[0] == digest:
+        render_stats['memory_hits'] += 1
+        return cached[1]
+    if app.config['MARKDOWN_PERSIST']:
+        row = get_db().execute('SELECT html FROM rendered_html WHERE note_id=? AND extras=? AND content_hash=?',
+                               (note['id'], extras_key, digest)).fetchone()
+        if row:
+            render_stats['db_hits'] += 1
+            render_cache.set((note['id'], extras_key), (digest, row['html']))
+            return row['html']
+    render_stats['misses'] += 1
+    return store_rendered(note['id'], extras, content)
+
+def invalidate_rendered(note_id):
+    for extras in (MARKDOWN_EXTRAS, []):
+        render_cache.invalidate((note_id, ','.join(extras)))
+    if app.config['MARKDOWN_PERSIST']:
+        get_db().execute('DELETE FROM rendered_html WHERE note_id=?', (note_id,))
+
+def render_cache_stats():
+    """渲染缓存命中率（内存层 + 持久层）"""
+    hits = render_stats['memory_hits'] + render_stats['db_hits']
+    total = hits + render_stats['misses']
+    stats = dict(render_stats, memory=render_cache.stats())
+    stats['hit_rate'] = round(hits / total, 4) if total else 0.0
+    return stats
 
 # --------- 验证码 ---------
 def generate_captcha_text(length=4):
     return ''.join(random.choices('0123456789', k=length))
 
+# 字体只在启动时加载一次
+CAPTCHA_FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'captcha_font', 'Arial.ttf')
+try:
+    captcha_font = ImageFont.truetype(CAPTCHA_FONT_PATH, 30)
+except OSError:
+    captcha_font = ImageFont.load_default()
+
 def generate_captcha_image(text):
     img = Image.new('RGB', (100, 40), color=(0,0,0))
     draw = ImageDraw.Draw(img)
-    font_path = os.path.join(os.path.dirname(__file__), 'captcha_font', 'Arial.ttf')
-    try:
-        font = ImageFont.truetype(font_path, 30)
-    except:
-        font = ImageFont.load_default()
-    draw.text((10, 3), text, font=font, fill=(220,20,60))
+    draw.text((10, 3), text, font=captcha_font, fill=(220,20,60))
     for _ in range(5):
         x1,y1=random.randint(0,100), random.randint(0,40)
         x2,y2=random.randint(0,100), random.randint(0,40)
         draw.line((x1,y1,x2,y2), fill=(180,20,30), width=1)
     return img
 
+def render_captcha():
+    text = generate_captcha_text()
+    return text, captcha_pool.png_bytes(generate_captcha_image(text))
+
+# 预先渲染的验证码池，低于水位线时由后台线程补充
+app.config['CAPTCHA_POOL_SIZE'] = 64
+app.config['CAPTCHA_LOW_WATERMARK'] = 16
+captcha_images = captcha_pool.CaptchaPool(render_captcha, size=app.config['CAPTCHA_POOL_SIZE'],
+                                          low_watermark=app.config['CAPTCHA_LOW_WATERMARK'])
+metrics.watch_cache('captcha_pool', captcha_images.stats)
+
+# 令牌模式：CAPTCHA_MODE = 'token' 时验证码不写会话，匿名访问者不会在服务器上留下会话文件
+app.config['CAPTCHA_MODE'] = 'session'       # 'session' 或 'token'
+app.config['CAPTCHA_TOKEN_TTL'] = 300        # 令牌有效期（秒）
+captcha_tokens = captcha_pool.CaptchaTokens(app.config['SECRET_KEY'], ttl=app.config['CAPTCHA_TOKEN_TTL'],
+                                            replay=captcha_pool.SQLiteReplaySet(DATABASE))
+
+def token_captcha():
+    return app.config['CAPTCHA_MODE'] == 'token'
+
+def captcha_context():
+    """表单模板所需的验证码参数；令牌模式下每次渲染签发一个新令牌"""
+    if token_captcha():
+        token = captcha_tokens.issue()
+        return dict(captcha_token=token, captcha_src=url_for('captcha', t=token))
+    return dict(captcha_token=None, captcha_src=url_for('captcha'))
+
+def check_captcha(answer):
+    if token_captcha():
+        return captcha_tokens.verify(request.form.get('captcha_token', ''), answer)
+    return 'captcha' in session and answer.lower()==session['captcha'].lower()
+
 @app.route('/captcha')
 def captcha():
-    text = generate_captcha_text()
+    token = request.args.get('t')
+    if token:
+        text = captcha_tokens.answer(token)
+        if text is None:
+            abort(404)
+        with perf.timer('captcha'):
+            png = captcha_pool.png_bytes(generate_captcha_image(text))
+        return send_file(io.BytesIO(png), mimetype='image/png', max_age=0)
+    with perf.timer('captcha'):
+        text, png = captcha_images.pop()
     session['captcha'] = text
-    img = generate_captcha_image(text)
-    buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    buf.seek(0)
-    return send_file(buf, mimetype='image/png')
+    return send_file(io.BytesIO(png), mimetype='image/png')
+
+def captcha_pool_stats():
+    """验证码池深度与生成速率"""
+    return captcha_images.stats()
+
+def session_stats():
+    """会话读写次数、跳过的写入与缓存命中率"""
+    return app.session_interface.stats()
 
 # --------- 用户函数 ---------
 def get_user_by_username(username):
@@ -96,24 +349,74 @@ def get_user_by_id(user_id):
     db = get_db()
     return db.execute('SELECT * FROM users WHERE id=?', (user_id,)).fetchone()
 
+# 登录后会话中保存签名的身份声明 [id, 用户名, 密码版本, 签发时间, 签名]，大多数请求不必查询 users 表；
+# 声明超过 IDENTITY_REVALIDATE 秒后重新查库核对，用户被删除或密码变更后旧声明随之失效
+app.config['IDENTITY_CLAIMS'] = True
+app.config['IDENTITY_REVALIDATE'] = 300
+claim_key = hmac.new(app.config['SECRET_KEY'].encode('utf-8'), b'identity-claim', hashlib.sha256).digest()
+
+def password_version(user):
+    """密码哈希的摘要，密码改变后随之改变"""
+    return hashlib.sha256(user['password'].encode('utf-8')).hexdigest()[:16]
+
+def sign_claim(payload):
+    message = '\x1f'.join(str(value) for value in payload).encode('utf-8')
+    return hmac.new(claim_key, message, hashlib.sha256).hexdigest()
+
+def issue_claim(user):
+    payload = [user['id'], user['username'], password_version(user), int(time.time())]
+    session['identity'] = payload + [sign_claim(payload)]
+
+def read_claim(user_id):
+    """校验会话中的身份声明，返回 (用户名, 密码版本, 签发时间)；无效或不属于 user_id 时返回 None"""
+    try:
+        uid, username, version, issued, signature = session.get('identity')
+    except (TypeError, ValueError):
+        return None
+    if uid != user_id or not hmac.compare_digest(str(signature), sign_claim([uid, username, version, issued])):
+        return None
+    return username, version, issued
+
+def load_identity():
+    """解析当前请求的用户，返回 {'id', 'username'}；声明过期时查库核对并重新签发"""
+    uid = session.get('user_id')
+    if not uid:
+        return None
+    claim = read_claim(uid) if app.config['IDENTITY_CLAIMS'] else None
+    if claim and time.time() - claim[2] < app.config['IDENTITY_REVALIDATE']:
+        return {'id': uid, 'username': claim[0]}
+    user = get_user_by_id(uid)
+    if user is None or (claim and claim[1] != password_version(user)):
+        logout_user()
+        return None
+    if app.config['IDENTITY_CLAIMS']:
+        issue_claim(user)
+    return {'id': user['id'], 'username': user['username']}
+
 def login_user(user):
     session['user_id'] = user['id']
+    if app.config['IDENTITY_CLAIMS']:
+        issue_claim(user)
+    g._identity = {'id': user['id'], 'username': user['username']}
 
 def logout_user():
     session.pop('user_id', None)
+    session.pop('identity', None)
+    g._identity = None
 
 def current_user():
-    uid = session.get('user_id')
-    if uid:
-        return get_user_by_id(uid)
-    return None
+    """当前登录用户，每个请求最多解析一次，结果保存在 g 中"""
+    if '_identity' not in g:
+        g._identity = load_identity()
+    return g._identity
 
 def login_required(f):
     from functools import wraps
     @wraps(f)
     def decorated(*args, **kwargs):
         if not current_user():
-            flash('请先登录', 'warning')
+            if not token_captcha():
+                flash('请先登录', 'warning')
             return redirect(url_for('login', next=request.path))
         return f(*args, **kwargs)
     return decorated
@@ -128,15 +431,49 @@ def get_note(note_id, user_id):
     db = get_db()
     return db.execute('SELECT * FROM notes WHERE id=? AND user_id=?',(note_id,user_id)).fetchone()
 
+def list_notes(user_id, before=None):
+    """
+    键集分页：按 id 倒序取 id < before 的一页，返回 (笔记, 下一页的 before)。
+    不用 OFFSET，也不读取正文，任何一页的代价都相同。
+    """
+    limit = app.config['NOTES_PAGE_SIZE']
+    preview = app.config['NOTE_PREVIEW_CHARS']
+    if preview:
+        sql = 'SELECT id, title, substr(content, 1, ?) AS preview FROM notes WHERE user_id=?'
+        params = [preview, user_id]
+    else:
+        sql = 'SELECT id, title FROM notes WHERE user_id=?'
+        params = [user_id]
+    if before:
+        sql += ' AND id<?'
+        params.append(before)
+    rows = get_db().execute(sql + ' ORDER BY id DESC LIMIT ?', params + [limit + 1]).fetchall()
+    # 多取一行只用来判断是否还有下一页
+    next_before = rows[limit - 1]['id'] if len(rows) > limit else None
+    return rows[:limit], next_before
+
+def render_form(template, error=None):
+    """渲染登录/注册表单；令牌模式下提示直接显示在页面上，不经过 flash 写会话"""
+    notice=None
+    if not token_captcha():
+        if error:
+            flash(error,'danger')
+            error=None
+    elif request.args.get('registered'):
+        notice='注册成功，请登录'
+    elif request.args.get('next'):
+        notice='请先登录'
+    return render_template(template, error=error, notice=notice, **captcha_context())
+
 # --------- 路由 ---------
 
 @app.route('/')
 @login_required
 def index():
     user = current_user()
-    db = get_db()
-    notes = db.execute('SELECT * FROM notes WHERE user_id=? ORDER BY id DESC', (user['id'],)).fetchall()
-    return render_template_string(index_html, notes=notes)
+    before = request.args.get('before', type=int)
+    notes, next_before = list_notes(user['id'], before)
+    return render_template('index.html', notes=notes, before=before, next_before=next_before)
 
 @app.route('/register', methods=['GET','POST'])
 def register():
@@ -156,24 +493,25 @@ def register():
             error='两次密码输入不一致'
         elif len(password)<6:
             error='密码长度至少6位'
-        elif 'captcha' not in session or captcha.lower()!=session['captcha'].lower():
+        elif not check_captcha(captcha):
             error='验证码错误'
         elif get_user_by_username(username):
             error='用户名已存在'
         if error:
-            flash(error,'danger')
-            return render_template_string(register_html)
+            return render_form('register.html', error)
         pw_hash = generate_password_hash(password)
         db = get_db()
         try:
             db.execute('INSERT INTO users (username, password) VALUES (?,?)',(username, pw_hash))
             db.commit()
+            if token_captcha():
+                # 认证成功之前不写会话，提示信息通过查询参数带到登录页
+                return redirect(url_for('login', registered=1))
             flash('注册成功，请登录', 'success')
             return redirect(url_for('login'))
         except sqlite3.IntegrityError:
-            flash('用户名已存在','danger')
-            return render_template_string(register_html)
-    return render_template_string(register_html)
+            return render_form('register.html', '用户名已存在')
+    return render_form('register.html')
 
 @app.route('/login', methods=['GET','POST'])
 def login():
@@ -188,7 +526,7 @@ def login():
             error='所有字段必须填写'
         elif not USERNAME_RE.match(username):
             error='用户名只能由字母和数字组成'
-        elif 'captcha' not in session or captcha.lower()!=session['captcha'].lower():
+        elif not check_captcha(captcha):
             error='验证码错误'
         else:
             user = get_user_by_username(username)
@@ -200,9 +538,8 @@ def login():
             else:
                 error='用户名或密码错误'
         if error:
-            flash(error,'danger')
-            return render_template_string(login_html)
-    return render_template_string(login_html)
+            return render_form('login.html', error)
+    return render_form('login.html')
 
 @app.route('/logout')
 @login_required
@@ -219,13 +556,15 @@ def note_new():
         content = request.form.get('content','').strip()
         if not title:
             flash('标题不能为空','warning')
-            return render_template_string(note_edit_html, mode='新建', title=title, content=content)
+            return render_template('note_edit.html', mode='新建', title=title, content=content)
         db = get_db()
-        db.execute('INSERT INTO notes (user_id,title,content) VALUES (?,?,?)', (current_user()['id'], title, content))
+        cur = db.execute('INSERT INTO notes (user_id,title,content) VALUES (?,?,?)', (current_user()['id'], title, content))
         db.commit()
+        # 保存时按当前扩展设置预先渲染，首次阅览即可命中缓存
+        store_rendered(cur.lastrowid, current_extras(), content)
         flash('笔记创建成功','success')
         return redirect(url_for('index'))
-    return render_template_string(note_edit_html, mode='新建')
+    return render_template('note_edit.html', mode='新建')
 
 @app.route('/note/<int:note_id>/edit', methods=['GET','POST'])
 @login_required
@@ -239,13 +578,15 @@ def note_edit(note_id):
         content=request.form.get('content','').strip()
         if not title:
             flash('标题不能为空','warning')
-            return render_template_string(note_edit_html, mode='编辑', note=note)
+            return render_template('note_edit.html', mode='编辑', note=note)
         db = get_db()
         db.execute('UPDATE notes SET title=?, content=? WHERE id=? AND user_id=?', (title, content, note_id, current_user()['id']))
+        invalidate_rendered(note_id)
         db.commit()
+        store_rendered(note_id, current_extras(), content)
         flash('笔记更新成功','success')
         return redirect(url_for('index'))
-    return render_template_string(note_edit_html, mode='编辑', note=note)
+    return render_template('note_edit.html', mode='编辑', note=note)
 
 @app.route('/note/<int:note_id>/delete', methods=['POST'])
 @login_required
@@ -256,6 +597,7 @@ def note_delete(note_id):
     else:
         db = get_db()
         db.execute('DELETE FROM notes WHERE id=? AND user_id=?', (note_id, current_user()['id']))
+        invalidate_rendered(note_id)
         db.commit()
         flash('笔记已删除','info')
     return redirect(url_for('index'))
@@ -286,12 +628,15 @@ def note_view(note_id):
         return redirect(url_for('index'))
     font = request.args.get('font', 'serif')
     enable_ext = session.get('enable_extensions', True)
-    if enable_ext:
-        extras=['fenced-code-blocks', 'tables', 'strike', 'math', 'footnotes']
-    else:
-        extras=[]
-    html_content = markdown(note['content'] or '', extras=extras)
-    return render_template_string(note_view_html, note=note, content=html_content, font_family=font, extensions_enabled=enable_ext)
+    html_content = render_note(note, current_extras())
+    return render_template('note_view.html', note=note, content=html_content, font_family=font, extensions_enabled=enable_ext)
+
+@app.route('/search')
+@login_required
+def search():
+    q = request.args.get('q', '').strip()
+    results = search_notes(current_user()['id'], q) if q else []
+    return render_template('search.html', q=q, results=results)
 
 @app.route('/toggle_extensions')
 @login_required
@@ -391,6 +736,10 @@ base_html = '''
             flex-wrap: wrap;
             align-items: center;
         }
+        mark {
+            background-color: #550000;
+            color: #ffd0d0;
+        }
         .font-select select {
             background-color: #222;
             color: #ff4c4c;
@@ -415,6 +764,7 @@ base_html = '''
             启用扩展功能
         {% endif %}
     </a> |
+    <a href="{{ url_for('search') }}">搜索</a> |
     <a href="{{ url_for('logout') }}">登出</a>
 {% else %}
     <a href="{{ url_for('login') }}">登录</a> |
@@ -429,6 +779,8 @@ base_html = '''
         {% endfor %}
     {% endif %}
 {% endwith %}
+{% if error %}<div class="flash flash-danger">{{ error }}</div>{% endif %}
+{% if notice %}<div class="flash flash-info">{{ notice }}</div>{% endif %}
 
 {% block content %}{% endblock %}
 </div>
@@ -438,7 +790,7 @@ base_html = '''
 '''
 
 register_html = '''
-{% extends base_html %}
+{% extends 'base.html' %}
 {% block title %}注册{% endblock %}
 {% block content %}
 <h2 class="mb-4">用户注册</h2>
@@ -460,7 +812,12 @@ register_html = '''
       <label for="captcha" class="form-label">验证码</label>
       <input id="captcha" name="captcha" type="text" minlength="4" maxlength="4" class="form-control" style="width: 100px;" required>
     </div>
-    <img src="{{ url_for('captcha') }}" alt="验证码" class="captcha-img ms-3" title="点击刷新" onclick="this.src='{{ url_for('captcha') }}?'+Math.random()" />
+    {% if captcha_token %}
+    <input type="hidden" name="captcha_token" value="{{ captcha_token }}">
+    <img src="{{ captcha_src }}" alt="验证码" class="captcha-img ms-3" title="点击刷新" onclick="location.replace(location.href)" />
+    {% else %}
+    <img src="{{ captcha_src }}" alt="验证码" class="captcha-img ms-3" title="点击刷新" onclick="this.src='{{ url_for('captcha') }}?'+Math.random()" />
+    {% endif %}
   </div>
   <button type="submit" class="btn btn-danger">注册</button>
 </form>
@@ -468,7 +825,7 @@ register_html = '''
 '''
 
 login_html = '''
-{% extends base_html %}
+{% extends 'base.html' %}
 {% block title %}登录{% endblock %}
 {% block content %}
 <h2 class="mb-4">用户登录</h2>
@@ -486,7 +843,12 @@ login_html = '''
       <label for="captcha" class="form-label">验证码</label>
       <input id="captcha" name="captcha" type="text" minlength="4" maxlength="4" class="form-control" style="width: 100px;" required>
     </div>
-    <img src="{{ url_for('captcha') }}" alt="验证码" class="captcha-img ms-3" title="点击刷新" onclick="this.src='{{ url_for('captcha') }}?'+Math.random()" />
+    {% if captcha_token %}
+    <input type="hidden" name="captcha_token" value="{{ captcha_token }}">
+    <img src="{{ captcha_src }}" alt="验证码" class="captcha-img ms-3" title="点击刷新" onclick="location.replace(location.href)" />
+    {% else %}
+    <img src="{{ captcha_src }}" alt="验证码" class="captcha-img ms-3" title="点击刷新" onclick="this.src='{{ url_for('captcha') }}?'+Math.random()" />
+    {% endif %}
   </div>
   <button type="submit" class="btn btn-danger">登录</button>
 </form>
@@ -494,12 +856,12 @@ login_html = '''
 '''
 
 index_html = '''
-{% extends base_html %}
+{% extends 'base.html' %}
 {% block title %}笔记列表{% endblock %}
 {% block content %}
 <h2 class="mb-4">笔记列表</h2>
 
-{% if notes|length == 0 %}
+{% if notes|length == 0 and not before %}
   <p>还没有笔记，<a href="{{ url_for('note_new') }}">新建一个</a></p>
 {% else %}
 <table class="table table-striped table-dark align-middle">
@@ -512,7 +874,10 @@ index_html = '''
   <tbody>
     {% for note in notes %}
     <tr>
-      <td>{{ note['title'] }}</td>
+      <td>
+        {{ note['title'] }}
+        {% if note['preview'] is defined and note['preview'] %}<div class="small text-muted">{{ note['preview'] }}</div>{% endif %}
+      </td>
       <td>
         <a href="{{ url_for('note_view', note_id=note['id']) }}" class="btn btn-sm btn-outline-danger me-1">阅览</a>
         <a href="{{ url_for('note_edit', note_id=note['id']) }}" class="btn btn-sm btn-outline-danger me-1">编辑</a>
@@ -529,12 +894,17 @@ index_html = '''
     {% endfor %}
   </tbody>
 </table>
+<nav class="mb-4">
+  {% if before %}<a href="{{ url_for('index') }}">第一页</a>{% endif %}
+  {% if before and next_before %} | {% endif %}
+  {% if next_before %}<a href="{{ url_for('index', before=next_before) }}">下一页</a>{% endif %}
+</nav>
 {% endif %}
 {% endblock %}
 '''
 
 note_edit_html = '''
-{% extends base_html %}
+{% extends 'base.html' %}
 {% block title %}{{ mode }} 笔记{% endblock %}
 {% block content %}
 <h2 class="mb-4">{{ mode }} 笔记</h2>
@@ -555,7 +925,7 @@ note_edit_html = '''
 '''
 
 note_view_html = '''
-{% extends base_html %}
+{% extends 'base.html' %}
 {% block head %}
 <style>
 .note-content {
@@ -604,6 +974,43 @@ function changeFont() {
 {% endblock %}
 '''
 
+search_html = '''
+{% extends 'base.html' %}
+{% block title %}搜索笔记{% endblock %}
+{% block content %}
+<h2 class="mb-4">搜索笔记</h2>
+<form method="get" action="{{ url_for('search') }}" class="form-inline mb-4">
+  <input type="text" name="q" value="{{ q }}" class="form-control" style="max-width: 360px;" placeholder="输入关键词" required>
+  <button type="submit" class="btn btn-danger">搜索</button>
+</form>
+{% if q %}
+  {% if results %}
+  <ul class="list-unstyled">
+    {% for r in results %}
+    <li class="mb-3">
+      <a href="{{ url_for('note_view', note_id=r.id) }}">{{ r.title }}</a>
+      <div class="small">{{ r.snippet }}</div>
+    </li>
+    {% endfor %}
+  </ul>
+  {% else %}
+  <p>没有找到匹配的笔记。</p>
+  {% endif %}
+{% endif %}
+{% endblock %}
+'''
+
+# 启动时统一编译，之后按名称渲染
+template_registry.register_templates(app, {
+    'base.html': base_html,
+    'register.html': register_html,
+    'login.html': login_html,
+    'index.html': index_html,
+    'note_edit.html': note_edit_html,
+    'note_view.html': note_view_html,
+    'search.html': search_html,
+}, bytecode_dir=app.config['TEMPLATE_BYTECODE_DIR'])
+
 # --------- 启动 ---------
 
 if __name__ == '__main__':
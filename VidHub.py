@@ -1,7 +1,14 @@
 import os
 import random
 import string
-from flask import Flask, request, redirect, url_for, render_template_string, flash, jsonify, session, send_from_directory
+import hashlib
+import secrets
+import shutil
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from flask import Flask, request, redirect, url_for, render_template, flash, jsonify, session, abort
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_wtf import FlaskForm, CSRFProtect
@@ -9,9 +16,19 @@ from wtforms import StringField, PasswordField, SubmitField, FileField
 from wtforms.validators import DataRequired, Length, EqualTo
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 from PIL import Image, ImageDraw, ImageFont
-from io import BytesIO
 import base64
+import mimetypes
+import lcs_engine
+import caching
+import template_registry
+import captcha as captcha_pool
+import media_stream
+import media_pipeline
+import blob_store
+import perf
+import metrics
 
 # 创建 Flask 应用
 app = Flask(__name__)
@@ -21,7 +38,33 @@ app.config['SECRET_KEY'] = 'your_secret_key'  # 请替换为您的密钥
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'  # 数据库 URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # 关闭追踪修改
 app.config['UPLOAD_FOLDER'] = 'uploads'  # 文件上传目录
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 最大上传文件大小为 100MB
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 单个请求体上限；视频分片上传，不受此限制
+app.config['MAX_UPLOAD_SIZE'] = 4 * 1024 * 1024 * 1024  # 单个视频文件的大小上限（4GB）
+app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024  # 每个分片的最大字节数
+app.config['UPLOAD_SESSION_TTL'] = 24 * 3600  # 未完成的上传会话在无活动多久后清理（秒）
+app.config['UPLOAD_CLAIM_TIMEOUT'] = 600  # 写入分片的请求多久没有完成即视为已中断，其他请求可以接手（秒）
+app.config['VIDEO_OFFLOAD'] = None  # 视频发送方式：None 由 Python 发送，'x-accel'（nginx）或 'x-sendfile'（Apache、lighttpd）
+app.config['VIDEO_ACCEL_PREFIX'] = '/protected_uploads/'  # x-accel 模式下指向 UPLOAD_FOLDER 的 nginx internal location
+app.config['VIDEO_MAX_AGE'] = 3600  # 视频响应的浏览器缓存时间（秒）
+app.config['THUMBNAIL_FOLDER'] = 'thumbnails'  # 视频封面目录
+app.config['MEDIA_WORKERS'] = 2  # 后台提取元数据与封面的线程数
+app.config['SEARCH_RESULT_LIMIT'] = 50  # 用户搜索最多返回的条数
+app.config['USER_CACHE_SIZE'] = 1024  # 用户缓存容量
+app.config['USER_CACHE_TTL'] = 300  # 用户缓存过期时间（秒）
+app.config['TEMPLATE_BYTECODE_DIR'] = None  # 模板字节码缓存目录，设置后加快新 worker 的冷启动
+app.config['CAPTCHA_POOL_SIZE'] = 64  # 预先渲染的验证码数量
+app.config['CAPTCHA_LOW_WATERMARK'] = 16  # 验证码池低于该数量时后台补充
+app.config['PERF_ENABLED'] = False  # 请求级性能采样（见 perf.py），关闭时不注册任何钩子
+app.config['PERF_SLOW_MS'] = 500  # 耗时超过该毫秒数的请求记入慢请求日志
+app.config['PERF_SLOW_QUERIES'] = 50  # SQL 条数超过该值的请求记入慢请求日志
+app.config['PERF_SLOW_QUERY_MS'] = 100  # 单条 SQL 超过该毫秒数时记入慢查询日志
+app.config['PERF_SERVER_TIMING'] = False  # 在响应头 Server-Timing 中附带分项耗时，只应在调试时打开
+app.config['METRICS_ENABLED'] = False  # Prometheus 指标（见 metrics.py），/metrics 输出所有 worker 的合计
+app.config['METRICS_DATABASE'] = 'metrics.db'  # 各 worker 定期把增量合并进这个共享的 SQLite 文件
+app.config['METRICS_FLUSH_INTERVAL'] = 5  # 合并间隔（秒）
+app.config['METRICS_TOKEN'] = None  # 抓取时须带 "Authorization: Bearer <令牌>"；为 None 时只允许本机直接访问
+perf.install(app)
+metrics.install(app)
 
 # 初始化扩展
 db = SQLAlchemy(app)  # 数据库
@@ -32,11 +75,21 @@ csrf = CSRFProtect(app)  # CSRF 防护
 # 设置允许上传的文件扩展名
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'wmv'}
 
+# 跨请求的用户缓存，缓存的是列值快照而不是绑定在某个会话上的实例
+user_cache = caching.LRUCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+metrics.watch_cache('user', user_cache.stats)
+
 # 加载用户的回调函数
 @login_manager.user_loader
 def load_user(user_id):
-    """根据用户 ID 加载用户对象"""
-    return User.query.get(int(user_id))
+    """根据用户 ID 加载用户对象，命中缓存时不查询数据库"""
+    data = user_cache.get(int(user_id))
+    if data is not None:
+        return caching.orm_restore(db.session, User, data)
+    user = User.query.get(int(user_id))
+    if user is not None:
+        user_cache.set(user.id, caching.orm_snapshot(user))
+    return user
 
 # 数据库模型
 class User(db.Model, UserMixin):
@@ -59,7 +112,49 @@ class Video(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(150), nullable=False)  # 视频标题
     filename = db.Column(db.String(150), nullable=False)  # 文件名
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)  # 所属用户 ID
+    sha256 = db.Column(db.String(64), db.ForeignKey('blob.sha256'), index=True)  # 引用的 Blob（文件内容的 SHA-256）
+    # 以下由后台流水线在上传后填写，列表页直接读取，不再访问文件
+    meta_status = db.Column(db.String(10), default='pending', index=True)  # pending / ready / failed；进程启动时按此列找出待处理的视频
+    size = db.Column(db.BigInteger)  # 文件字节数
+    duration = db.Column(db.Float)  # 时长（秒）
+    container = db.Column(db.String(100))  # 容器格式
+    codec = db.Column(db.String(50))  # 视频编码
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    poster = db.Column(db.String(150))  # THUMBNAIL_FOLDER 下的封面文件名
+
+class Blob(db.Model):
+    """按内容寻址保存的视频文件；内容相同的多个 Video 共享一个 Blob，refcount 为引用数"""
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+
+class UploadSession(db.Model):
+    """分片上传会话：记录已接收的字节数，全部接收并 finalize 后才登记为 Video"""
+    id = db.Column(db.String(32), primary_key=True)  # 随机会话 ID
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # 所属用户 ID
+    title = db.Column(db.String(150), nullable=False)  # 视频标题
+    filename = db.Column(db.String(150), nullable=False)  # 经过 secure_filename 处理的文件名
+    size = db.Column(db.BigInteger, nullable=False)  # 文件总字节数
+    received = db.Column(db.BigInteger, nullable=False, default=0)  # 已写入磁盘的字节数
+    writer = db.Column(db.String(32))  # 正在写入分片的请求持有的随机令牌，没有请求在写时为空
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # 最后活动时间，按此列清理过期会话
+
+def init_db():
+    """建表，并为升级前已存在的表补上模型中新增的列（ALTER TABLE ADD COLUMN）和索引"""
+    db.create_all()
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.exec_driver_sql('ALTER TABLE "%s" ADD COLUMN "%s" %s' % (
+                        table.name, column.name, column.type.compile(dialect=db.engine.dialect)))
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
 
 # 表单
 class RegistrationForm(FlaskForm):
@@ -78,39 +173,263 @@ class LoginForm(FlaskForm):
     submit = SubmitField('登录')
 
 # 辅助函数
-def generate_captcha():
-    """生成验证码图片及对应的文本"""
+captcha_font = ImageFont.load_default()  # 字体只加载一次
+
+def render_captcha():
+    """渲染一张验证码图片，返回文本及 Base64 编码的 PNG"""
     # 随机生成4位验证码
     captcha_text = ''.join(random.choices(string.ascii_letters + string.digits, k=4))
     # 创建图片
     image = Image.new('RGB', (100, 30), color=(255, 255, 255))
-    font = ImageFont.load_default()
     draw = ImageDraw.Draw(image)
-    draw.text((10, 5), captcha_text, font=font, fill=(0, 0, 0))
+    draw.text((10, 5), captcha_text, font=captcha_font, fill=(0, 0, 0))
     # 将图片转换为 Base64 编码
-    buffer = BytesIO()
-    image.save(buffer, format='png')
-    image_data = base64.b64encode(buffer.getvalue()).decode()
+    image_data = base64.b64encode(captcha_pool.png_bytes(image)).decode()
     return captcha_text, image_data
 
+# 预先渲染的验证码池，由后台线程在低于水位线时补充
+captcha_images = captcha_pool.CaptchaPool(render_captcha, size=app.config['CAPTCHA_POOL_SIZE'],
+                                          low_watermark=app.config['CAPTCHA_LOW_WATERMARK'])
+metrics.watch_cache('captcha_pool', captcha_images.stats)
+
+@perf.timed('captcha')
+def generate_captcha():
+    """从验证码池取出一张验证码图片及对应的文本"""
+    return captcha_images.pop()
+
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# 分片上传：分片直接写入 uploads/.partial/<会话 ID>，finalize 时原地改名，不再复制
+COPY_BLOCK = 64 * 1024  # 从请求流读取、写入磁盘的块大小
+
+# 进程内的增量哈希状态：会话 ID -> (已计算的字节数, sha256 对象)
+upload_hashers = {}
+upload_lock = threading.Lock()
+
+def partial_path(upload_id):
+    """上传中的文件路径"""
+    return os.path.join(app.config['UPLOAD_FOLDER'], '.partial', upload_id)
+
+def upload_error(message, status, **extra):
+    """上传接口统一的错误响应"""
+    return jsonify(dict(status='error', message=message, **extra)), status
+
+def get_upload(upload_id):
+    """当前用户的上传会话，不存在或不属于当前用户时返回 None"""
+    upload = db.session.get(UploadSession, upload_id)
+    if upload is None or upload.user_id != current_user.id:
+        return None
+    return upload
+
+def claim_upload(upload_id, offset):
+    """
+    在数据库中占用上传会话以写入从 offset 开始的分片，返回令牌；偏移量不符或另一个请求正在写入时返回 None。
+    条件 UPDATE 只能有一个请求成功，多个 worker 进程之间同样有效；超过 UPLOAD_CLAIM_TIMEOUT 的占用视为已中断。
+    """
+    token = secrets.token_hex(16)
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=app.config['UPLOAD_CLAIM_TIMEOUT'])
+    claimed = db.session.execute(
+        update(UploadSession)
+        .where(UploadSession.id == upload_id, UploadSession.received == offset,
+               (UploadSession.writer.is_(None)) | (UploadSession.updated_at < stale))
+        .values(writer=token, updated_at=now)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+    return token if claimed.rowcount == 1 else None
+
+def release_upload(upload_id, token, received=None):
+    """
+    释放占用；received 不为空时同时记录新的已接收字节数。
+    返回 False 表示占用已超时并被其他请求接手，本次写入无效。
+    """
+    values = {'writer': None}
+    if received is not None:
+        values['received'] = received
+    released = db.session.execute(
+        update(UploadSession)
+        .where(UploadSession.id == upload_id, UploadSession.writer == token)
+        .values(**values)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+    return released.rowcount == 1
+
+def resume_hasher(upload_id, offset):
+    """
+    取出与 offset 对应的增量哈希状态。
+    状态不在本进程（请求落到了别的 worker、进程重启或上次分片中断）时，从磁盘上已确认的前 offset 字节重新计算。
+    """
+    with upload_lock:
+        state = upload_hashers.pop(upload_id, None)
+    if state is not None and state[0] == offset:
+        return state[1]
+    hasher = hashlib.sha256()
+    remaining = offset
+    with open(partial_path(upload_id), 'rb') as f:
+        while remaining:
+            block = f.read(min(COPY_BLOCK, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+def discard_upload(upload):
+    """删除上传会话及其未完成的文件（由调用方提交事务）"""
+    with upload_lock:
+        upload_hashers.pop(upload.id, None)
+    try:
+        os.remove(partial_path(upload.id))
+    except FileNotFoundError:
+        pass
+    db.session.delete(upload)
+
+def expire_uploads():
+    """清理长时间没有活动的上传会话"""
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['UPLOAD_SESSION_TTL'])
+    for upload in UploadSession.query.filter(UploadSession.updated_at < cutoff).all():
+        discard_upload(upload)
+    db.session.commit()
+
+# 视频文件按内容存放在 uploads/blobs/ 下，相同内容只保存一份
+blobs = blob_store.BlobStore(os.path.join(app.config['UPLOAD_FOLDER'], 'blobs'))
+
+def legacy_video_path(video):
+    """改用内容寻址存储之前的文件位置"""
+    return os.path.join(app.config['UPLOAD_FOLDER'], str(video.user_id), video.filename)
+
+def video_path(video):
+    """视频文件在磁盘上的路径；尚未迁移的旧视频仍在 uploads/<用户 ID>/ 下"""
+    if video.sha256:
+        path = blobs.path(video.sha256)
+        if os.path.exists(path):
+            return path
+    return legacy_video_path(video)
+
+def acquire_blob(digest, size, count=1):
+    """
+    增加 count 次对 Blob 的引用，不存在时创建。
+    要在放置文件之前执行：这条写语句持有 SQLite 写锁直到提交，与 purge_blob 删除最后一个引用互斥。
+    """
+    stmt = sqlite_insert(Blob).values(sha256=digest, size=size, refcount=count)
+    db.session.execute(stmt.on_conflict_do_update(index_elements=[Blob.sha256],
+                                                  set_={'refcount': Blob.refcount + count}))
+
+def reuse_blob(digest, size):
+    """
+    已有相同内容的 Blob 时增加引用并返回 True，用于跳过整个上传。
+    引用数为 0 的行可能正在被 purge_blob 删除文件，不能复用。
+    """
+    result = db.session.execute(update(Blob).where(Blob.sha256 == digest, Blob.size == size, Blob.refcount > 0)
+                                .values(refcount=Blob.refcount + 1))
+    return result.rowcount == 1
+
+def release_blob(digest):
+    """减少一次引用（由调用方提交）；返回 True 表示已没有引用，提交成功后应调用 purge_blob"""
+    db.session.execute(update(Blob).where(Blob.sha256 == digest).values(refcount=Blob.refcount - 1))
+    refcount = db.session.execute(select(Blob.refcount).where(Blob.sha256 == digest)).scalar()
+    return refcount is not None and refcount <= 0
+
+def purge_blob(digest):
+    """
+    在 release_blob 的事务提交之后调用：引用数仍为 0 时删除 Blob 行和文件。
+    DELETE 持有写锁直到提交，期间 acquire_blob 无法为同一内容增加引用。
+    提交失败时留下的是没有文件的 0 引用行：reuse_blob 不会使用它，acquire_blob 之后 put 会重新放入文件。
+    """
+    deleted = db.session.execute(db.delete(Blob).where(Blob.sha256 == digest, Blob.refcount <= 0))
+    if deleted.rowcount:
+        blobs.remove(digest)
+    db.session.commit()
+
+# 上传后的元数据与封面提取
+video_extractor = media_pipeline.default_extractor()
+
+def poster_path(video_id):
+    return os.path.join(app.config['THUMBNAIL_FOLDER'], '%d.jpg' % video_id)
+
+def process_video(video_id):
+    """在工作线程中提取元数据和封面并写回 Video 行"""
+    with app.app_context():
+        video = db.session.get(Video, video_id)
+        # 多个 worker 进程启动时都会补交同一批视频，先处理完的那个之后其余的直接跳过
+        if video is None or video.meta_status == 'ready':
+            return
+        os.makedirs(app.config['THUMBNAIL_FOLDER'], exist_ok=True)
+        if copy_video_metadata(video):
+            db.session.commit()
+            return
+        try:
+            info = video_extractor.extract(video_path(video), poster_path(video.id))
+        except Exception:
+            video.meta_status = 'failed'
+            db.session.commit()
+            raise
+        for key in ('size', 'duration', 'container', 'codec', 'width', 'height'):
+            setattr(video, key, info.get(key))
+        video.poster = '%d.jpg' % video.id if info.get('poster') else None
+        video.meta_status = 'ready'
+        db.session.commit()
+
+def copy_video_metadata(video):
+    """内容相同的视频已经处理过时，直接复用它的元数据和封面"""
+    if not video.sha256:
+        return False
+    source = Video.query.filter(Video.sha256 == video.sha256, Video.id != video.id,
+                                Video.meta_status == 'ready').first()
+    if source is None:
+        return False
+    for key in ('size', 'duration', 'container', 'codec', 'width', 'height'):
+        setattr(video, key, getattr(source, key))
+    video.poster = None
+    if source.poster:
+        shutil.copyfile(os.path.join(app.config['THUMBNAIL_FOLDER'], source.poster), poster_path(video.id))
+        video.poster = '%d.jpg' % video.id
+    video.meta_status = 'ready'
+    return True
+
+def unprocessed_video_ids():
+    """尚未提取元数据的视频；升级前上传的旧视频 meta_status 为空"""
+    query = db.session.query(Video.id).filter((Video.meta_status == 'pending') | (Video.meta_status.is_(None)))
+    return [video_id for (video_id,) in query]
+
+def requeue_videos(jobs):
+    """把尚未处理完的视频重新放入队列（任务只保存在内存中，重启后需要补上）；每个进程启动流水线时调用"""
+    with app.app_context():
+        for video_id in unprocessed_video_ids():
+            jobs.submit(video_id)
+
+media_jobs = media_pipeline.MediaPipeline(process_video, workers=app.config['MEDIA_WORKERS'],
+                                          on_start=requeue_videos)
+
+@app.before_request
+def start_media_jobs():
+    """每个 worker 进程处理第一个请求前启动流水线，不依赖以 __main__ 方式运行"""
+    media_jobs.start()
+
+@app.template_filter('duration')
+def format_duration(seconds):
+    """秒数格式化为 h:mm:ss 或 m:ss；尚未提取元数据（None 或未定义）时为空"""
+    if not isinstance(seconds, (int, float)):
+        return ''
+    minutes, secs = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, secs) if hours else '%d:%02d' % (minutes, secs)
+
+@app.template_filter('filesize')
+def format_filesize(size):
+    """字节数格式化为 KB / MB / GB；未知时为空"""
+    if not isinstance(size, (int, float)):
+        return ''
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return '%d %s' % (size, unit) if unit == 'B' else '%.1f %s' % (size, unit)
+        size /= 1024
+
 def longest_common_subsequence(s1, s2):
     """计算两个字符串的最长公共子序列长度"""
-    m, n = len(s1), len(s2)
-    dp = [0] * (n + 1)
-    for i in range(m):
-        prev = 0
-        for j in range(n):
-            temp = dp[j + 1]
-            if s1[i] == s2[j]:
-                dp[j + 1] = prev + 1
-            else:
-                dp[j + 1] = max(dp[j], dp[j + 1])
-            prev = temp
-    return dp[n]
+    return lcs_engine.lcs_length(s1, s2)
 
 # 路由
 @app.route('/')
@@ -133,20 +452,22 @@ def register():
         # 验证码校验
         if form.captcha.data.lower() != session.get('captcha', '').lower():
             flash('验证码错误', 'danger')
-            return render_template_string(register_template, form=form, captcha_image=captcha_image)
+            return render_template('register.html', form=form, captcha_image=captcha_image)
         # 检查用户名是否已存在
         if User.query.filter_by(username=form.username.data).first():
             flash('用户名已存在', 'danger')
-            return render_template_string(register_template, form=form, captcha_image=captcha_image)
+            return render_template('register.html', form=form, captcha_image=captcha_image)
         # 创建新用户
         new_user = User(username=form.username.data)
         new_user.set_password(form.password.data)
         db.session.add(new_user)
         db.session.commit()
+        # SQLite 可能复用已删除用户的 ID，清掉可能残留的旧缓存
+        user_cache.invalidate(new_user.id)
         flash('注册成功，请登录', 'success')
         return redirect(url_for('login'))
 
-    return render_template_string(register_template, form=form, captcha_image=captcha_image)
+    return render_template('register.html', form=form, captcha_image=captcha_image)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -163,7 +484,7 @@ def login():
         # 验证码校验
         if form.captcha.data.lower() != session.get('captcha', '').lower():
             flash('验证码错误', 'danger')
-            return render_template_string(login_template, form=form, captcha_image=captcha_image)
+            return render_template('login.html', form=form, captcha_image=captcha_image)
         # 检查用户
         user = User.query.filter_by(username=form.username.data).first()
         if user and user.check_password(form.password.data):
@@ -172,7 +493,7 @@ def login():
             return redirect(url_for('dashboard'))
         flash('用户名或密码错误', 'danger')
 
-    return render_template_string(login_template, form=form, captcha_image=captcha_image)
+    return render_template('login.html', form=form, captcha_image=captcha_image)
 
 @app.route('/logout')
 @login_required
@@ -186,41 +507,140 @@ def logout():
 @login_required
 def dashboard():
     """用户主页"""
-    return render_template_string(dashboard_template)
+    return render_template('dashboard.html')
 
-@app.route('/upload', methods=['POST'])
+@app.route('/uploads/sessions', methods=['POST'])
 @login_required
-def upload():
-    """处理视频上传的 AJAX 请求"""
-    file = request.files.get('file')
-    title = request.form.get('title', '').strip()
-    if not file or not title:
-        return jsonify({'status': 'error', 'message': '缺少必要的参数'}), 400
-    if file.filename == '':
-        return jsonify({'status': 'error', 'message': '未选择文件'}), 400
-    if not allowed_file(file.filename):
-        return jsonify({'status': 'error', 'message': '文件类型不允许'}), 400
-
-    # 保存文件
-    filename = secure_filename(file.filename)
-    user_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(current_user.id))
-    os.makedirs(user_folder, exist_ok=True)
-    file_path = os.path.join(user_folder, filename)
-    file.save(file_path)
-
-    # 保存视频信息到数据库
-    new_video = Video(title=title, filename=filename, user_id=current_user.id)
+def create_upload():
+    """
+    创建分片上传会话，请求体为 JSON：title、filename、size，以及可选的 sha256。
+    服务器上已有相同内容时直接登记视频，客户端不必再上传任何数据。
+    （视频本身是公开的，凭哈希取得已有内容不会泄露什么。）
+    """
+    data = request.get_json(silent=True) or {}
+    title = str(data.get('title', '')).strip()
+    filename = secure_filename(str(data.get('filename', '')))
+    size = data.get('size')
+    if not title or not filename or not isinstance(size, int) or size <= 0:
+        return upload_error('缺少必要的参数', 400)
+    if not allowed_file(filename):
+        return upload_error('文件类型不允许', 400)
+    if size > app.config['MAX_UPLOAD_SIZE']:
+        return upload_error('文件过大', 413)
+
+    digest = str(data.get('sha256') or '').lower()
+    if digest and reuse_blob(digest, size):
+        new_video = Video(title=title, filename=filename, user_id=current_user.id, sha256=digest)
+        db.session.add(new_video)
+        db.session.commit()
+        media_jobs.submit(new_video.id)
+        return jsonify({'status': 'success', 'message': '文件上传成功', 'video_id': new_video.id,
+                        'sha256': digest, 'deduplicated': True}), 201
+
+    expire_uploads()
+    upload = UploadSession(id=secrets.token_hex(16), user_id=current_user.id, title=title,
+                           filename=filename, size=size, received=0)
+    os.makedirs(os.path.dirname(partial_path(upload.id)), exist_ok=True)
+    open(partial_path(upload.id), 'wb').close()
+    db.session.add(upload)
+    db.session.commit()
+    with upload_lock:
+        upload_hashers[upload.id] = (0, hashlib.sha256())
+    return jsonify({'status': 'success', 'id': upload.id, 'offset': 0,
+                    'chunk_size': app.config['UPLOAD_CHUNK_SIZE']}), 201
+
+@app.route('/uploads/sessions/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    """查询已接收的字节数，断线后客户端从这里继续上传"""
+    upload = get_upload(upload_id)
+    if upload is None:
+        return upload_error('上传会话不存在', 404)
+    return jsonify({'status': 'success', 'offset': upload.received, 'size': upload.size})
+
+@app.route('/uploads/sessions/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    """写入一个分片：请求体为原始字节，?offset= 必须等于已接收的字节数"""
+    upload = get_upload(upload_id)
+    if upload is None:
+        return upload_error('上传会话不存在', 404)
+    offset = request.args.get('offset', type=int)
+    length = request.content_length
+    if offset != upload.received:
+        return upload_error('偏移量不匹配', 409, offset=upload.received)
+    if length is None:
+        return upload_error('缺少 Content-Length', 411)
+    if length > app.config['UPLOAD_CHUNK_SIZE'] or offset + length > upload.size:
+        return upload_error('分片过大', 413)
+    token = claim_upload(upload_id, offset)
+    if token is None:
+        db.session.refresh(upload)
+        if upload.received != offset:
+            return upload_error('偏移量不匹配', 409, offset=upload.received)
+        return upload_error('该上传的另一个分片正在写入', 409, offset=upload.received)
+    received = None
+    try:
+        hasher = resume_hasher(upload_id, offset)
+        written = 0
+        with open(partial_path(upload_id), 'r+b') as f:
+            # 丢弃上次中断时写了一半的数据
+            f.seek(offset)
+            f.truncate()
+            while written < length:
+                block = request.stream.read(min(COPY_BLOCK, length - written))
+                if not block:
+                    break
+                f.write(block)
+                hasher.update(block)
+                written += len(block)
+        if written != length:
+            # 连接中断，哈希状态已经包含残缺数据，丢弃后下次从磁盘重算
+            return upload_error('分片不完整', 400, offset=offset)
+        received = offset + length
+    finally:
+        released = release_upload(upload_id, token, received)
+    if not released:
+        return upload_error('写入超时，已被其他请求接手', 409)
+    with upload_lock:
+        upload_hashers[upload_id] = (received, hasher)
+    return jsonify({'status': 'success', 'offset': received})
+
+@app.route('/uploads/sessions/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload(upload_id):
+    """全部分片接收完毕后登记视频；可选的 JSON 字段 sha256 用于校验"""
+    upload = get_upload(upload_id)
+    if upload is None:
+        return upload_error('上传会话不存在', 404)
+    if upload.received != upload.size:
+        return upload_error('上传尚未完成', 409, offset=upload.received)
+    digest = resume_hasher(upload_id, upload.size).hexdigest()
+    expected = (request.get_json(silent=True) or {}).get('sha256')
+    if expected and str(expected).lower() != digest:
+        discard_upload(upload)
+        db.session.commit()
+        return upload_error('文件校验失败', 400)
+
+    # 先登记引用再放置文件；内容已存在时丢弃刚上传的副本，否则原地改名移入存储
+    acquire_blob(digest, upload.size)
+    blobs.put(partial_path(upload_id), digest)
+
+    new_video = Video(title=upload.title, filename=upload.filename, user_id=current_user.id, sha256=digest)
     db.session.add(new_video)
+    db.session.delete(upload)
     db.session.commit()
+    # 元数据和封面在后台提取，不阻塞本次请求
+    media_jobs.submit(new_video.id)
 
-    return jsonify({'status': 'success', 'message': '文件上传成功'})
+    return jsonify({'status': 'success', 'message': '文件上传成功', 'video_id': new_video.id, 'sha256': digest})
 
 @app.route('/my_videos')
 @login_required
 def my_videos():
     """显示用户的所有视频"""
     videos = Video.query.filter_by(user_id=current_user.id).all()
-    return render_template_string(my_videos_template, videos=videos)
+    return render_template('my_videos.html', videos=videos)
 
 @app.route('/delete_video', methods=['POST'])
 @login_required
@@ -231,15 +651,21 @@ def delete_video():
     if not video or video.user_id != current_user.id:
         return jsonify({'status': 'error', 'message': '未找到视频或没有权限'}), 400
 
-    # 删除文件
-    user_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(current_user.id))
-    file_path = os.path.join(user_folder, video.filename)
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
-    # 删除数据库记录
+    # 先提交数据库修改，成功后再删除文件；视频文件只在最后一个引用消失时删除
+    orphaned = legacy_path = None
+    if video.sha256 and db.session.get(Blob, video.sha256) is not None:
+        if release_blob(video.sha256):
+            orphaned = video.sha256
+    else:
+        legacy_path = legacy_video_path(video)
     db.session.delete(video)
     db.session.commit()
+    if orphaned:
+        purge_blob(orphaned)
+    if legacy_path and os.path.exists(legacy_path):
+        os.remove(legacy_path)
+    if os.path.exists(poster_path(video.id)):
+        os.remove(poster_path(video.id))
 
     return jsonify({'status': 'success', 'message': '视频已删除'})
 
@@ -251,14 +677,72 @@ def play_video(video_id):
         flash('视频不存在', 'danger')
         return redirect(url_for('index'))
 
-    user_id = video.user_id
-    video_url = url_for('uploaded_file', user_id=user_id, filename=video.filename)
-    return render_template_string(play_video_template, video=video, video_url=video_url)
+    video_url = url_for('video_file', video_id=video.id)
+    return render_template('play_video.html', video=video, video_url=video_url)
+
+@app.route('/videos/<int:video_id>/file')
+def video_file(video_id):
+    """提供视频文件供播放，支持范围请求；只发送数据库中登记过的视频"""
+    video = db.session.get(Video, video_id)
+    if video is None:
+        abort(404)
+    path = video_path(video)
+    if not os.path.isfile(path):
+        abort(404)
+    return media_stream.send_media(
+        path, mimetype=mimetypes.guess_type(video.filename)[0], etag=video.sha256,
+        offload=app.config['VIDEO_OFFLOAD'],
+        accel_path=app.config['VIDEO_ACCEL_PREFIX'] + os.path.relpath(path, app.config['UPLOAD_FOLDER']).replace(os.sep, '/'),
+        max_age=app.config['VIDEO_MAX_AGE'])
+
+@app.route('/thumbnails/<int:video_id>.jpg')
+def video_poster(video_id):
+    """视频封面"""
+    video = db.session.get(Video, video_id)
+    if video is None or not video.poster:
+        abort(404)
+    return media_stream.send_media(os.path.join(app.config['THUMBNAIL_FOLDER'], video.poster),
+                                   mimetype='image/jpeg', max_age=app.config['VIDEO_MAX_AGE'])
 
-@app.route('/uploads/<int:user_id>/<filename>')
-def uploaded_file(user_id, filename):
-    """提供上传的文件供播放"""
-    return send_from_directory(os.path.join(app.config['UPLOAD_FOLDER'], str(user_id)), filename)
+@app.cli.command('process-videos')
+def process_videos_command():
+    """为尚未处理的视频提取元数据和封面（同步执行，用于补齐旧数据）"""
+    init_db()
+    video_ids = unprocessed_video_ids()
+    for video_id in video_ids:
+        process_video(video_id)
+    print('已处理 %d 个视频' % len(video_ids))
+
+@app.cli.command('migrate-blobs')
+def migrate_blobs_command():
+    """把 uploads/<用户 ID>/ 下的旧视频移入内容寻址存储，并建立引用计数"""
+    init_db()
+    # 多条记录可能指向同一个旧文件：每个文件只哈希、移动一次，引用数等于记录数
+    legacy = {}
+    for video in Video.query.all():
+        if video.sha256 and blobs.exists(video.sha256) and db.session.get(Blob, video.sha256):
+            continue
+        legacy.setdefault(legacy_video_path(video), []).append(video)
+    moved = 0
+    for path, videos in legacy.items():
+        if os.path.isfile(path):
+            digest = blob_store.hash_file(path)
+            acquire_blob(digest, os.path.getsize(path), count=len(videos))
+            blobs.put(path, digest)
+        else:
+            # 旧版本的迁移只处理了共用同一文件的第一条记录，其余记录改用它的 Blob
+            migrated = Video.query.filter(Video.user_id == videos[0].user_id, Video.filename == videos[0].filename,
+                                          Video.sha256.isnot(None)).first()
+            if migrated is None or not blobs.exists(migrated.sha256):
+                print('找不到视频 %s 的文件：%s' % (', '.join(str(video.id) for video in videos), path))
+                continue
+            digest = migrated.sha256
+            acquire_blob(digest, os.path.getsize(blobs.path(digest)), count=len(videos))
+        for video in videos:
+            video.sha256 = digest
+        db.session.commit()
+        moved += len(videos)
+    print('已迁移 %d 个视频' % moved)
 
 @app.route('/search')
 def search():
@@ -267,14 +751,13 @@ def search():
     users = []
     if query:
         all_users = User.query.all()
-        # 使用最长公共子序列算法排序用户
-        users = sorted(
-            all_users,
-            key=lambda u: -longest_common_subsequence(query.lower(), u.username.lower())
-        )
-        users = [u for u in users if longest_common_subsequence(query.lower(), u.username.lower()) > 0]
+        # 使用最长公共子序列算法排序用户，只保留得分最高的若干个
+        with perf.timer('lcs'):
+            ranked = lcs_engine.top_k(query.lower(), all_users, lambda u: u.username.lower(),
+                                      limit=app.config['SEARCH_RESULT_LIMIT'])
+        users = [u for score, u in ranked]
 
-    return render_template_string(search_results_template, users=users, query=query)
+    return render_template('search_results.html', users=users, query=query)
 
 @app.route('/user_videos/<int:user_id>')
 def user_videos(user_id):
@@ -285,7 +768,7 @@ def user_videos(user_id):
         return redirect(url_for('index'))
 
     videos = Video.query.filter_by(user_id=user_id).all()
-    return render_template_string(user_videos_template, user=user, videos=videos)
+    return render_template('user_videos.html', user=user, videos=videos)
 
 # 模板字符串
 register_template = '''
@@ -390,29 +873,77 @@ dashboard_template = '''
         </div>
         <button type="submit" class="btn btn-success">上传</button>
     </form>
+    <div class="progress mt-3" style="display: none;">
+        <div id="uploadProgress" class="progress-bar" role="progressbar" style="width: 0%;">0%</div>
+    </div>
     <div id="uploadStatus"></div>
 </div>
 <script src="https://code.jquery.com/jquery-3.5.1.min.js"></script>
 <script>
+// 分片上传：创建会话 -> 按偏移量逐片 PUT -> finalize；断线后按服务器记录的偏移量续传
+var uploadUrl = '{{ url_for('create_upload') }}';
+var csrfToken = '{{ csrf_token() }}';
+var MAX_RETRIES = 5;
+
+function api(method, url, body, contentType) {
+    return fetch(url, {
+        method: method,
+        credentials: 'same-origin',
+        headers: {'X-CSRFToken': csrfToken, 'Content-Type': contentType || 'application/json'},
+        body: body
+    }).then(function(response) {
+        return response.json().then(function(data) {
+            if (!response.ok) {
+                var error = new Error(data.message || '上传失败');
+                error.status = response.status;
+                throw error;
+            }
+            return data;
+        });
+    });
+}
+
+function sleep(ms) {
+    return new Promise(function(resolve) { setTimeout(resolve, ms); });
+}
+
+async function uploadFile(file, title, onProgress) {
+    var session = await api('POST', uploadUrl, JSON.stringify({title: title, filename: file.name, size: file.size}));
+    if (session.deduplicated) return session;
+    var sessionUrl = uploadUrl + '/' + session.id;
+    var offset = session.offset;
+    var failures = 0;
+    while (offset < file.size) {
+        try {
+            var chunk = file.slice(offset, offset + session.chunk_size);
+            offset = (await api('PUT', sessionUrl + '?offset=' + offset, chunk, 'application/octet-stream')).offset;
+            failures = 0;
+            onProgress(offset / file.size);
+        } catch (error) {
+            if (++failures > MAX_RETRIES) throw error;
+            await sleep(1000 * failures);
+            offset = (await api('GET', sessionUrl)).offset;
+        }
+    }
+    return api('POST', sessionUrl + '/finalize', '{}');
+}
+
 $(function() {
     $('#uploadForm').submit(function(event) {
         event.preventDefault();
-        var formData = new FormData(this);
-        $.ajax({
-            url: '{{ url_for('upload') }}',
-            type: 'POST',
-            data: formData,
-            headers: {'X-CSRFToken': '{{ csrf_token() }}'},
-            contentType: false,
-            processData: false,
-            success: function(response) {
-                $('#uploadStatus').html('<div class="alert alert-success">' + response.message + '</div>');
-                $('#uploadForm')[0].reset();
-            },
-            error: function(xhr) {
-                var message = xhr.responseJSON ? xhr.responseJSON.message : '上传失败';
-                $('#uploadStatus').html('<div class="alert alert-danger">' + message + '</div>');
-            }
+        var file = $('#file')[0].files[0];
+        var title = $('#title').val().trim();
+        if (!file || !title) return;
+        var bar = $('#uploadProgress');
+        bar.parent().show();
+        uploadFile(file, title, function(ratio) {
+            var percent = Math.floor(ratio * 100) + '%';
+            bar.css('width', percent).text(percent);
+        }).then(function(response) {
+            $('#uploadStatus').html('<div class="alert alert-success">' + response.message + '</div>');
+            $('#uploadForm')[0].reset();
+        }).catch(function(error) {
+            $('#uploadStatus').html('<div class="alert alert-danger">' + (error.message || '上传失败') + '</div>');
         });
     });
 });
@@ -437,14 +968,26 @@ my_videos_template = '''
     <table class="table mt-3">
         <thead>
             <tr>
+                <th>封面</th>
                 <th>标题</th>
+                <th>时长</th>
+                <th>大小</th>
                 <th>操作</th>
             </tr>
         </thead>
         <tbody>
         {% for video in videos %}
             <tr>
+                <td>
+                    {% if video.poster %}
+                    <img src="{{ url_for('video_poster', video_id=video.id) }}" alt="" width="120" loading="lazy">
+                    {% elif video.meta_status == 'pending' %}
+                    <span class="text-muted">处理中</span>
+                    {% endif %}
+                </td>
                 <td>{{ video.title }}</td>
+                <td>{{ video.duration|duration }}</td>
+                <td>{{ video.size|filesize }}</td>
                 <td>
                     <a href="{{ url_for('play_video', video_id=video.id) }}" class="btn btn-success btn-sm">播放</a>
                     <button class="btn btn-danger btn-sm delete-btn" data-id="{{ video.id }}">删除</button>
@@ -495,7 +1038,7 @@ play_video_template = '''
 <body>
 <div class="container">
     <h2 class="mt-4">{{ video.title }}</h2>
-    <video width="640" height="480" controls>
+    <video width="640" height="480" controls preload="metadata"{% if video.poster %} poster="{{ url_for('video_poster', video_id=video.id) }}"{% endif %}>
         <source src="{{ video_url }}" type="video/mp4">
         您的浏览器不支持HTML5视频
     </video>
@@ -552,14 +1095,26 @@ user_videos_template = '''
     <table class="table mt-3">
         <thead>
             <tr>
+                <th>封面</th>
                 <th>标题</th>
+                <th>时长</th>
+                <th>大小</th>
                 <th>操作</th>
             </tr>
         </thead>
         <tbody>
         {% for video in videos %}
             <tr>
+                <td>
+                    {% if video.poster %}
+                    <img src="{{ url_for('video_poster', video_id=video.id) }}" alt="" width="120" loading="lazy">
+                    {% elif video.meta_status == 'pending' %}
+                    <span class="text-muted">处理中</span>
+                    {% endif %}
+                </td>
                 <td>{{ video.title }}</td>
+                <td>{{ video.duration|duration }}</td>
+                <td>{{ video.size|filesize }}</td>
                 <td>
                     <a href="{{ url_for('play_video', video_id=video.id) }}" class="btn btn-success btn-sm">播放</a>
                 </td>
@@ -575,14 +1130,27 @@ user_videos_template = '''
 </html>
 '''
 
+# 注册并预编译页面模板，之后按名称渲染
+template_registry.register_templates(app, {
+    'register.html': register_template,
+    'login.html': login_template,
+    'dashboard.html': dashboard_template,
+    'my_videos.html': my_videos_template,
+    'play_video.html': play_video_template,
+    'search_results.html': search_results_template,
+    'user_videos.html': user_videos_template,
+}, bytecode_dir=app.config['TEMPLATE_BYTECODE_DIR'])
+
 # 应用程序启动
 if __name__ == '__main__':
     # 确保上传目录存在
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-    # 自动创建数据库
+    # 自动创建数据库，并升级旧版数据库的表结构
     with app.app_context():
-        db.create_all()
+        init_db()
+    # 启动后台流水线，未处理完的视频重新排队
+    media_jobs.start()
 
     # 运行应用程序
     app.run(debug=True)
@@ -1,13 +1,22 @@
-from flask import Flask, render_template, redirect, url_for, request, flash, session, send_file
+from flask import Flask, render_template, redirect, url_for, request, flash, session, send_file, g, jsonify, abort
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, TextAreaField, BooleanField
 from wtforms.validators import DataRequired, Length, EqualTo
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+import os
 import sqlite3
 from io import BytesIO
 import random
 import string
+from collections import namedtuple
 from PIL import Image, ImageDraw, ImageFont
+import lcs_engine
+import search_index
+import sqlite_pool
+import caching
+import captcha as captcha_pool
+import perf
+import metrics
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key'
@@ -16,14 +25,66 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# 请求级性能采样（见 perf.py）：关闭时不注册任何钩子
+app.config['PERF_ENABLED'] = False
+# 耗时超过 PERF_SLOW_MS 毫秒或 SQL 超过 PERF_SLOW_QUERIES 条的请求记入慢请求日志
+app.config['PERF_SLOW_MS'] = 500
+app.config['PERF_SLOW_QUERIES'] = 50
+# 单条 SQL 超过 PERF_SLOW_QUERY_MS 毫秒时记入慢查询日志（语句与参数）
+app.config['PERF_SLOW_QUERY_MS'] = 100
+# 在响应头 Server-Timing 中附带分项耗时，只应在调试时打开
+app.config['PERF_SERVER_TIMING'] = False
+perf.install(app)
+
+# Prometheus 指标（见 metrics.py）：/metrics 输出所有 worker 合计的请求数、延迟直方图、SQL 条数与缓存命中率
+app.config['METRICS_ENABLED'] = False
+# 各 worker 定期把增量合并进这个共享的 SQLite 文件
+app.config['METRICS_DATABASE'] = './metrics.db'
+app.config['METRICS_FLUSH_INTERVAL'] = 5
+# 抓取时须带 "Authorization: Bearer <令牌>"；为 None 时只允许本机直接访问
+app.config['METRICS_TOKEN'] = None
+metrics.install(app)
+
 # Configure database
 DATABASE = 'users.db'
 
+# 进程内用户名索引，供用户搜索使用
+usernameIndex = search_index.UsernameIndex(DATABASE)
+
+# 笔记搜索时经 n-gram 索引筛选后参与 LCS 精排的最大候选数
+app.config['SEARCH_CANDIDATE_LIMIT'] = 200
+# 搜索结果（笔记、用户）最多返回的条数
+app.config['SEARCH_RESULT_LIMIT'] = 50
+# 笔记数达到该值的用户搜索时不经 n-gram 筛选，全部笔记交给进程池并行打分（不受候选数上限截断）；
+# 笔记数较少的用户仍先筛选，候选不超过 SEARCH_CANDIDATE_LIMIT，达不到该值，在进程内打分。
+# SEARCH_WORKERS 不大于 1 时关闭并行，所有用户都先经 n-gram 筛选
+app.config['PARALLEL_SEARCH_THRESHOLD'] = 2000
+app.config['SEARCH_WORKERS'] = os.cpu_count()
+
+searchScorer = lcs_engine.ParallelScorer(workers=app.config['SEARCH_WORKERS'],
+                                         threshold=app.config['PARALLEL_SEARCH_THRESHOLD'])
+
+# 笔记列表每页条数与预览字符数（0 表示只取标题，列表查询完全由索引覆盖）
+app.config['NOTES_PAGE_SIZE'] = 50
+app.config['NOTE_PREVIEW_CHARS'] = 0
+
+app.config['DB_POOL_SIZE'] = 8
+
+# 连接池：连接跨请求复用，在应用上下文结束时归还
+dbPool = sqlite_pool.SQLitePool(DATABASE, size=app.config['DB_POOL_SIZE'], factory=perf.connection_class())
+
 def get_db():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(g, '_database', None)
+    if conn is None:
+        conn = g._database = dbPool.acquire()
     return conn
 
+@app.teardown_appcontext
+def releaseDb(exc):
+    conn = g.pop('_database', None)
+    if conn is not None:
+        dbPool.release(conn)
+
 # -------------------------------------------
 # User Model
 # -------------------------------------------
@@ -55,26 +116,17 @@ class User(UserMixin):
 
     @staticmethod
     def searchUsers(query):
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users')
-        usersData = cursor.fetchall()
-        usersWithScores = []
-        for userRow in usersData:
-            username = userRow['username']
-            score = lcsLength(query, username)
-            if score > 0:
-                user = User(userRow['id'], username, userRow['password'])
-                usersWithScores.append((score, user))
-        usersWithScores.sort(reverse=True, key=lambda x: x[0])
-        resultUsers = []
-        for score, user in usersWithScores:
-            resultUsers.append(user)
-        return resultUsers
+        # 由进程内用户名索引作答，不再逐行读取 users 表；搜索结果不携带密码
+        with perf.timer('lcs'):
+            matches = usernameIndex.search(query, limit=app.config['SEARCH_RESULT_LIMIT'])
+        return [User(userId, username, None) for userId, username in matches]
 
 # -------------------------------------------
 # Note Model
 # -------------------------------------------
+# 列表页的一行：只有标题和正文预览，不是完整的笔记
+NoteSummary = namedtuple('NoteSummary', ['id', 'title', 'preview'])
+
 class Note:
     def __init__(self, id, userId, title, content):
         self.id = id
@@ -104,6 +156,11 @@ class Note:
             notes.append(note)
         return notes
 
+    @staticmethod
+    def count(userId):
+        conn = get_db()
+        return conn.execute('SELECT COUNT(*) FROM notes WHERE userId = ?', (userId,)).fetchone()[0]
+
     @staticmethod
     def getAllByUser(userId):
         conn = get_db()
@@ -116,12 +173,111 @@ class Note:
             notes.append(note)
         return notes
 
+    @staticmethod
+    def getPage(userId, before=None, limit=50, previewChars=0):
+        """
+        键集分页：按 id 倒序取 id < before 的一页，返回 (NoteSummary 列表, 下一页的 before)。
+        只读取标题和可选的正文预览，任何一页的代价都相同。
+        """
+        conn = get_db()
+        if previewChars:
+            sql = 'SELECT id, title, substr(content, 1, ?) AS preview FROM notes WHERE userId = ?'
+            params = [previewChars, userId]
+        else:
+            sql = "SELECT id, title, '' AS preview FROM notes WHERE userId = ?"
+            params = [userId]
+        if before:
+            sql += ' AND id < ?'
+            params.append(before)
+        cursor = conn.execute(sql + ' ORDER BY id DESC LIMIT ?', params + [limit + 1])
+        rows = cursor.fetchall()
+        # 多取的一行只用来判断是否还有下一页
+        nextBefore = rows[limit - 1]['id'] if len(rows) > limit else None
+        return [NoteSummary(row['id'], row['title'], row['preview']) for row in rows[:limit]], nextBefore
+
+    @staticmethod
+    def getMany(noteIds, userId):
+        if not noteIds:
+            return []
+        conn = get_db()
+        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(noteIds))
+        cursor.execute('SELECT * FROM notes WHERE userId = ? AND id IN (%s) ORDER BY id' % placeholders,
+                       [userId] + list(noteIds))
+        return [Note(row['id'], row['userId'], row['title'], row['content']) for row in cursor.fetchall()]
+
+# -------------------------------------------
+# Note N-gram Index
+# -------------------------------------------
+class NoteIndex:
+    """笔记的 n-gram 倒排索引，存放在 noteGrams 表中，与笔记写入在同一事务内维护"""
+
+    # 单次查询最多使用的 gram 数，避免超出 SQLite 的参数个数限制
+    MAX_QUERY_GRAMS = 500
+
+    @staticmethod
+    def createTable(conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS noteGrams (
+                            userId INTEGER NOT NULL,
+                            gram TEXT NOT NULL,
+                            noteId INTEGER NOT NULL,
+                            PRIMARY KEY (userId, gram, noteId)
+                        ) WITHOUT ROWID''')
+        conn.execute('CREATE INDEX IF NOT EXISTS noteGramsNoteId ON noteGrams(noteId)')
+
+    @staticmethod
+    def update(conn, noteId, userId, title, content):
+        conn.execute('DELETE FROM noteGrams WHERE noteId = ?', (noteId,))
+        grams = search_index.extract_grams(title + content)
+        conn.executemany('INSERT INTO noteGrams (userId, gram, noteId) VALUES (?, ?, ?)',
+                         [(userId, gram, noteId) for gram in grams])
+
+    @staticmethod
+    def remove(conn, noteId):
+        conn.execute('DELETE FROM noteGrams WHERE noteId = ?', (noteId,))
+
+    @staticmethod
+    def backfill(conn):
+        # 为索引建立之前就存在的笔记补建索引
+        cursor = conn.execute('''SELECT id, userId, title, content FROM notes
+                                 WHERE id NOT IN (SELECT DISTINCT noteId FROM noteGrams)''')
+        for row in cursor.fetchall():
+            NoteIndex.update(conn, row['id'], row['userId'], row['title'], row['content'])
+
+    @staticmethod
+    def candidates(userId, query, limit):
+        """按命中的 gram 数返回最多 limit 个候选笔记 ID；查询过短无法使用索引时返回 None"""
+        grams = sorted(search_index.extract_grams(query))[:NoteIndex.MAX_QUERY_GRAMS]
+        if not grams:
+            return None
+        conn = get_db()
+        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(grams))
+        cursor.execute('''SELECT noteId, COUNT(*) AS hits FROM noteGrams
+                          WHERE userId = ? AND gram IN (%s)
+                          GROUP BY noteId ORDER BY hits DESC, noteId LIMIT ?''' % placeholders,
+                       [userId] + grams + [limit])
+        return [row['noteId'] for row in cursor.fetchall()]
+
 # -------------------------------------------
 # Load User Function for Login Manager
 # -------------------------------------------
+app.config['USER_CACHE_SIZE'] = 1024
+app.config['USER_CACHE_TTL'] = 300  # 秒；多进程部署下其他进程的修改最迟在此时间后生效
+
+# 跨请求的用户缓存：已登录用户的每次请求不再为重建 User 对象查库
+userCache = caching.LRUCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+metrics.watch_cache('user', userCache.stats)
+
 @login_manager.user_loader
 def loadUser(userId):
-    return User.get(userId)
+    userId = str(userId)
+    user = userCache.get(userId)
+    if user is None:
+        user = User.get(userId)
+        if user is not None:
+            userCache.set(userId, user)
+    return user
 
 # -------------------------------------------
 # Initialize Database
@@ -143,7 +299,17 @@ def initializeDatabase():
                         content TEXT NOT NULL,
                         FOREIGN KEY(userId) REFERENCES users(id)
                     )''')
+    # 笔记列表按 (userId, id DESC) 定位翻页；带上 title 后只取标题时不必回表
+    conn.execute('CREATE INDEX IF NOT EXISTS notesUserId ON notes(userId, id DESC, title)')
+    # Create note n-gram index
+    NoteIndex.createTable(conn)
+    NoteIndex.backfill(conn)
     conn.commit()
+    usernameIndex.load()
+    # 常驻进程池随应用启动一次，之后的搜索请求复用
+    searchScorer.start()
+    # 验证码池在后台填充；fork 出的 worker 会在首次取用时重新启动
+    captchaPool.start()
 
 # -------------------------------------------
 # Forms
@@ -183,24 +349,31 @@ class UserSearchForm(FlaskForm):
 # -------------------------------------------
 # Captcha Generation
 # -------------------------------------------
-def generateCaptcha():
+# 字体只加载一次，由后台线程预先渲染验证码
+try:
+    captchaFont = ImageFont.truetype("arial.ttf", 24)
+except IOError:
+    captchaFont = ImageFont.load_default()
+
+def renderCaptcha():
     characters = ''.join(random.choices(string.ascii_uppercase + string.digits, k=5))
-    session['captcha'] = characters
     img = Image.new('RGB', (100, 30), color = (255, 255, 255))
     d = ImageDraw.Draw(img)
-    
-    # Load a font
-    try:
-        font = ImageFont.truetype("arial.ttf", 24)
-    except IOError:
-        font = ImageFont.load_default()
-
-    d.text((10, 0), characters, fill=(0, 0, 0), font=font)
-    
-    buffer = BytesIO()
-    img.save(buffer, format="PNG")
-    buffer.seek(0)
-    return buffer
+    d.text((10, 0), characters, fill=(0, 0, 0), font=captchaFont)
+    return characters, captcha_pool.png_bytes(img)
+
+app.config['CAPTCHA_POOL_SIZE'] = 64
+app.config['CAPTCHA_LOW_WATERMARK'] = 16
+
+captchaPool = captcha_pool.CaptchaPool(renderCaptcha, size=app.config['CAPTCHA_POOL_SIZE'],
+                                       low_watermark=app.config['CAPTCHA_LOW_WATERMARK'])
+metrics.watch_cache('captcha_pool', captchaPool.stats)
+
+@perf.timed('captcha')
+def generateCaptcha():
+    characters, png = captchaPool.pop()
+    session['captcha'] = characters
+    return BytesIO(png)
 
 @app.route('/captcha')
 def captcha():
@@ -211,20 +384,7 @@ def captcha():
 # LCS Algorithm
 # -------------------------------------------
 def lcsLength(a, b):
-    a = a.lower()
-    b = b.lower()
-    m = len(a)
-    n = len(b)
-    dp = []
-    for i in range(m+1):
-        dp.append([0]*(n+1))
-    for i in range(m):
-        for j in range(n):
-            if a[i] == b[j]:
-                dp[i+1][j+1] = dp[i][j]+1
-            else:
-                dp[i+1][j+1] = max(dp[i][j+1], dp[i+1][j])
-    return dp[m][n]
+    return lcs_engine.lcs_length(a.lower(), b.lower())
 
 # -------------------------------------------
 # Home Page Route
@@ -255,6 +415,8 @@ def register():
             cursor = conn.cursor()
             cursor.execute('INSERT INTO users (username, password) VALUES (?, ?)', (form.username.data, form.password.data))
             conn.commit()
+            userCache.invalidate(str(cursor.lastrowid))
+            usernameIndex.add(cursor.lastrowid, form.username.data)
             flash('注册成功。现在您可以登录了。', 'success')
             return redirect(url_for('login'))
     return render_template('register.html', form=form)
@@ -302,6 +464,7 @@ def changePassword():
             cursor = conn.cursor()
             cursor.execute('UPDATE users SET password = ? WHERE id = ?', (form.newPassword.data, current_user.id))
             conn.commit()
+            userCache.invalidate(str(current_user.id))
             flash('密码修改成功。', 'success')
             return redirect(url_for('home'))
         else:
@@ -314,8 +477,10 @@ def changePassword():
 @app.route('/notes')
 @login_required
 def notes():
-    notes = Note.getAll(current_user.id)
-    return render_template('notes.html', notes=notes)
+    before = request.args.get('before', type=int)
+    notes, nextBefore = Note.getPage(current_user.id, before, app.config['NOTES_PAGE_SIZE'],
+                                     app.config['NOTE_PREVIEW_CHARS'])
+    return render_template('notes.html', notes=notes, before=before, nextBefore=nextBefore)
 
 # -------------------------------------------
 # Create New Note Route
@@ -328,6 +493,7 @@ def newNote():
         conn = get_db()
         cursor = conn.cursor()
         cursor.execute('INSERT INTO notes (userId, title, content) VALUES (?, ?, ?)', (current_user.id, form.title.data, form.content.data))
+        NoteIndex.update(conn, cursor.lastrowid, current_user.id, form.title.data, form.content.data)
         conn.commit()
         flash('笔记创建成功！', 'success')
         return redirect(url_for('notes'))
@@ -348,6 +514,7 @@ def editNote(noteId):
         conn = get_db()
         cursor = conn.cursor()
         cursor.execute('UPDATE notes SET title = ?, content = ? WHERE id = ? AND userId = ?', (form.title.data, form.content.data, noteId, current_user.id))
+        NoteIndex.update(conn, noteId, current_user.id, form.title.data, form.content.data)
         conn.commit()
         flash('笔记更新成功！', 'success')
         return redirect(url_for('notes'))
@@ -366,6 +533,7 @@ def deleteNote(noteId):
         conn = get_db()
         cursor = conn.cursor()
         cursor.execute('DELETE FROM notes WHERE id = ? AND userId = ?', (noteId, current_user.id))
+        NoteIndex.remove(conn, noteId)
         conn.commit()
         flash('笔记已删除。', 'success')
     return redirect(url_for('notes'))
@@ -380,17 +548,20 @@ def searchNotes():
     notes = []
     if form.validate_on_submit():
         query = form.query.data
-        allNotes = Note.getAll(current_user.id)
-        notesWithScores = []
-        for note in allNotes:
-            combinedText = note.title + note.content
-            score = lcsLength(query, combinedText)
-            if score > 0:
-                notesWithScores.append((score, note))
-        notesWithScores.sort(reverse=True, key=lambda x: x[0])
-        notes = []
-        for score, note in notesWithScores:
-            notes.append(note)
+        # 笔记数达到并行阈值时直接对全部笔记并行打分；否则先用 n-gram 索引筛出候选集，
+        # 再用 LCS 精排，查询过短时退回全量扫描
+        if searchScorer.enabled and Note.count(current_user.id) >= searchScorer.threshold:
+            candidateIds = None
+        else:
+            candidateIds = NoteIndex.candidates(current_user.id, query, app.config['SEARCH_CANDIDATE_LIMIT'])
+        if candidateIds is None:
+            allNotes = Note.getAll(current_user.id)
+        else:
+            allNotes = Note.getMany(candidateIds, current_user.id)
+        with perf.timer('lcs'):
+            ranked = searchScorer.top_k(query.lower(), allNotes, lambda note: (note.title + note.content).lower(),
+                                        limit=app.config['SEARCH_RESULT_LIMIT'])
+        notes = [note for score, note in ranked]
         if not notes:
             flash('未找到匹配的笔记。', 'info')
         return render_template('search_results.html', notes=notes)
@@ -422,6 +593,28 @@ def userNotes(userId):
     notes = Note.getAllByUser(userId)
     return render_template('public_notes.html', user=user, notes=notes)
 
+# -------------------------------------------
+# Connection Pool / Cache Stats Routes
+# -------------------------------------------
+@app.route('/debug/db_pool')
+def dbPoolStats():
+    # 仅在调试模式下开放，用于观察并调整连接池大小
+    if not app.debug:
+        abort(404)
+    return jsonify(dbPool.stats())
+
+@app.route('/debug/user_cache')
+def userCacheStats():
+    if not app.debug:
+        abort(404)
+    return jsonify(userCache.stats())
+
+@app.route('/debug/captcha_pool')
+def captchaPoolStats():
+    if not app.debug:
+        abort(404)
+    return jsonify(captchaPool.stats())
+
 # -------------------------------------------
 # Run the Application
 # -------------------------------------------
@@ -0,0 +1,427 @@
+"""
+SQL 审计：在临时目录中为每个应用建库并写入种子数据，按常用路径发出一轮请求，
+记录执行过的每一条不同的 SQL 及其 EXPLAIN QUERY PLAN，标出两类问题：
+
+- 全表扫描：SCAN <表> 且没有使用任何索引（SCAN ... USING INDEX 是按索引顺序读取，配合 LIMIT 属正常，只列出不报警）；
+- 临时 B 树：USE TEMP B-TREE FOR ORDER BY / GROUP BY / DISTINCT，排序或去重无法利用索引。
+
+确实无法避免的问题（如 LCS 搜索本来就要读取全部用户）登记在 ACCEPTED 中并注明原因。
+存在未登记的问题时退出码为 1，可作为代码评审的检查项。
+
+用法：python benchmarks/audit_queries.py [--app 名称 ...] [--json] [--output 文件]
+
+应用名称：app（app.py）、notes（Flask-notes-app.py）、notebook（笔记本应用.py）、vidhub（VidHub.py）、forum（新的项目/论坛.py）。
+语句由 perf.statement_listeners 采集，sqlite3 连接须经 perf.connect / perf.connection_class 创建。
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import perf
+
+USERS = 5
+NOTES_PER_USER = 120
+VIDEOS_PER_USER = 10
+POSTS_PER_USER = 30
+COMMENTS_PER_POST = 3
+
+# (应用, 匹配语句的正则, 原因)
+ACCEPTED = [
+    ('app', r'GROUP BY noteId ORDER BY hits DESC',
+     '按命中 gram 数排序候选笔记，排序键是聚合结果，只能在临时 B 树中排序；候选数有上限'),
+    ('notes', r'ORDER BY bm25\(',
+     '按 bm25 相关度排序，分数由全文索引在查询时算出，无法预先建索引；结果有 LIMIT'),
+    ('notebook', r'ORDER BY bm25\(',
+     '按 bm25 相关度排序，分数由全文索引在查询时算出，无法预先建索引；结果有 LIMIT'),
+    ('vidhub', r'^SELECT .* FROM user$',
+     'LCS 用户搜索需要逐个比较全部用户名'),
+    ('forum', r'row_number\(\) OVER \(PARTITION BY comment.post_id',
+     '一页说说各自的前几条评论合在一起排序，行数不超过 POSTS_PER_PAGE × INLINE_COMMENTS'),
+    ('forum', r'^SELECT .* FROM user$',
+     'LCS 用户搜索需要逐个比较全部用户名'),
+]
+
+DML_RE = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE|WITH)\b', re.I)
+SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\S+)(.*)$')
+PAGE_RE = re.compile(r'[?&](?:before|cursor)=([\w%-]+)')
+
+
+def normalize(statement):
+    """合并空白，并把 IN (?, ?, ...) 折叠成 IN (...)，参数个数不同的同一条语句只记一次"""
+    statement = ' '.join(statement.split())
+    return re.sub(r'IN \((?:\?, ?)*\?\)', 'IN (...)', statement)
+
+
+class Recorder:
+    """perf 的语句监听器：按归一化后的语句累计次数与耗时，保留第一次出现时的原文与参数用于 EXPLAIN"""
+
+    def __init__(self):
+        self.statements = {}
+
+    def __call__(self, statement, parameters, seconds):
+        if not DML_RE.match(statement):
+            return
+        key = normalize(statement)
+        entry = self.statements.get(key)
+        if entry is None:
+            entry = self.statements[key] = {'sql': statement, 'parameters': parameters,
+                                            'count': 0, 'total': 0.0, 'max': 0.0}
+        elif entry['parameters'] is None and parameters is not None:
+            entry['parameters'] = parameters
+        entry['count'] += 1
+        entry['total'] += seconds
+        entry['max'] = max(entry['max'], seconds)
+
+
+def explain(conn, sql, parameters):
+    """返回查询计划的各行 (深度, 描述)；参数无法绑定时以 NULL 代替"""
+    try:
+        rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, parameters or ()).fetchall()
+    except (sqlite3.ProgrammingError, sqlite3.InterfaceError):
+        rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, [None] * sql.count('?')).fetchall()
+    depth = {0: -1}
+    plan = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        plan.append((depth[node], detail))
+    return plan
+
+
+def issues(plan):
+    # 物化的子查询（MATERIALIZE x）本身就是临时结果，扫描它不算全表扫描
+    materialized = {detail.split()[1] for _, detail in plan if detail.startswith('MATERIALIZE ')}
+    found = []
+    for _, detail in plan:
+        match = SCAN_RE.match(detail)
+        if (match and not match.group(1).startswith('(') and match.group(1) not in materialized | {'CONSTANT'}
+                and 'USING' not in match.group(2) and 'VIRTUAL TABLE' not in match.group(2)):
+            found.append('全表扫描 ' + match.group(1))
+        if 'TEMP B-TREE' in detail:
+            found.append('临时 B 树（%s）' % detail)
+    return found
+
+
+def accepted(app_name, sql):
+    for name, pattern, reason in ACCEPTED:
+        if name == app_name and re.search(pattern, sql):
+            return reason
+    return None
+
+
+# ---- 加载应用 ----
+
+def python_part(source):
+    """捆绑文件中 Python 代码之后跟着模板，截到第一个模板标记为止"""
+    cut = len(source)
+    for marker in ('\n```', '\n<!doctype html>'):
+        if marker in source:
+            cut = min(cut, source.index(marker))
+    return source[:cut]
+
+
+def extract_notebook_templates(source, folder):
+    pattern = r"(?:#### )?`templates/([^`]+)`\s*```[a-z]*\n(.*?)\n```"
+    for match in re.finditer(pattern, source, re.S):
+        with open(os.path.join(folder, match.group(1)), 'w', encoding='utf-8') as f:
+            f.write(match.group(2))
+
+
+def extract_forum_templates(source, folder):
+    parts = re.split(r'\n---\s*\n', source[source.index('\n<!doctype html>'):])
+    with open(os.path.join(folder, 'base.html'), 'w', encoding='utf-8') as f:
+        f.write(parts[0].strip())
+    for part in parts[1:]:
+        match = re.search(r'###\s*\d+\.\s*\S+\s+(\w+\.html)[^\n]*\n(.*)', part, re.S)
+        if match:
+            body = re.sub(r'^\s*```\w*\s*$', '', match.group(2), flags=re.M)
+            with open(os.path.join(folder, match.group(1)), 'w', encoding='utf-8') as f:
+                f.write(body.strip())
+
+
+def load(name, path, extract=None):
+    """在当前目录（临时目录）中执行应用代码，返回模块；相对路径的数据库、上传目录等都落在这里"""
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    module = type(sys)('audit_' + name)
+    module.__file__ = path
+    exec(compile(python_part(source), path, 'exec'), module.__dict__)
+    app = module.app
+    if extract is not None:
+        os.makedirs('templates')
+        extract(source, os.path.abspath('templates'))
+        app.template_folder = os.path.abspath('templates')
+    app.config['WTF_CSRF_ENABLED'] = False
+    # 请求失败已汇总在报告中，不再逐个打印异常栈
+    app.logger.disabled = True
+    app.config['METRICS_ENABLED'] = False
+    perf.install(app, force=True)
+    return module
+
+
+def sqlalchemy_database(module):
+    with module.app.app_context():
+        return os.path.abspath(module.db.engine.url.database)
+
+
+# ---- 各应用的种子数据与请求 ----
+
+class Client:
+    """记录每个请求的结果；应用抛出的异常只记下来，不中断审计"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.failures = []
+
+    def request(self, method, url, **kwargs):
+        try:
+            response = self.client.open(url, method=method, **kwargs)
+        except Exception as exc:
+            self.failures.append('%s %s: %s' % (method, url, exc.__class__.__name__))
+            return None
+        if response.status_code >= 400:
+            self.failures.append('%s %s: HTTP %d' % (method, url, response.status_code))
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def follow_page(self, url):
+        """打开列表页，再顺着页面上的 before / cursor 链接打开第二页"""
+        response = self.get(url)
+        match = response is not None and PAGE_RE.search(response.get_data(as_text=True))
+        if match:
+            self.get(url + ('&' if '?' in url else '?') + match.group(0)[1:])
+
+    def login(self, **values):
+        with self.client.session_transaction() as session:
+            session.update(values)
+
+
+def seed_app(module, client):
+    client.get('/login')  # before_first_request 建表
+    conn = sqlite3.connect(module.DATABASE)
+    conn.executemany('INSERT INTO users (username, password) VALUES (?, ?)',
+                     [('user%d' % i, 'x') for i in range(USERS)])
+    conn.executemany('INSERT INTO notes (userId, title, content) VALUES (?, ?, ?)',
+                     [(i % USERS + 1, '笔记 %d' % i, '数据库索引与查询计划 %d ' % i * 5)
+                      for i in range(USERS * NOTES_PER_USER)])
+    conn.commit()
+    conn.close()
+    with module.app.app_context():
+        db = module.get_db()
+        module.NoteIndex.backfill(db)
+        db.commit()
+
+
+def exercise_app(module, client):
+    client.login(_user_id='1', _fresh=True)
+    client.get('/notes')
+    client.get('/notes?before=%d' % (USERS * NOTES_PER_USER))
+    client.post('/notes/new', data={'title': '新笔记', 'content': '查询计划'})
+    client.get('/notes/1/edit')
+    client.post('/notes/1/edit', data={'title': '改过的笔记', 'content': '索引'})
+    client.post('/notes/search', data={'query': '数据库索引'})
+    client.post('/notes/search', data={'query': 'a'})
+    client.post('/user_search', data={'query': 'user'})
+    client.get('/user/2/notes')
+    client.post('/notes/%d/delete' % (USERS + 1))
+    module.searchScorer.shutdown()
+
+
+def seed_notes(module, client):
+    with module.app.app_context():
+        module.init_db()
+    conn = sqlite3.connect(module.DATABASE)
+    conn.executemany('INSERT INTO users (username, password) VALUES (?, ?)',
+                     [('user%d' % i, 'x') for i in range(USERS)])
+    conn.executemany('INSERT INTO notes (user_id, title, content) VALUES (?, ?, ?)',
+                     [(i % USERS + 1, '笔记 %d' % i, '# 标题\n\n数据库 **索引** %d' % i)
+                      for i in range(USERS * NOTES_PER_USER)])
+    conn.commit()
+    conn.close()
+
+
+def exercise_notes(module, client):
+    client.login(user_id=1)
+    client.follow_page('/')
+    client.get('/note/1')
+    client.get('/note/1')
+    client.get('/note/1/edit')
+    client.post('/note/1/edit', data={'title': '改过的笔记', 'content': '*索引*'})
+    client.post('/note/new', data={'title': '新笔记', 'content': '查询计划'})
+    client.post('/note/%d/rename' % (USERS + 1), data={'new_title': '新标题'})
+    client.get('/search?q=数据库')
+    client.get('/search?q=index')
+    client.get('/toggle_extensions')
+    client.post('/note/%d/delete' % (USERS * 2 + 1))
+
+
+def seed_vidhub(module, client):
+    Blob, User, Video, db = module.Blob, module.User, module.Video, module.db
+    with module.app.app_context():
+        module.init_db()
+        db.session.add_all(User(username='user%d' % i, password_hash='x') for i in range(USERS))
+        db.session.add(Blob(sha256='0' * 64, size=1024, refcount=2))
+        db.session.flush()
+        for i in range(USERS * VIDEOS_PER_USER):
+            db.session.add(Video(title='视频 %d' % i, filename='v%d.mp4' % i, user_id=i % USERS + 1,
+                                 sha256='0' * 64 if i < 2 else None, meta_status='ready'))
+        db.session.commit()
+
+
+def exercise_vidhub(module, client):
+    client.login(_user_id='1', _fresh=True)
+    client.get('/dashboard')
+    client.get('/my_videos')
+    client.get('/search?q=user')
+    client.get('/user_videos/2')
+    client.get('/play_video/1')
+    client.post('/uploads/sessions', json={'title': '重复', 'filename': 'a.mp4', 'size': 1024, 'sha256': '0' * 64})
+    client.post('/uploads/sessions', json={'title': '新视频', 'filename': 'b.mp4', 'size': 2048})
+    client.post('/delete_video', data={'video_id': 1})
+    client.post('/delete_video', data={'video_id': USERS + 1})
+    module.media_jobs.join()
+
+
+def seed_forum(module, client):
+    Comment, Post, User, db = module.Comment, module.Post, module.User, module.db
+    start = datetime(2024, 1, 1)
+    with module.app.app_context():
+        module.init_db()
+        users = [User(username='user%d' % i, password_hash='x') for i in range(USERS)]
+        db.session.add_all(users)
+        db.session.flush()
+        for i in range(USERS * POSTS_PER_USER):
+            post = Post(content='说说 %d' % i, user_id=users[i % USERS].id,
+                        timestamp=start + timedelta(minutes=i), comment_count=COMMENTS_PER_POST)
+            db.session.add(post)
+            db.session.flush()
+            db.session.add_all(Comment(content='评论 %d' % j, user_id=users[j % USERS].id, post_id=post.id,
+                                       timestamp=start + timedelta(minutes=i, seconds=j))
+                               for j in range(COMMENTS_PER_POST))
+        module.repair_counters()
+
+
+def exercise_forum(module, client):
+    client.login(_user_id='1', _fresh=True)
+    client.follow_page('/')
+    client.follow_page('/user/user1')
+    client.get('/post/1/comments')
+    client.post('/post', data={'content': '新说说'})
+    client.post('/post/1/comment', data={'content': '新评论'})
+    client.post('/search', data={'username': 'user2'})
+
+
+APPS = {
+    'app': ('app.py', None, lambda m: os.path.abspath(m.DATABASE), seed_app, exercise_app),
+    'notes': ('Flask-notes-app.py', None, lambda m: os.path.abspath(m.DATABASE), seed_notes, exercise_notes),
+    'notebook': ('笔记本应用.py', extract_notebook_templates, lambda m: os.path.abspath(m.DATABASE),
+                 seed_notes, exercise_notes),
+    'vidhub': ('VidHub.py', None, sqlalchemy_database, seed_vidhub, exercise_vidhub),
+    'forum': (os.path.join('新的项目', '论坛.py'), extract_forum_templates, sqlalchemy_database,
+              seed_forum, exercise_forum),
+}
+
+
+def audit(name):
+    filename, extract, database, seed, exercise = APPS[name]
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='audit-%s-' % name, ignore_cleanup_errors=True) as workdir:
+        os.chdir(workdir)
+        try:
+            module = load(name, os.path.join(ROOT, filename), extract)
+            if name == 'app':
+                module.app.template_folder = os.path.join(ROOT, 'templates')
+            client = Client(module.app)
+            seed(module, client)
+            recorder = Recorder()
+            perf.statement_listeners.append(recorder)
+            try:
+                exercise(module, client)
+            finally:
+                perf.statement_listeners.remove(recorder)
+
+            results = []
+            conn = sqlite3.connect(database(module))
+            try:
+                for key, entry in recorder.statements.items():
+                    result = {'app': name, 'sql': key, 'count': entry['count'],
+                              'total_ms': round(entry['total'] * 1000, 3),
+                              'max_ms': round(entry['max'] * 1000, 3)}
+                    try:
+                        plan = explain(conn, entry['sql'], entry['parameters'])
+                    except sqlite3.Error as exc:
+                        result.update(plan=[], issues=[], error=str(exc))
+                    else:
+                        result.update(plan=['  ' * depth + detail for depth, detail in plan], issues=issues(plan))
+                    result['accepted'] = accepted(name, key) if result['issues'] else None
+                    results.append(result)
+            finally:
+                conn.close()
+            return results, client.failures
+        finally:
+            os.chdir(cwd)
+
+
+def format_report(reports):
+    lines = []
+    for name, (results, failures) in reports.items():
+        lines.append('== %s（%s）：%d 条语句 ==' % (name, APPS[name][0], len(results)))
+        for failure in failures:
+            lines.append('  请求失败：' + failure)
+        for result in results:
+            lines.append('')
+            lines.append('[%d 次，最长 %.2f ms] %s' % (result['count'], result['max_ms'], result['sql']))
+            if result.get('error'):
+                lines.append('    无法取得查询计划：' + result['error'])
+            for step in result['plan']:
+                lines.append('    ' + step)
+            for issue in result['issues']:
+                lines.append('  %s %s' % ('--' if result['accepted'] else '!!', issue))
+            if result['accepted']:
+                lines.append('     已接受：' + result['accepted'])
+        lines.append('')
+    flagged = [r for results, _ in reports.values() for r in results if r['issues']]
+    unaccepted = [r for r in flagged if not r['accepted']]
+    lines.append('共 %d 条语句，%d 条有问题，其中 %d 条未登记' % (
+        sum(len(results) for results, _ in reports.values()), len(flagged), len(unaccepted)))
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='记录各应用执行的 SQL 并检查查询计划')
+    parser.add_argument('--app', action='append', choices=sorted(APPS), help='只审计指定应用，可重复')
+    parser.add_argument('--json', action='store_true', help='输出 JSON')
+    parser.add_argument('--output', help='写入文件而不是标准输出')
+    args = parser.parse_args()
+
+    # 先于加载应用启用，app.py 的连接池在导入时就要选定连接类
+    perf.enabled = True
+    reports = {name: audit(name) for name in (args.app or APPS)}
+    if args.json:
+        text = json.dumps([r for results, _ in reports.values() for r in results],
+                          ensure_ascii=False, indent=2) + '\n'
+    else:
+        text = format_report(reports)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    unaccepted = any(r['issues'] and not r['accepted'] for results, _ in reports.values() for r in results)
+    return 1 if unaccepted else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
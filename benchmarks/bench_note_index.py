@@ -0,0 +1,79 @@
+"""
+对比 app.py 笔记搜索在“全量 LCS 扫描”与“n-gram 索引筛选 + LCS 精排”两种方式下的结果与开销。
+
+用法：python benchmarks/bench_note_index.py [笔记数] [查询数]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as notes_app
+import lcs_engine
+import search_index
+import sqlite_pool
+
+WORDS = ['flask', 'python', 'sqlite', 'index', 'search', 'markdown', 'session', 'captcha',
+         '数据库', '索引', '搜索', '笔记', '缓存', '性能', '模板', '验证码', '用户', '会话']
+TOP_K = 10
+
+
+def make_note(rng):
+    title = ' '.join(rng.choices(WORDS, k=3))
+    content = ' '.join(rng.choices(WORDS, k=rng.randint(50, 400)))
+    return title, content
+
+
+def rank(query, notes):
+    compiled = lcs_engine.compile_query(query.lower())
+    scored = [(compiled.score((n.title + n.content).lower()), n) for n in notes]
+    scored = [item for item in scored if item[0] > 0]
+    scored.sort(reverse=True, key=lambda x: x[0])
+    return [score for score, _ in scored[:TOP_K]]
+
+
+def main(noteCount=2000, queryCount=20):
+    rng = random.Random(42)
+    notes_app.DATABASE = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    notes_app.dbPool = sqlite_pool.SQLitePool(notes_app.DATABASE)
+    notes_app.usernameIndex = search_index.UsernameIndex(notes_app.DATABASE)
+    with notes_app.app.app_context():
+        notes_app.initializeDatabase()
+        conn = notes_app.get_db()
+        conn.execute("INSERT INTO users (username, password) VALUES ('bench', 'x')")
+        for _ in range(noteCount):
+            title, content = make_note(rng)
+            cursor = conn.execute('INSERT INTO notes (userId, title, content) VALUES (1, ?, ?)', (title, content))
+            notes_app.NoteIndex.update(conn, cursor.lastrowid, 1, title, content)
+        conn.commit()
+
+        limit = notes_app.app.config['SEARCH_CANDIDATE_LIMIT']
+        same = 0
+        touched = 0
+        fullTime = indexTime = 0.0
+        for _ in range(queryCount):
+            query = ' '.join(rng.choices(WORDS, k=2))
+            start = time.perf_counter()
+            expected = rank(query, notes_app.Note.getAll(1))
+            fullTime += time.perf_counter() - start
+
+            start = time.perf_counter()
+            ids = notes_app.NoteIndex.candidates(1, query, limit)
+            candidates = notes_app.Note.getAll(1) if ids is None else notes_app.Note.getMany(ids, 1)
+            actual = rank(query, candidates)
+            indexTime += time.perf_counter() - start
+
+            touched += len(candidates)
+            same += actual == expected
+
+    print('笔记数: %d  查询数: %d  候选上限: %d' % (noteCount, queryCount, limit))
+    print('Top-%d 得分序列一致的查询: %d/%d' % (TOP_K, same, queryCount))
+    print('平均参与 LCS 的行数: %.1f (%.2f%%)' % (touched / queryCount, 100.0 * touched / queryCount / noteCount))
+    print('全量扫描: %.1f ms/次  索引筛选: %.1f ms/次' % (fullTime * 1000 / queryCount, indexTime * 1000 / queryCount))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,49 @@
+"""
+测量 ParallelScorer 在不同进程数下的加速比（相对于进程内单线程 top_k）。
+
+用法：python benchmarks/bench_parallel.py [笔记数] [笔记长度]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lcs_engine
+
+ALPHABET = 'abcdefghijklmnopqrstuvwxyz     数据库索引搜索笔记缓存'
+QUERY = 'flask sqlite 数据库'
+LIMIT = 50
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(count=5000, length=2000):
+    rng = random.Random(3)
+    corpus = [''.join(rng.choices(ALPHABET, k=length)) for _ in range(count)]
+    text = lambda t: t
+
+    base, expected = timed(lambda: lcs_engine.top_k(QUERY, corpus, text, limit=LIMIT))
+    print('笔记数: %d  每条长度: %d  CPU 核数: %d' % (count, length, os.cpu_count()))
+    print('%-8s %10s %8s %6s' % ('workers', 'time(ms)', 'speedup', 'same'))
+    print('%-8s %10.1f %8.2f %6s' % ('inline', base * 1000, 1.0, True))
+    for workers in range(2, (os.cpu_count() or 1) + 1):
+        scorer = lcs_engine.ParallelScorer(workers=workers, threshold=0).start()
+        # 预热：让工作进程完成启动和模块导入，不计入测量
+        scorer.top_k(QUERY, corpus[:workers * scorer.chunk_size], text, limit=LIMIT)
+        elapsed, actual = timed(lambda: scorer.top_k(QUERY, corpus, text, limit=LIMIT))
+        scorer.shutdown()
+        print('%-8d %10.1f %8.2f %6s' % (workers, elapsed * 1000, base / elapsed, actual == expected))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
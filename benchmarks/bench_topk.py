@@ -0,0 +1,58 @@
+"""
+对比“全部打分后排序”与 lcs_engine.top_k 的结果与 LCS 计算次数。
+
+用法：python benchmarks/bench_topk.py [候选数] [limit]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lcs_engine
+
+ALPHABET = 'abcdefghijklmnopqrstuvwxyz0123456789数据库索引搜索笔记'
+QUERIES = ['flask', 'search', 'abc', '数据库', 'note2024', 'zzq']
+
+
+def make_corpus(rng, count):
+    corpus = []
+    for _ in range(count):
+        # 大部分候选较短（类似用户名、标题），少数是长文本
+        length = rng.randint(3, 16) if rng.random() < 0.9 else rng.randint(200, 2000)
+        corpus.append(''.join(rng.choices(ALPHABET, k=length)))
+    return corpus
+
+
+def full_sort(query, corpus):
+    compiled = lcs_engine.compile_query(query)
+    scored = [(compiled.score(text), text) for text in corpus]
+    scored = [item for item in scored if item[0] > 0]
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return scored
+
+
+def main(count=20000, limit=10):
+    rng = random.Random(7)
+    corpus = make_corpus(rng, count)
+    print('候选数: %d  limit: %d' % (count, limit))
+    print('%-10s %8s %8s %8s %8s %8s %10s %10s' % ('query', 'computed', 'length', 'histo', 'early', 'same',
+                                                   'full(ms)', 'topk(ms)'))
+    for query in QUERIES:
+        start = time.perf_counter()
+        expected = full_sort(query, corpus)[:limit]
+        full_ms = (time.perf_counter() - start) * 1000
+
+        stats = lcs_engine.RankStats()
+        start = time.perf_counter()
+        actual = lcs_engine.top_k(query, corpus, lambda text: text, limit=limit, stats=stats)
+        topk_ms = (time.perf_counter() - start) * 1000
+
+        print('%-10s %8d %8d %8d %8d %8s %10.1f %10.1f' % (
+            query, stats.computed, stats.pruned_by_length, stats.pruned_by_histogram,
+            stats.skipped_by_early_stop, actual == expected, full_ms, topk_ms))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
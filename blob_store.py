@@ -0,0 +1,48 @@
+"""
+按内容寻址的文件存储：文件以 SHA-256 命名，放在两级扇出目录下（ab/cd/abcd...），
+相同内容只保存一份。引用计数由调用方在数据库中维护，这里只负责文件的放置与删除。
+"""
+
+import hashlib
+import os
+
+BLOCK_SIZE = 64 * 1024
+
+
+def hash_file(path):
+    """流式计算文件的 SHA-256"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, src, digest):
+        """
+        把 src 移入存储（同一文件系统内改名，不复制数据）。
+        相同内容已经存在时直接丢弃 src；返回 True 表示写入了新文件。
+        """
+        target = self.path(digest)
+        if os.path.exists(target):
+            os.remove(src)
+            return False
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(src, target)
+        return True
+
+    def remove(self, digest):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
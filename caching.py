@@ -0,0 +1,96 @@
+"""
+进程内缓存工具：带容量上限与可选过期时间的 LRU 缓存，以及 SQLAlchemy 模型的快照/还原辅助。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    线程安全的 LRU 缓存；ttl 为秒数，None 表示不过期。stats() 报告命中率。
+
+    给定 maxweight 和 weigh(value) 时，还按条目权重之和（例如字符数）限制内存占用。
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, maxweight=None, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        self._data = OrderedDict()   # key -> (过期时间, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                self._pop(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (expires, value)
+            if self.weigh is not None:
+                self.weight += self.weigh(value)
+            while self._data and (len(self._data) > self.maxsize or
+                                  (self.maxweight is not None and self.weight > self.maxweight)):
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _pop(self, key):
+        entry = self._data.pop(key, _MISSING)
+        if entry is not _MISSING and self.weigh is not None:
+            self.weight -= self.weigh(entry[1])
+
+    def invalidate(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'weight': self.weight,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def orm_snapshot(obj):
+    """把 SQLAlchemy 模型实例的列值拷贝成普通字典，可以安全地跨请求、跨会话缓存"""
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+
+def orm_restore(session, model, data):
+    """用快照重建实例并以 merge(load=False) 挂到当前会话上，不发出任何 SQL"""
+    from sqlalchemy.orm import make_transient_to_detached
+    obj = model(**data)
+    make_transient_to_detached(obj)
+    return session.merge(obj, load=False)
@@ -0,0 +1,230 @@
+"""
+验证码子系统：预先渲染好一批 (文本, PNG 字节) 放在有界池中，由后台线程在低于水位线时补充。
+
+请求处理时只需从池中取出一张并写入会话，不再同步绘图和编码 PNG；
+池被抽空时退回同步生成，保证请求不会因此阻塞或失败。
+
+CaptchaTokens 提供无状态的令牌模式：答案由 HMAC 从令牌中推导，令牌自带过期时间和签名，
+放在表单隐藏字段与图片 URL 中，服务器不必为匿名访问者写会话；一次性使用由重放集合保证。
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import deque
+from io import BytesIO
+
+
+def png_bytes(image):
+    """把 Pillow 图片编码为 PNG 字节"""
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class CaptchaPool:
+    def __init__(self, render, size=64, low_watermark=16):
+        """render() 返回 (text, 图片数据)，图片数据可以是 PNG 字节或其 Base64 文本；池中最多保存 size 张，低于 low_watermark 时后台补满"""
+        self.render = render
+        self.size = size
+        self.low_watermark = low_watermark
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._started = None
+        self.generated = 0
+        self.generate_time = 0.0
+        self.served = 0
+        self.misses = 0
+
+    def _generate(self):
+        start = time.perf_counter()
+        item = self.render()
+        elapsed = time.perf_counter() - start
+        with self._cond:
+            self.generated += 1
+            self.generate_time += elapsed
+        return item
+
+    def _refill_loop(self):
+        while True:
+            with self._cond:
+                while len(self._items) >= self.low_watermark:
+                    self._cond.wait()
+                missing = self.size - len(self._items)
+            for _ in range(missing):
+                item = self._generate()
+                with self._cond:
+                    self._items.append(item)
+
+    def start(self):
+        """启动后台补充线程；fork 出的子进程中会重新启动"""
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid():
+                return self
+            self._items.clear()
+            self._pid = os.getpid()
+            self._started = time.monotonic()
+            self._thread = threading.Thread(target=self._refill_loop, name='captcha-refill', daemon=True)
+            self._thread.start()
+        return self
+
+    def pop(self):
+        """取出一张验证码 (text, 图片数据)"""
+        if self._pid != os.getpid():
+            self.start()
+        with self._cond:
+            self.served += 1
+            if self._items:
+                item = self._items.popleft()
+                if len(self._items) < self.low_watermark:
+                    self._cond.notify()
+                return item
+            self.misses += 1
+            self._cond.notify()
+        # 池被抽空：同步生成一张
+        return self._generate()
+
+    def stats(self):
+        with self._cond:
+            uptime = time.monotonic() - self._started if self._started else 0.0
+            return {
+                'depth': len(self._items),
+                'size': self.size,
+                'low_watermark': self.low_watermark,
+                'served': self.served,
+                'hits': self.served - self.misses,
+                'misses': self.misses,
+                'generated': self.generated,
+                'generate_ms_avg': round(self.generate_time * 1000 / self.generated, 3) if self.generated else 0.0,
+                'generated_per_sec': round(self.generated / uptime, 3) if uptime else 0.0,
+            }
+
+
+class MemoryReplaySet:
+    """进程内的一次性令牌集合，只适合单进程部署"""
+
+    def __init__(self):
+        self._used = {}
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+
+    def add(self, nonce, expires):
+        """记录 nonce；已经用过时返回 False"""
+        now = time.time()
+        with self._lock:
+            if now >= self._next_purge:
+                self._used = {k: v for k, v in self._used.items() if v >= now}
+                self._next_purge = now + 60
+            if nonce in self._used:
+                return False
+            self._used[nonce] = expires
+            return True
+
+
+class SQLiteReplaySet:
+    """保存在 SQLite 表中的一次性令牌集合，多个 worker 进程共享；过期记录定期清理"""
+
+    def __init__(self, database, table='captcha_used', purge_interval=60):
+        self.database = database
+        self.table = table
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._next_purge = 0.0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.database, timeout=10)
+            conn.execute('CREATE TABLE IF NOT EXISTS %s (nonce TEXT PRIMARY KEY, expires INTEGER NOT NULL)'
+                         ' WITHOUT ROWID' % self.table)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, nonce, expires):
+        """记录 nonce；已经用过时返回 False"""
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            if now >= self._next_purge:
+                self._next_purge = now + self.purge_interval
+                conn.execute('DELETE FROM %s WHERE expires < ?' % self.table, (int(now),))
+            cur = conn.execute('INSERT OR IGNORE INTO %s (nonce, expires) VALUES (?, ?)' % self.table,
+                               (nonce, int(expires)))
+        return cur.rowcount == 1
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+class CaptchaTokens:
+    """
+    签名、可过期、一次性的验证码令牌，格式为 nonce.过期时间戳.签名。
+
+    答案 = HMAC(密钥, nonce) 映射到 alphabet，不需要在服务器上保存；
+    verify() 先把 nonce 写入重放集合再比对答案，同一个令牌无论对错只能提交一次。
+    """
+
+    def __init__(self, secret, ttl=300, length=4, alphabet='0123456789', replay=None):
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        # 签名与答案使用不同的派生密钥
+        self._sign_key = hmac.new(secret, b'captcha-token-sign', hashlib.sha256).digest()
+        self._answer_key = hmac.new(secret, b'captcha-token-answer', hashlib.sha256).digest()
+        self.ttl = ttl
+        self.length = length
+        self.alphabet = alphabet
+        self.replay = replay if replay is not None else MemoryReplaySet()
+
+    def _sign(self, payload):
+        return _b64(hmac.new(self._sign_key, payload.encode('ascii'), hashlib.sha256).digest())
+
+    def _answer(self, nonce):
+        value = int.from_bytes(hmac.new(self._answer_key, nonce.encode('ascii'), hashlib.sha256).digest(), 'big')
+        chars = []
+        for _ in range(self.length):
+            value, index = divmod(value, len(self.alphabet))
+            chars.append(self.alphabet[index])
+        return ''.join(chars)
+
+    def _parse(self, token):
+        """校验签名与过期时间，返回 (nonce, expires)；无效时返回 None"""
+        try:
+            nonce, expires, signature = token.split('.')
+            expires = int(expires)
+        except (AttributeError, ValueError):
+            return None
+        if not hmac.compare_digest(signature, self._sign('%s.%d' % (nonce, expires))):
+            return None
+        if expires < time.time():
+            return None
+        return nonce, expires
+
+    def issue(self):
+        """签发一个新令牌"""
+        nonce = secrets.token_urlsafe(12)
+        payload = '%s.%d' % (nonce, int(time.time()) + self.ttl)
+        return '%s.%s' % (payload, self._sign(payload))
+
+    def answer(self, token):
+        """令牌对应的验证码文本，用于渲染图片；令牌无效或过期时返回 None"""
+        parsed = self._parse(token)
+        return self._answer(parsed[0]) if parsed else None
+
+    def verify(self, token, guess):
+        """校验用户输入；令牌在这里被消费，不能再次使用"""
+        parsed = self._parse(token)
+        if parsed is None:
+            return False
+        nonce, expires = parsed
+        if not self.replay.add(nonce, expires):
+            return False
+        return hmac.compare_digest(self._answer(nonce).lower().encode('utf-8'), (guess or '').lower().encode('utf-8'))
@@ -0,0 +1,219 @@
+"""
+位并行最长公共子序列（LCS）引擎，供各应用的模糊搜索共用。
+
+采用 Allison–Dix / Hyyrö 的位向量算法：查询串的每个字符位置对应整数中的一个比特，
+扫描文本时每个字符只需常数次（大）整数运算，不再构造 (m+1)×(n+1) 的 DP 表。
+结果与传统动态规划的 LCS 长度完全一致。
+
+大小写等归一化由调用方负责：传入什么序列就按什么序列逐元素比较。
+"""
+
+import atexit
+import heapq
+import multiprocessing
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    _popcount = int.bit_count  # Python 3.10+
+except AttributeError:
+    def _popcount(x):
+        return bin(x).count('1')
+
+
+class CompiledQuery:
+    """预编译的查询：每个字符的位掩码只构造一次，可对任意多条文本重复打分"""
+
+    __slots__ = ('query', 'length', 'masks', 'full', '_histogram')
+
+    def __init__(self, query):
+        self.query = query
+        self.length = len(query)
+        masks = {}
+        bit = 1
+        for ch in query:
+            masks[ch] = masks.get(ch, 0) | bit
+            bit <<= 1
+        self.masks = masks
+        self.full = bit - 1
+        self._histogram = None
+
+    def score(self, text):
+        """返回查询与 text 的 LCS 长度"""
+        if not self.length:
+            return 0
+        masks = self.masks
+        full = self.full
+        v = full
+        for ch in text:
+            m = masks.get(ch)
+            if m:
+                # 不在查询中出现的字符不会改变状态向量，直接跳过
+                u = v & m
+                v = ((v + u) | (v - u)) & full
+        return self.length - _popcount(v)
+
+    def histogram_bound(self, text):
+        """LCS 的字符直方图上界：每个字符最多匹配 min(查询中次数, 文本中次数) 次"""
+        if self._histogram is None:
+            self._histogram = Counter(self.query)
+        counts = Counter(text)
+        return sum(min(n, counts[ch]) for ch, n in self._histogram.items())
+
+
+def compile_query(query):
+    """预编译查询串，返回 CompiledQuery"""
+    return CompiledQuery(query)
+
+
+def lcs_length(a, b):
+    """计算两个序列的 LCS 长度（一次性比较）"""
+    # Python 的循环开销远大于大整数运算，因此以较长者作为位向量、遍历较短者
+    if len(a) < len(b):
+        a, b = b, a
+    return CompiledQuery(a).score(b)
+
+
+class RankStats:
+    """top_k 的计数器，用于观察剪枝效果"""
+
+    __slots__ = ('candidates', 'computed', 'pruned_by_length', 'pruned_by_histogram', 'skipped_by_early_stop')
+
+    def __init__(self):
+        self.candidates = 0
+        self.computed = 0
+        self.pruned_by_length = 0
+        self.pruned_by_histogram = 0
+        self.skipped_by_early_stop = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def top_k(query, items, text, limit=None, stats=None):
+    """
+    按与 query 的 LCS 得分降序返回得分大于 0 的前 limit 项 [(score, item), ...]。
+
+    query 可以是原始序列或 CompiledQuery；text(item) 返回参与比较的（已归一化）文本。
+    同分时保持 items 的原有顺序，与“全部打分后稳定排序”的结果完全一致。
+    给定 limit 时用大小为 limit 的堆保存当前最优结果，上界（长度、字符直方图）
+    不超过第 limit 名得分的候选直接跳过；满分结果凑满 limit 个后提前结束。
+    """
+    compiled = query if isinstance(query, CompiledQuery) else CompiledQuery(query)
+    if stats is None:
+        stats = RankStats()
+    if limit is None:
+        scored = []
+        for item in items:
+            stats.candidates += 1
+            stats.computed += 1
+            score = compiled.score(text(item))
+            if score > 0:
+                scored.append((score, item))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return scored
+    if limit <= 0:
+        return []
+
+    best = compiled.length
+    # 堆顶是当前最差的结果：得分最低、同分时下标最大
+    heap = []
+    perfect = 0
+    for index, item in enumerate(items):
+        stats.candidates += 1
+        if perfect >= limit:
+            stats.skipped_by_early_stop += 1
+            continue
+        t = text(item)
+        if len(heap) == limit:
+            # 后出现的候选同分也排不到前面，因此上界等于门槛即可跳过
+            threshold = heap[0][0]
+            if min(best, len(t)) <= threshold:
+                stats.pruned_by_length += 1
+                continue
+            if compiled.histogram_bound(t) <= threshold:
+                stats.pruned_by_histogram += 1
+                continue
+        stats.computed += 1
+        score = compiled.score(t)
+        if score <= 0:
+            continue
+        if score == best:
+            perfect += 1
+        entry = (score, -index, item)
+        if len(heap) < limit:
+            heapq.heappush(heap, entry)
+        elif score > heap[0][0]:
+            heapq.heapreplace(heap, entry)
+    heap.sort(key=lambda e: (-e[0], -e[1]))
+    return [(score, item) for score, _, item in heap]
+
+
+def score_chunk(query, texts):
+    """进程池工作函数：返回 texts 中每条文本与 query 的 LCS 长度"""
+    compiled = CompiledQuery(query)
+    return [compiled.score(t) for t in texts]
+
+
+def _warm_up():
+    """进程池预热用的空任务"""
+    return os.getpid()
+
+
+class ParallelScorer:
+    """
+    多进程 LCS 打分：把候选切块后交给常驻的进程池并行计算，绕开 GIL。
+
+    进程池在 start() 时创建并预热（spawn 方式的子进程要到提交任务时才启动，
+    不预热的话第一次大搜索要付出全部启动开销），之后在整个进程生命周期内复用；
+    候选数低于 threshold 或未启用时退回进程内的 top_k，小用户不付出进程间通信的开销。
+    """
+
+    def __init__(self, workers=None, threshold=2000, chunk_size=256):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 1
+
+    def start(self):
+        with self._lock:
+            if self._executor is None and self.enabled:
+                # 使用 spawn 而不是 fork：start() 可能在多线程的 Web 进程中调用
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                atexit.register(self.shutdown)
+                # 每个工作进程一个空任务，等全部返回时子进程都已启动并完成导入
+                for future in [self._executor.submit(_warm_up) for _ in range(self.workers)]:
+                    future.result()
+        return self
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def top_k(self, query, items, text, limit=None, stats=None):
+        """与 lcs_engine.top_k 语义相同；query 为归一化后的查询串"""
+        items = list(items)
+        if len(items) < self.threshold or not self.enabled:
+            return top_k(query, items, text, limit=limit, stats=stats)
+        executor = self._executor or self.start()._executor
+        texts = [text(item) for item in items]
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        scores = []
+        for part in executor.map(score_chunk, [query] * len(chunks), chunks):
+            scores.extend(part)
+        if stats is not None:
+            stats.candidates += len(items)
+            stats.computed += len(items)
+        scored = [(score, item) for score, item in zip(scores, items) if score > 0]
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return scored if limit is None else scored[:limit]
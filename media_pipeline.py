@@ -0,0 +1,156 @@
+"""
+上传后的视频处理流水线：进程内任务队列 + 工作线程池，调用可替换的提取器获取元数据和封面。
+
+提取器的 extract(path, poster_path) 返回字典：size、duration、container、codec、width、height，
+以及 poster（是否已生成封面 JPEG）。有 ffprobe/ffmpeg 时用 FFmpegExtractor，否则退回只读取文件大小的 StubExtractor。
+外部命令在子进程中运行，不占用 GIL，几个线程就能让多个提取任务并行。
+"""
+
+import json
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class StubExtractor:
+    """不依赖外部工具：只记录文件大小和扩展名，不生成封面"""
+
+    def extract(self, path, poster_path):
+        return {
+            'size': os.path.getsize(path),
+            'duration': None,
+            'container': os.path.splitext(path)[1].lstrip('.').lower() or None,
+            'codec': None,
+            'width': None,
+            'height': None,
+            'poster': False,
+        }
+
+
+class FFmpegExtractor:
+    """用 ffprobe 读取容器与视频流信息，用 ffmpeg 截取一帧作为封面"""
+
+    def __init__(self, ffprobe='ffprobe', ffmpeg='ffmpeg', poster_width=320, timeout=120):
+        self.ffprobe = ffprobe
+        self.ffmpeg = ffmpeg
+        self.poster_width = poster_width
+        self.timeout = timeout
+
+    def probe(self, path):
+        result = subprocess.run(
+            [self.ffprobe, '-v', 'error', '-show_format', '-show_streams', '-of', 'json', path],
+            capture_output=True, check=True, timeout=self.timeout)
+        return json.loads(result.stdout or b'{}')
+
+    def make_poster(self, path, poster_path, duration):
+        # 跳过片头：取时长的 10%，最多第 10 秒
+        position = min(duration * 0.1, 10.0) if duration else 0.0
+        tmp_path = poster_path + '.tmp.jpg'
+        try:
+            subprocess.run(
+                [self.ffmpeg, '-v', 'error', '-y', '-ss', '%.2f' % position, '-i', path,
+                 '-frames:v', '1', '-vf', 'scale=%d:-2' % self.poster_width, tmp_path],
+                capture_output=True, check=True, timeout=self.timeout)
+            os.replace(tmp_path, poster_path)
+            return True
+        except (OSError, subprocess.SubprocessError) as exc:
+            logger.warning('生成封面失败 %s: %s', path, exc)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+    def extract(self, path, poster_path):
+        info = self.probe(path)
+        fmt = info.get('format', {})
+        stream = next((s for s in info.get('streams', []) if s.get('codec_type') == 'video'), {})
+        duration = float(fmt['duration']) if fmt.get('duration') else None
+        return {
+            'size': os.path.getsize(path),
+            'duration': duration,
+            'container': fmt.get('format_name'),
+            'codec': stream.get('codec_name'),
+            'width': stream.get('width'),
+            'height': stream.get('height'),
+            'poster': bool(stream) and self.make_poster(path, poster_path, duration),
+        }
+
+
+def default_extractor():
+    """PATH 中同时有 ffprobe 和 ffmpeg 时使用 FFmpegExtractor，否则使用 StubExtractor"""
+    ffprobe, ffmpeg = shutil.which('ffprobe'), shutil.which('ffmpeg')
+    if ffprobe and ffmpeg:
+        return FFmpegExtractor(ffprobe, ffmpeg)
+    return StubExtractor()
+
+
+class MediaPipeline:
+    """
+    后台任务队列。handler(job) 在工作线程中执行，异常会被记录而不会终止线程。
+    线程在第一次 start 或 submit 时启动；fork 出的子进程中会重新启动。
+    队列只在内存中，每个进程启动线程后调用 on_start(pipeline)，用来重新提交未完成的任务。
+    """
+
+    def __init__(self, handler, workers=2, on_start=None):
+        self.handler = handler
+        self.workers = workers
+        self.on_start = on_start
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self.done = 0
+        self.failed = 0
+
+    def start(self):
+        if self._pid == os.getpid():
+            return self
+        with self._lock:
+            if self._pid == os.getpid():
+                return self
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name='media-worker-%d' % i, daemon=True).start()
+        if self.on_start is not None:
+            try:
+                self.on_start(self)
+            except Exception:
+                logger.exception('重新提交未完成的任务失败')
+        return self
+
+    def _work(self):
+        jobs = self._queue
+        while True:
+            job = jobs.get()
+            try:
+                self.handler(job)
+                with self._lock:
+                    self.done += 1
+            except Exception:
+                logger.exception('处理任务 %r 失败', job)
+                with self._lock:
+                    self.failed += 1
+            finally:
+                jobs.task_done()
+
+    def submit(self, job):
+        if self._pid != os.getpid():
+            self.start()
+        self._queue.put(job)
+
+    def join(self):
+        """等待已提交的任务全部完成"""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queued': self._queue.qsize(),
+                'done': self.done,
+                'failed': self.failed,
+            }
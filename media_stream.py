@@ -0,0 +1,137 @@
+"""
+媒体文件的流式发送：Range / If-Range / 206、强 ETag，以及交给反向代理发送的卸载模式。
+
+- 请求范围一直延伸到文件末尾（浏览器拖动进度条时的 "bytes=N-"）或请求整个文件时，
+  把已定位的文件对象交给 wsgi.file_wrapper，gunicorn 等服务器会用 os.sendfile 零拷贝发送；
+- 中间的有界范围按块读取，只发送所请求的字节；
+- 卸载模式下只输出 X-Accel-Redirect（nginx）或 X-Sendfile（Apache、lighttpd）头，
+  由前端服务器完成范围请求与文件发送。调用方必须先做完权限检查。
+"""
+
+import mimetypes
+import os
+import re
+
+from flask import Response, request
+from werkzeug.http import http_date, parse_date, quote_etag, unquote_etag
+from werkzeug.wsgi import wrap_file
+
+BLOCK_SIZE = 64 * 1024
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_etag(stat):
+    """没有内容哈希时，用 inode、大小和修改时间生成 ETag；文件写入后不再修改，可视为强校验"""
+    return '%x-%x-%x' % (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def parse_range(header, size):
+    """
+    解析单个字节范围，返回闭区间 (start, end)。
+    没有 Range 头、多段范围或格式不对（包括结束位置小于起始位置）时返回 None，按 RFC 9110 忽略 Range、
+    返回完整文件；格式正确但无法满足（起始位置不小于文件大小）时返回 False。
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.group(0) == 'bytes=-':
+        return None
+    first, last = match.groups()
+    if not first:
+        # 后缀范围：最后 N 个字节
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+def _if_range_matches(if_range, etag, mtime):
+    """If-Range 只在校验器与当前文件一致时才允许返回部分内容；ETag 须强比较"""
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        value, weak = unquote_etag(if_range)
+        return not weak and value == etag
+    date = parse_date(if_range)
+    return date is not None and int(date.timestamp()) == int(mtime)
+
+
+def _iter_range(f, remaining):
+    try:
+        while remaining > 0:
+            block = f.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    finally:
+        f.close()
+
+
+def send_media(path, mimetype=None, etag=None, offload=None, accel_path=None, max_age=0):
+    """
+    发送 path 指向的文件。
+
+    etag 为内容哈希等强校验值，缺省时由文件元数据生成。
+    offload 为 'x-accel' 或 'x-sendfile' 时只输出卸载头：前者需要 accel_path（nginx internal location 下的路径），
+    后者使用文件的绝对路径。
+    """
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if offload == 'x-accel':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = accel_path
+        return response
+    if offload == 'x-sendfile':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+        return response
+
+    f = open(path, 'rb')
+    try:
+        stat = os.fstat(f.fileno())
+        size = stat.st_size
+        etag = etag or file_etag(stat)
+        headers = {
+            'Accept-Ranges': 'bytes',
+            'ETag': quote_etag(etag),
+            'Last-Modified': http_date(stat.st_mtime),
+            'Cache-Control': 'public, max-age=%d' % max_age if max_age else 'no-cache',
+        }
+        # If-None-Match 用弱比较：W/"x" 与 "x" 视为一致
+        if request.if_none_match.contains_weak(etag):
+            f.close()
+            return Response(status=304, headers=headers)
+
+        byte_range = None
+        if _if_range_matches(request.headers.get('If-Range'), etag, stat.st_mtime):
+            byte_range = parse_range(request.headers.get('Range'), size)
+        if byte_range is False:
+            f.close()
+            headers['Content-Range'] = 'bytes */%d' % size
+            return Response(status=416, headers=headers)
+
+        start, end = byte_range or (0, size - 1)
+        length = max(end - start + 1, 0)
+        f.seek(start)
+        if end == size - 1:
+            # 发送到文件末尾：交给 wsgi.file_wrapper，支持的服务器会走 sendfile
+            body = wrap_file(request.environ, f, BLOCK_SIZE)
+        else:
+            body = _iter_range(f, length)
+    except BaseException:
+        f.close()
+        raise
+
+    response = Response(body, status=206 if byte_range else 200, mimetype=mimetype,
+                        headers=headers, direct_passthrough=True)
+    response.content_length = length
+    if byte_range:
+        response.headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    return response
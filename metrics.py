@@ -0,0 +1,250 @@
+"""
+Prometheus 文本格式的 /metrics 接口：请求计数、按端点的延迟直方图、SQL 条数、分项耗时与缓存命中率。
+
+数据来自 perf 的请求采样（install() 会强制启用 perf）。多进程部署（gunicorn 多个 worker）时，
+各进程只在内存中累加，定期（以及被抓取时）把增量合并进同一个 SQLite 文件，/metrics 输出的是所有进程的总和，
+不会因为负载均衡随机落到某个 worker 而只看到一部分。已退出的 worker 已合并的计数仍然保留。
+
+访问控制：设置 METRICS_TOKEN 后须带 "Authorization: Bearer <令牌>"；
+未设置时只允许本机直接访问（经反向代理转发、带 X-Forwarded-For 的请求一律拒绝）。
+"""
+
+import hmac
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from flask import Response, abort, request
+
+import perf
+
+# 直方图桶上限（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+FAMILIES = {
+    'http_requests_total': ('counter', '请求数，按端点、方法和状态码'),
+    'http_request_duration_seconds': ('histogram', '请求处理耗时，按端点'),
+    'http_request_part_seconds_total': ('counter', '请求耗时按类别（db、template、markdown、lcs、captcha）累计'),
+    'db_queries_total': ('counter', '执行的 SQL 语句数，按端点'),
+    'cache_hits_total': ('counter', '缓存命中次数'),
+    'cache_misses_total': ('counter', '缓存未命中次数'),
+    'cache_hit_ratio': ('gauge', '缓存命中率（所有进程合计）'),
+}
+
+LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metrics (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (name, labels)
+) WITHOUT ROWID
+'''
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for key, value in sorted(labels.items()))
+
+
+def _split_le(labels):
+    """把标签串拆成 (去掉 le 后的标签串, le 的数值)；+Inf 解析为无穷大"""
+    pairs = LABEL_RE.findall(labels)
+    le = dict(pairs).get('le')
+    rest = ','.join('%s="%s"' % pair for pair in pairs if pair[0] != 'le')
+    return rest, float(le) if le is not None else None
+
+
+class Registry:
+    def __init__(self, database, flush_interval=5):
+        self.database = database
+        self.flush_interval = flush_interval
+        self._values = {}      # (name, labels) -> 本进程累计值
+        self._flushed = {}     # (name, labels) -> 已合并进数据库的值
+        self._caches = {}      # 名称 -> 返回 {'hits', 'misses'} 的函数
+        self._lock = threading.RLock()  # _start 持锁时调用 _collect
+        self._flush_lock = threading.Lock()
+        self._pid = None
+
+    def _start(self):
+        """fork 之后丢弃从父进程继承、尚未合并的增量，并启动本进程的合并线程"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # fork 出的子进程：缓存的命中计数同样继承自父进程，一并视为已合并
+                self._flushed = self._collect()
+            self._pid = os.getpid()
+        if self.flush_interval:
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def inc(self, name, labels, amount=1):
+        if self._pid != os.getpid():
+            self._start()
+        key = (name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """记录一次直方图观测：_bucket（累积）、_sum 与 _count"""
+        for bound in BUCKETS:
+            if value <= bound:
+                self.inc(name + '_bucket', _labels(le=bound, **labels))
+        self.inc(name + '_bucket', _labels(le='+Inf', **labels))
+        self.inc(name + '_sum', _labels(**labels), value)
+        self.inc(name + '_count', _labels(**labels))
+
+    def watch_cache(self, name, stats):
+        """stats() 返回本进程累计的 {'hits', 'misses'}，例如 caching.LRUCache.stats"""
+        self._caches[name] = stats
+
+    def _collect(self):
+        """本进程的计数快照，包括从各缓存读取的命中数"""
+        with self._lock:
+            values = dict(self._values)
+        for name, stats in self._caches.items():
+            data = stats()
+            values[('cache_hits_total', _labels(cache=name))] = data['hits']
+            values[('cache_misses_total', _labels(cache=name))] = data['misses']
+        return values
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(SCHEMA)
+        return conn
+
+    def flush(self):
+        """把上次合并以来的增量累加进共享数据库"""
+        if self._pid != os.getpid():
+            self._start()
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        values = self._collect()
+        deltas = [(name, labels, value - self._flushed.get((name, labels), 0))
+                  for (name, labels), value in values.items()]
+        deltas = [row for row in deltas if row[2]]
+        if not deltas:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany('INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?) '
+                                 'ON CONFLICT(name, labels) DO UPDATE SET value = value + excluded.value', deltas)
+        finally:
+            conn.close()
+        for name, labels, delta in deltas:
+            self._flushed[(name, labels)] = self._flushed.get((name, labels), 0) + delta
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass
+
+    def render(self):
+        """合并本进程的增量后，输出所有进程合计的 Prometheus 文本"""
+        self.flush()
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT name, labels, value FROM metrics ORDER BY name, labels').fetchall()
+        finally:
+            conn.close()
+
+        samples = {}
+        for name, labels, value in rows:
+            family = name
+            for suffix in ('_bucket', '_sum', '_count'):
+                if name.endswith(suffix) and name[:-len(suffix)] in FAMILIES:
+                    family = name[:-len(suffix)]
+            samples.setdefault(family, []).append((name, labels, value))
+
+        hits = {labels: value for name, labels, value in samples.get('cache_hits_total', [])}
+        misses = {labels: value for name, labels, value in samples.get('cache_misses_total', [])}
+        samples['cache_hit_ratio'] = [('cache_hit_ratio', labels, value / (value + misses.get(labels, 0)))
+                                      for labels, value in hits.items() if value + misses.get(labels, 0)]
+
+        lines = []
+        for family, (kind, help_text) in FAMILIES.items():
+            if not samples.get(family):
+                continue
+            lines.append('# HELP %s %s' % (family, help_text))
+            lines.append('# TYPE %s %s' % (family, kind))
+            rows = _histogram_order(family, samples[family]) if kind == 'histogram' else samples[family]
+            for name, labels, value in rows:
+                lines.append('%s{%s} %s' % (name, labels, repr(float(value))) if labels else
+                             '%s %s' % (name, repr(float(value))))
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_order(family, rows):
+    """
+    按序列（去掉 le 的标签集）分组：每组先输出按 le 数值递增、+Inf 在最后的 _bucket，
+    再输出 _sum 和 _count，符合 Prometheus 文本格式的要求
+    """
+    series = {}
+    for name, labels, value in rows:
+        suffix = name[len(family):]
+        rest, le = _split_le(labels)
+        group = series.setdefault(rest, {'_bucket': [], '_sum': [], '_count': []})
+        group[suffix].append((le if suffix == '_bucket' else 0, name, labels, value))
+    ordered = []
+    for rest in sorted(series):
+        for suffix in ('_bucket', '_sum', '_count'):
+            ordered.extend(row[1:] for row in sorted(series[rest][suffix], key=lambda row: row[0]))
+    return ordered
+
+
+registry = None
+
+
+def _record(stats, response):
+    endpoint = request.endpoint or 'unmatched'
+    registry.inc('http_requests_total', _labels(endpoint=endpoint, method=request.method, status=response.status_code))
+    registry.observe('http_request_duration_seconds', stats.elapsed, endpoint=endpoint)
+    if stats.queries:
+        registry.inc('db_queries_total', _labels(endpoint=endpoint), stats.queries)
+    for category, seconds in stats.timings.items():
+        registry.inc('http_request_part_seconds_total', _labels(endpoint=endpoint, category=category), seconds)
+
+
+def _allowed(app):
+    token = app.config.get('METRICS_TOKEN')
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        return hmac.compare_digest(supplied.encode('utf-8'), ('Bearer ' + token).encode('utf-8'))
+    return request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+
+
+def install(app):
+    """METRICS_ENABLED 为真时注册 /metrics 并开始采集；返回 Registry（未启用时返回 None）"""
+    global registry
+    if not app.config.get('METRICS_ENABLED'):
+        return None
+    registry = Registry(app.config.get('METRICS_DATABASE', './metrics.db'),
+                        flush_interval=app.config.get('METRICS_FLUSH_INTERVAL', 5))
+    perf.install(app, force=True)
+    perf.listeners.append(_record)
+
+    def metrics():
+        if not _allowed(app):
+            abort(404)
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    return registry
+
+
+def watch_cache(name, stats):
+    """登记一个缓存的命中统计；未启用指标时什么都不做"""
+    if registry is not None:
+        registry.watch_cache(name, stats)
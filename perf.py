@@ -0,0 +1,283 @@
+"""
+请求级性能采样：把一次请求的耗时拆分为数据库、模板渲染、Markdown、LCS、验证码等类别，并统计 SQL 条数。
+
+- sqlite3：用 connect() 或 connection_class() 创建连接，trace 回调为每条语句计数，TimedConnection/TimedCursor 计时；
+- SQLAlchemy：引擎的 before/after_cursor_execute 事件计数并计时；
+- 模板：Flask 的 before_render_template / template_rendered 信号；
+- 其他代码段用 timer(类别) 或 @timed(类别) 包裹。
+
+各类别之间可能重叠，例如模板中触发的惰性加载既计入模板时间也计入数据库时间。
+超过 PERF_SLOW_MS 毫秒或 PERF_SLOW_QUERIES 条 SQL 的请求记一条警告日志；PERF_SERVER_TIMING 为真时附加 Server-Timing 响应头。
+单条语句执行超过 PERF_SLOW_QUERY_MS 毫秒时另记一条慢查询日志（语句与参数）。
+
+未启用（PERF_ENABLED 为假）时不注册任何钩子、不替换连接类，timer()/timed() 只多一次全局变量判断。
+"""
+
+import functools
+import logging
+import sqlite3
+import time
+from contextlib import nullcontext
+
+from flask import g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+
+logger = logging.getLogger(__name__)
+
+enabled = False
+slow_ms = 500
+slow_queries = 50
+server_timing = False
+slow_query_ms = 100
+# 请求结束时依次调用 listener(stats, response)，供指标导出等使用
+listeners = []
+# 每条语句执行后调用 listener(statement, parameters, seconds)，供查询审计等使用
+statement_listeners = []
+
+_NULL_TIMER = nullcontext()
+
+
+class RequestStats:
+    """一次请求的采样结果：timings 为 {类别: 秒}，queries 为 SQL 条数"""
+
+    __slots__ = ('start', 'elapsed', 'queries', 'timings', '_template_starts')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+        self.queries = 0
+        self.timings = {}
+        self._template_starts = []
+
+    def add(self, category, seconds):
+        self.timings[category] = self.timings.get(category, 0.0) + seconds
+
+
+def current():
+    """当前请求的 RequestStats；未启用或不在请求中（如后台线程）时返回 None"""
+    if enabled and has_request_context():
+        return g.get('_perf')
+    return None
+
+
+class _Timer:
+    __slots__ = ('stats', 'category', 'start')
+
+    def __init__(self, stats, category):
+        self.stats = stats
+        self.category = category
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add(self.category, time.perf_counter() - self.start)
+
+
+def timer(category):
+    """with perf.timer('lcs'): ... 把代码段的耗时计入当前请求的某个类别"""
+    if not enabled:
+        return _NULL_TIMER
+    stats = current()
+    if stats is None:
+        return _NULL_TIMER
+    return _Timer(stats, category)
+
+
+def timed(category):
+    """函数装饰器版本的 timer()"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with timer(category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ---- sqlite3 ----
+
+def _count_statement(statement):
+    # 触发器中的语句以 "-- TRIGGER" 形式回调，不单独计数
+    if statement.startswith('--'):
+        return
+    stats = current()
+    if stats is not None:
+        stats.queries += 1
+
+
+def _statement_done(statement, parameters, seconds):
+    if seconds * 1000 >= slow_query_ms:
+        logger.warning('慢查询 %.1f ms：%s %r', seconds * 1000, statement, parameters)
+    for listener in statement_listeners:
+        listener(statement, parameters, seconds)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """execute 与逐行读取都计入 db 类别（SELECT 的大部分工作发生在取行时）"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            seconds = time.perf_counter() - start
+            stats = current()
+            if stats is not None:
+                stats.add('db', seconds)
+            _statement_done(sql, parameters, seconds)
+
+    def executemany(self, sql, seq_of_parameters):
+        # 参数序列可能是生成器，慢查询日志与审计只拿到 None
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            seconds = time.perf_counter() - start
+            stats = current()
+            if stats is not None:
+                stats.add('db', seconds)
+            _statement_done(sql, None, seconds)
+
+    def executescript(self, *args):
+        with timer('db'):
+            return super().executescript(*args)
+
+    def fetchone(self):
+        with timer('db'):
+            return super().fetchone()
+
+    def fetchmany(self, *args):
+        with timer('db'):
+            return super().fetchmany(*args)
+
+    def fetchall(self):
+        with timer('db'):
+            return super().fetchall()
+
+    def __next__(self):
+        with timer('db'):
+            return super().__next__()
+
+
+class TimedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_trace_callback(_count_statement)
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute 等快捷方法在 C 层直接执行，不经过 Cursor.execute，这里改为走 TimedCursor
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
+
+    def commit(self):
+        with timer('db'):
+            return super().commit()
+
+
+def connection_class():
+    """启用时返回 TimedConnection，否则返回普通的 sqlite3.Connection"""
+    return TimedConnection if enabled else sqlite3.Connection
+
+
+def connect(database, **kwargs):
+    """与 sqlite3.connect 相同，启用时创建带计时与计数的连接"""
+    return sqlite3.connect(database, factory=connection_class(), **kwargs)
+
+
+# ---- SQLAlchemy ----
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._perf_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is None:
+        return
+    seconds = time.perf_counter() - context._perf_start
+    stats = current()
+    if stats is not None:
+        stats.queries += 1
+        stats.add('db', seconds)
+    _statement_done(statement, None if executemany else parameters, seconds)
+
+
+def _watch_sqlalchemy():
+    try:
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+    except ImportError:
+        return
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+# ---- 请求钩子 ----
+
+def _template_start(sender, template, context, **extra):
+    stats = current()
+    if stats is not None:
+        stats._template_starts.append(time.perf_counter())
+
+
+def _template_end(sender, template, context, **extra):
+    stats = current()
+    if stats is not None and stats._template_starts:
+        stats.add('template', time.perf_counter() - stats._template_starts.pop())
+
+
+def _start_request():
+    g._perf = RequestStats()
+
+
+def _finish_request(response):
+    stats = g.pop('_perf', None)
+    if stats is None:
+        return response
+    stats.elapsed = time.perf_counter() - stats.start
+    if server_timing:
+        parts = ['%s;dur=%.2f' % (name, seconds * 1000) for name, seconds in stats.timings.items()]
+        parts.append('total;dur=%.2f;desc="%d SQL"' % (stats.elapsed * 1000, stats.queries))
+        response.headers['Server-Timing'] = ', '.join(parts)
+    if stats.elapsed * 1000 >= slow_ms or stats.queries >= slow_queries:
+        logger.warning('慢请求 %s %s：%.1f ms，%d 条 SQL，%s', request.method, request.full_path.rstrip('?'),
+                       stats.elapsed * 1000, stats.queries,
+                       ', '.join('%s %.1f ms' % (name, seconds * 1000) for name, seconds in stats.timings.items()))
+    for listener in listeners:
+        listener(stats, response)
+    return response
+
+
+def install(app, force=False):
+    """
+    按 app.config 中的 PERF_* 配置启用采样；PERF_ENABLED 为假时什么都不做。
+    force 为真时忽略 PERF_ENABLED（metrics 依赖这里的采样）；重复调用只安装一次。
+    """
+    global enabled, slow_ms, slow_queries, server_timing, slow_query_ms
+    if not (force or app.config.get('PERF_ENABLED')) or 'perf' in app.extensions:
+        return
+    app.extensions['perf'] = True
+    enabled = True
+    slow_ms = app.config.get('PERF_SLOW_MS', slow_ms)
+    slow_queries = app.config.get('PERF_SLOW_QUERIES', slow_queries)
+    server_timing = app.config.get('PERF_SERVER_TIMING', server_timing)
+    slow_query_ms = app.config.get('PERF_SLOW_QUERY_MS', slow_query_ms)
+    # 放在最前面：开始计时早于其他 before_request 钩子，after_request 按注册的逆序执行，因此最后结束
+    app.before_request_funcs.setdefault(None, []).insert(0, _start_request)
+    app.after_request_funcs.setdefault(None, []).insert(0, _finish_request)
+    before_render_template.connect(_template_start, app)
+    template_rendered.connect(_template_end, app)
+    _watch_sqlalchemy()
@@ -0,0 +1,110 @@
+"""
+搜索索引辅助：把文本切分成 n-gram，用于在 LCS 精排之前快速筛选候选集。
+
+拉丁字母、数字等按字符三元组（trigram）切分；中日韩文字没有空格分词，
+按二元组（bigram）切分，兼顾召回率与索引体积。
+"""
+
+import bisect
+import re
+import sqlite3
+import threading
+
+import lcs_engine
+
+# 中日韩统一表意文字、假名与谚文音节
+_CJK = '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+_TOKEN_RE = re.compile('([%s]+)|([^\\W_%s]+)' % (_CJK, _CJK))
+
+TRIGRAM = 3
+CJK_GRAM = 2
+
+
+def extract_grams(text):
+    """返回文本的 n-gram 集合（统一转小写）；长度不足一个 gram 的片段不产生 gram"""
+    grams = set()
+    for cjk, word in _TOKEN_RE.findall(text.lower()):
+        run, n = (cjk, CJK_GRAM) if cjk else (word, TRIGRAM)
+        for i in range(len(run) - n + 1):
+            grams.add(run[i:i + n])
+    return grams
+
+
+class UsernameIndex:
+    """
+    进程内的用户名索引：按 ID 有序的数组 + 字符倒排表。
+
+    LCS 得分大于 0 当且仅当两串至少有一个公共字符，因此用单字符倒排表取并集得到的候选集
+    与逐行扫描 users 表完全一致，只是不再读库、也不再为每行构造对象。
+    其他进程写库后，本进程通过专用连接上的 PRAGMA data_version 感知并增量刷新。
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._ids = []          # 按 ID 升序，保持与全表扫描相同的并列顺序
+        self._names = {}        # id -> username
+        self._postings = {}     # 小写字符 -> 包含该字符的用户 ID 集合
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.database, check_same_thread=False)
+        return self._conn
+
+    def _insert(self, user_id, username):
+        if user_id in self._names:
+            return
+        bisect.insort(self._ids, user_id)
+        self._names[user_id] = username
+        for ch in set(username.lower()):
+            self._postings.setdefault(ch, set()).add(user_id)
+
+    def load(self):
+        """从数据库全量加载"""
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        conn = self._connect()
+        self._data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        self._ids, self._names, self._postings = [], {}, {}
+        for user_id, username in conn.execute('SELECT id, username FROM users ORDER BY id'):
+            self._insert(user_id, username)
+
+    def _refresh(self):
+        conn = self._connect()
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if version == self._data_version:
+            return
+        self._data_version = version
+        # 用户只会新增，按 ID 增量拉取即可；总数对不上（有删除）时再全量重建
+        last_id = self._ids[-1] if self._ids else 0
+        for user_id, username in conn.execute('SELECT id, username FROM users WHERE id > ?', (last_id,)):
+            self._insert(user_id, username)
+        if conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] != len(self._ids):
+            self._load()
+
+    def add(self, user_id, username):
+        """注册成功后由本进程直接登记新用户"""
+        with self._lock:
+            if self._data_version is None:
+                self._load()
+            self._insert(user_id, username)
+
+    def search(self, query, limit=None):
+        """返回按 LCS 得分降序（同分按 ID 升序）排列的 (id, username) 列表，只包含得分大于 0 的用户"""
+        query = query.lower()
+        with self._lock:
+            if self._data_version is None:
+                self._load()
+            else:
+                self._refresh()
+            candidate_ids = set()
+            for ch in set(query):
+                candidate_ids |= self._postings.get(ch, set())
+            # 候选按 ID 升序排列，top_k 的稳定排序保证同分按 ID 升序
+            candidates = [(user_id, self._names[user_id]) for user_id in sorted(candidate_ids)]
+        ranked = lcs_engine.top_k(query, candidates, lambda c: c[1].lower(), limit=limit)
+        return [candidate for score, candidate in ranked]
@@ -0,0 +1,123 @@
+"""
+有界的 SQLite 连接池。
+
+连接在第一次需要时创建、初始化一次 PRAGMA，之后在请求之间反复复用；
+池满时借用方最多等待 timeout 秒。stats() 报告借出次数、等待次数与打开的连接数，便于调整池大小。
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+DEFAULT_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),        # 负数表示 KiB，约 16MB
+    ('mmap_size', 256 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+)
+
+
+class PoolTimeout(Exception):
+    """等待空闲连接超时"""
+
+
+class SQLitePool:
+    def __init__(self, database, size=8, timeout=10.0, pragmas=DEFAULT_PRAGMAS, row_factory=sqlite3.Row,
+                 factory=sqlite3.Connection):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.row_factory = row_factory
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # 后进先出：优先复用刚归还、页缓存还热的连接
+        self._idle = queue.LifoQueue()
+        self._open = 0
+        self._pid = os.getpid()
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=self.timeout, check_same_thread=False, factory=self.factory)
+        conn.row_factory = self.row_factory
+        for name, value in self.pragmas:
+            conn.execute('PRAGMA %s = %s' % (name, value))
+        return conn
+
+    def acquire(self):
+        """借出一个连接；池已满时等待其他请求归还"""
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork 之后不能复用父进程的连接
+                self._reset()
+            self._checkouts += 1
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if self._open < self.size:
+                self._open += 1
+                create = True
+            else:
+                self._waits += 1
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                raise
+        start = time.perf_counter()
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout('%d 个连接均被占用，等待 %.1f 秒后超时' % (self.size, self.timeout))
+        finally:
+            with self._lock:
+                self._wait_time += time.perf_counter() - start
+
+    def release(self, conn):
+        """归还连接；未提交的事务会被回滚，避免泄漏到下一个请求"""
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            with self._lock:
+                self._open -= 1
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._open -= 1
+
+    def stats(self):
+        with self._lock:
+            idle = self._idle.qsize()
+            return {
+                'size': self.size,
+                'open': self._open,
+                'idle': idle,
+                'in_use': self._open - idle,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time': round(self._wait_time, 6),
+            }
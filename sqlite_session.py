@@ -0,0 +1,250 @@
+"""
+保存在 SQLite 中的服务器端会话，取代 Flask-Session 的 filesystem 后端（每个会话一个文件、没有清理）。
+
+- 所有会话存放在一张 WAL 模式的表中，过期时间列带索引；
+- 只有会话内容被修改时才写库；未修改的会话只在剩余有效期不足一半时续期一次；
+- 过期会话由后台线程定期分批删除，请求路径上不做清理；
+- 进程内有一层按会话 ID 的读缓存。每次写入会话的同一事务中，把会话 ID 追加到 session_changes 变更日志；
+  其他连接（别的 worker 进程）提交写入后 PRAGMA data_version 会变化，此时读取新增的日志，
+  只作废被改动的那几个会话，保证注销等修改立即在所有进程生效，其余会话的缓存不受影响。
+"""
+
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+
+import caching
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires);
+CREATE TABLE IF NOT EXISTS session_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL,
+    changed INTEGER NOT NULL
+);
+'''
+
+
+class SQLiteSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.modified = False
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """
+    database 为会话库文件；lifetime 为服务器端的空闲过期秒数（缺省取 PERMANENT_SESSION_LIFETIME）。
+    sweep_interval 秒清理一次过期会话，每批最多删除 sweep_batch 行；cache_size 为读缓存容量，0 表示不缓存。
+    变更日志保留 change_retention 秒，空闲超过这段时间的进程再读取时会清空整层缓存。
+    """
+
+    serializer = session_json_serializer
+
+    def __init__(self, database, lifetime=None, sweep_interval=300, sweep_batch=500, cache_size=1024,
+                 change_retention=3600):
+        self.database = database
+        self.lifetime = lifetime
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.cache = caching.LRUCache(maxsize=cache_size) if cache_size else None
+        self.change_retention = change_retention
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._data_version = None
+        self._seen_change = 0
+        self.reads = 0
+        self.writes = 0
+        self.touches = 0
+        self.skipped = 0
+        self.swept = 0
+        self.invalidated = 0
+
+    # ---- 连接与后台清理 ----
+
+    def _connection(self):
+        """每个进程一个连接，由 _lock 串行化；fork 后重新连接并启动清理线程"""
+        if self._pid != os.getpid():
+            conn = sqlite3.connect(self.database, timeout=10, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.executescript(SCHEMA)
+            self._conn = conn
+            self._pid = os.getpid()
+            self._data_version = None
+            self._seen_change = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM session_changes').fetchone()[0]
+            if self.cache is not None:
+                self.cache.clear()
+            if self.sweep_interval:
+                threading.Thread(target=self._sweep_loop, name='session-sweeper', daemon=True).start()
+        return self._conn
+
+    def _check_cache(self, conn):
+        """其他连接提交过写入时，按变更日志作废被改动的会话"""
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if version == self._data_version:
+            return
+        self._data_version = version
+        rows = conn.execute('SELECT seq, id FROM session_changes WHERE seq > ? ORDER BY seq',
+                            (self._seen_change,)).fetchall()
+        if not rows:
+            return
+        if rows[0][0] != self._seen_change + 1:
+            # 中间的日志已被清理，无法知道改了哪些会话
+            self.cache.clear()
+        else:
+            for _, sid in rows:
+                self.cache.invalidate(sid)
+            self.invalidated += len(rows)
+        self._seen_change = rows[-1][0]
+
+    def _log_change(self, conn, sid):
+        # 本进程不缓存也要记日志，其他进程的缓存依赖它
+        conn.execute('INSERT INTO session_changes (id, changed) VALUES (?, ?)', (sid, int(time.time())))
+
+    def sweep(self):
+        """删除已过期的会话，分批提交以免长时间持有写锁；返回删除的行数"""
+        total = 0
+        while True:
+            with self._lock:
+                conn = self._connection()
+                deleted = conn.execute(
+                    'DELETE FROM sessions WHERE id IN '
+                    '(SELECT id FROM sessions WHERE expires < ? LIMIT ?)',
+                    (int(time.time()), self.sweep_batch)).rowcount
+                # 过期会话已无人使用，删除它们不必写变更日志；日志本身按保留时间清理
+                pruned = conn.execute(
+                    'DELETE FROM session_changes WHERE seq IN '
+                    '(SELECT seq FROM session_changes WHERE changed < ? ORDER BY seq LIMIT ?)',
+                    (int(time.time()) - self.change_retention, self.sweep_batch)).rowcount
+                self.swept += deleted
+            total += deleted
+            if deleted < self.sweep_batch and pruned < self.sweep_batch:
+                return total
+
+    def _sweep_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except sqlite3.Error:
+                pass
+
+    # ---- 读写 ----
+
+    def _load(self, sid):
+        """返回 (data, expires)；不存在或已过期时返回 None"""
+        with self._lock:
+            conn = self._connection()
+            if self.cache is not None:
+                self._check_cache(conn)
+                row = self.cache.get(sid)
+            else:
+                row = None
+            if row is None:
+                self.reads += 1
+                row = conn.execute('SELECT data, expires FROM sessions WHERE id = ?', (sid,)).fetchone()
+                if row is not None and self.cache is not None:
+                    self.cache.set(sid, row)
+        if row is None or row[1] < time.time():
+            return None
+        return row
+
+    def _store(self, sid, data, expires):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('INSERT INTO sessions (id, data, expires) VALUES (?, ?, ?) '
+                             'ON CONFLICT(id) DO UPDATE SET data = excluded.data, expires = excluded.expires',
+                             (sid, data, expires))
+                self._log_change(conn, sid)
+            if self.cache is not None:
+                self.cache.set(sid, (data, expires))
+
+    def _delete(self, sid):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('DELETE FROM sessions WHERE id = ?', (sid,))
+                self._log_change(conn, sid)
+            if self.cache is not None:
+                self.cache.invalidate(sid)
+
+    def _lifetime(self, app):
+        return int(self.lifetime or app.permanent_session_lifetime.total_seconds())
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            row = self._load(sid)
+            if row is not None:
+                try:
+                    return SQLiteSession(self.serializer.loads(row[0]), sid=sid, expires=row[1])
+                except ValueError:
+                    pass
+        return SQLiteSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            # 会话被清空（如注销）：删除记录和 Cookie；从未写入过的空会话什么都不做
+            if session.sid is not None:
+                self._delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = self._lifetime(app)
+        now = int(time.time())
+        if session.modified or session.sid is None:
+            sid = session.sid or secrets.token_urlsafe(32)
+            self._store(sid, self.serializer.dumps(dict(session)), now + lifetime)
+            self.writes += 1
+        elif session.expires - now < lifetime // 2:
+            # 内容没变，只在有效期过半时续期，而不是每个请求都写一次
+            sid = session.sid
+            self._store(sid, self.serializer.dumps(dict(session)), now + lifetime)
+            self.touches += 1
+        else:
+            self.skipped += 1
+            return
+
+        response.set_cookie(
+            name, sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def stats(self):
+        return {
+            'reads': self.reads,
+            'writes': self.writes,
+            'touches': self.touches,
+            'skipped': self.skipped,
+            'swept': self.swept,
+            'invalidated': self.invalidated,
+            'cache': self.cache.stats() if self.cache is not None else None,
+        }
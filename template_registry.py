@@ -0,0 +1,23 @@
+"""
+模块内字符串模板的注册表。
+
+把 {名称: 模板源码} 注册到应用的 Jinja 环境中，启动时统一编译一次，之后按名称用 render_template 渲染，
+不再像 render_template_string 那样每个请求都重新解析、编译源码。
+可选的磁盘字节码缓存让新启动的 worker 跳过编译，直接加载上次生成的字节码。
+"""
+
+import os
+
+from jinja2 import ChoiceLoader, DictLoader, FileSystemBytecodeCache
+
+
+def register_templates(app, templates, bytecode_dir=None):
+    """注册并预编译模板；templates 为 {名称: 源码}，优先级高于 templates/ 目录下的同名文件"""
+    env = app.jinja_env
+    env.loader = ChoiceLoader([DictLoader(templates), env.loader])
+    if bytecode_dir:
+        os.makedirs(bytecode_dir, exist_ok=True)
+        env.bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+    # 编译结果缓存在环境中（默认容量 400 个模板），DictLoader 以源码是否变化判断是否过期
+    for name in templates:
+        env.get_template(name)
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import perf
+
+
+@pytest.fixture(autouse=True)
+def perf_state(monkeypatch):
+    """perf 的开关和监听器是模块级的，每个测试结束后恢复，避免互相影响"""
+    for name in ('enabled', 'slow_ms', 'slow_queries', 'server_timing', 'slow_query_ms'):
+        monkeypatch.setattr(perf, name, getattr(perf, name))
+    monkeypatch.setattr(perf, 'listeners', [])
+    monkeypatch.setattr(perf, 'statement_listeners', [])
+
+
+def load_app(path, workdir, monkeypatch):
+    """
+    在 workdir 中执行应用文件并返回模块；相对路径的数据库等都落在 workdir 下。
+    捆绑了模板的文件只执行 Python 部分。
+    """
+    monkeypatch.chdir(workdir)
+    with open(os.path.join(ROOT, path), encoding='utf-8') as f:
+        source = f.read()
+    for marker in ('\n```', '\n<!doctype html>'):
+        if marker in source:
+            source = source[:source.index(marker)]
+    # 模块名不能被导入，否则 Flask 会按它找到仓库中的原文件，把 instance 目录放到仓库里
+    module = type(sys)('loaded_' + os.path.splitext(os.path.basename(path))[0])
+    module.__file__ = os.path.join(ROOT, path)
+    exec(compile(source, module.__file__, 'exec'), module.__dict__)
+    module.app.config['WTF_CSRF_ENABLED'] = False
+    return module
@@ -0,0 +1,27 @@
+import pytest
+
+from conftest import load_app
+
+
+@pytest.fixture
+def notes_app(tmp_path, monkeypatch):
+    module = load_app('app.py', tmp_path, monkeypatch)
+    with module.app.app_context():
+        module.initializeDatabase()
+        yield module
+    module.searchScorer.shutdown()
+
+
+def test_page_returns_preview_without_touching_content(notes_app):
+    conn = notes_app.get_db()
+    conn.execute("INSERT INTO users (username, password) VALUES ('amy', 'x')")
+    for i in range(3):
+        conn.execute('INSERT INTO notes (userId, title, content) VALUES (1, ?, ?)',
+                     ('t%d' % i, 'body number %d' % i))
+    conn.commit()
+
+    page, nextBefore = notes_app.Note.getPage(1, limit=2, previewChars=4)
+    assert [(n.title, n.preview) for n in page] == [('t2', 'body'), ('t1', 'body')]
+    assert not any(isinstance(n, notes_app.Note) for n in page)
+    assert nextBefore == page[-1].id
+    assert notes_app.Note.get(page[0].id, 1).content == 'body number 2'
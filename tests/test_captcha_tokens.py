@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+import captcha
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def tokens(request, tmp_path):
+    if request.param == 'memory':
+        replay = captcha.MemoryReplaySet()
+    else:
+        replay = captcha.SQLiteReplaySet(str(tmp_path / 'replay.db'))
+    return captcha.CaptchaTokens('secret', ttl=60, replay=replay)
+
+
+def test_correct_answer_accepted_once(tokens):
+    token = tokens.issue()
+    answer = tokens.answer(token)
+    assert len(answer) == 4 and answer.isdigit()
+    assert tokens.verify(token, answer)
+    # 重放同一令牌，即使答案正确也拒绝
+    assert not tokens.verify(token, answer)
+    assert tokens.answer(token) == answer
+
+
+def test_wrong_answer_consumes_token(tokens):
+    token = tokens.issue()
+    answer = tokens.answer(token)
+    wrong = '0000' if answer != '0000' else '1111'
+    assert not tokens.verify(token, wrong)
+    assert not tokens.verify(token, answer)
+
+
+def test_tampered_token_rejected(tokens):
+    token = tokens.issue()
+    nonce, expires, signature = token.split('.')
+    other_nonce = tokens.issue().split('.')[0]
+    forged = [
+        '%s.%s.%s' % (other_nonce, expires, signature),       # 换 nonce
+        '%s.%d.%s' % (nonce, int(expires) + 3600, signature),  # 延长有效期
+        '%s.%s.%s' % (nonce, expires, signature[:-2] + ('AA' if signature[-2:] != 'AA' else 'BB')),
+        '%s.%s' % (nonce, expires),
+        '',
+        None,
+    ]
+    for value in forged:
+        assert tokens.answer(value) is None
+        assert not tokens.verify(value, tokens.answer(token))
+    # 用别的密钥签发的令牌同样无效
+    other = captcha.CaptchaTokens('another secret', ttl=60)
+    foreign = other.issue()
+    assert not tokens.verify(foreign, other.answer(foreign))
+    # 篡改失败没有消费原令牌
+    assert tokens.verify(token, tokens.answer(token))
+
+
+def test_expired_token_rejected(tokens, monkeypatch):
+    token = tokens.issue()
+    answer = tokens.answer(token)
+    now = time.time()
+    monkeypatch.setattr(captcha.time, 'time', lambda: now + 61)
+    assert tokens.answer(token) is None
+    assert not tokens.verify(token, answer)
+
+
+def test_replay_shared_between_instances(tmp_path):
+    """多个 worker 进程各自构造 CaptchaTokens，共享同一个 SQLite 重放集合"""
+    path = str(tmp_path / 'replay.db')
+    first = captcha.CaptchaTokens('secret', replay=captcha.SQLiteReplaySet(path))
+    second = captcha.CaptchaTokens('secret', replay=captcha.SQLiteReplaySet(path))
+    token = first.issue()
+    assert second.verify(token, first.answer(token))
+    assert not first.verify(token, first.answer(token))
+
+
+def test_concurrent_verify_accepts_once(tokens):
+    token = tokens.issue()
+    answer = tokens.answer(token)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(tokens.verify(token, answer))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 1
+
+
+def stored_nonces(replay):
+    if isinstance(replay, captcha.MemoryReplaySet):
+        return set(replay._used)
+    return {row[0] for row in replay._connection().execute('SELECT nonce FROM %s' % replay.table)}
+
+
+def test_expired_nonces_purged(tokens, monkeypatch):
+    token = tokens.issue()
+    assert tokens.verify(token, tokens.answer(token))
+    old = token.split('.')[0]
+    assert stored_nonces(tokens.replay) == {old}
+
+    now = time.time()
+    monkeypatch.setattr(captcha.time, 'time', lambda: now + 3600)
+    fresh = tokens.issue()
+    assert tokens.verify(fresh, tokens.answer(fresh))
+    # 过期的 nonce 已被清理；对应的令牌本身也已过期，不会因此被重放
+    assert stored_nonces(tokens.replay) == {fresh.split('.')[0]}
+    assert not tokens.verify(token, tokens.answer(token))
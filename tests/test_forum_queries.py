@@ -0,0 +1,89 @@
+import os
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+import perf
+from conftest import ROOT, load_app
+
+FORUM = os.path.join('新的项目', '论坛.py')
+
+
+def extract_templates(folder):
+    """论坛的模板附在代码之后，以 --- 分隔，每节标题中给出文件名"""
+    with open(os.path.join(ROOT, FORUM), encoding='utf-8') as f:
+        source = f.read()
+    parts = re.split(r'\n---\s*\n', source[source.index('\n<!doctype html>'):])
+    os.makedirs(folder)
+    with open(os.path.join(folder, 'base.html'), 'w', encoding='utf-8') as f:
+        f.write(parts[0].strip())
+    for part in parts[1:]:
+        match = re.search(r'###\s*\d+\.\s*\S+\s+(\w+\.html)[^\n]*\n(.*)', part, re.S)
+        if match:
+            with open(os.path.join(folder, match.group(1)), 'w', encoding='utf-8') as f:
+                f.write(re.sub(r'^\s*```\w*\s*$', '', match.group(2), flags=re.M).strip())
+
+
+@pytest.fixture
+def forum(tmp_path, monkeypatch):
+    module = load_app(FORUM, tmp_path, monkeypatch)
+    extract_templates(str(tmp_path / 'templates'))
+    module.app.template_folder = str(tmp_path / 'templates')
+    perf.install(module.app, force=True)
+    with module.app.app_context():
+        module.init_db()
+        module.db.session.add_all([module.User(username='amy'), module.User(username='bob')])
+        module.db.session.commit()
+    client = module.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+    return module, client
+
+
+def add_posts(module, count):
+    """每个用户各发 count 条说说，每条带 3 条评论"""
+    db, Post, Comment = module.db, module.Post, module.Comment
+    start = datetime(2024, 1, 1)
+    with module.app.app_context():
+        existing = Post.query.count()
+        for i in range(existing, existing + count * 2):
+            post = Post(content='说说 %d' % i, user_id=i % 2 + 1, timestamp=start + timedelta(minutes=i))
+            db.session.add(post)
+            db.session.flush()
+            db.session.add_all(Comment(content='评论', user_id=j % 2 + 1, post_id=post.id,
+                                       timestamp=post.timestamp + timedelta(seconds=j)) for j in range(3))
+        module.repair_counters()
+
+
+def queries(client, url):
+    client.get(url)  # 先让用户缓存命中，只比较页面本身的查询
+    counts = []
+    perf.listeners.append(lambda stats, response: counts.append(stats.queries))
+    assert client.get(url).status_code == 200
+    perf.listeners.pop()
+    return counts[0]
+
+
+@pytest.mark.parametrize('url', ['/', '/user/amy'])
+def test_queries_per_page_do_not_grow_with_posts(forum, url):
+    module, client = forum
+    add_posts(module, 1)
+    few = queries(client, url)
+    add_posts(module, module.app.config['POSTS_PER_PAGE'] + 5)
+    many = queries(client, url)
+    assert few == many
+
+
+@pytest.mark.parametrize('url', ['/', '/user/amy'])
+def test_drifted_comment_counter_still_renders(forum, url):
+    module, client = forum
+    with module.app.app_context():
+        # 计数器声称有评论，但一条也没有加载出来
+        module.db.session.add(module.Post(content='说说', user_id=1, comment_count=3))
+        module.db.session.commit()
+    response = client.get(url)
+    assert response.status_code == 200
+    assert 'data-cursor=""' in response.get_data(as_text=True)
+    # 空游标从第一条评论开始
+    assert client.get('/post/1/comments?cursor=').get_json()['comments'] == []
@@ -0,0 +1,64 @@
+import multiprocessing
+import random
+
+import pytest
+
+import lcs_engine
+
+
+def test_parallel_scorer_start_spawns_workers():
+    scorer = lcs_engine.ParallelScorer(workers=2, threshold=10)
+    try:
+        scorer.start()
+        # start() 返回时工作进程已经启动，第一次搜索不再付出启动开销
+        assert len(multiprocessing.active_children()) >= 2
+        items = ['flask %d' % i for i in range(50)] + ['sqlite']
+        assert scorer.top_k('sqlite', items, lambda item: item, limit=1) == [(6, 'sqlite')]
+    finally:
+        scorer.shutdown()
+
+
+def dp_lcs(a, b):
+    """改写前各应用使用的动态规划实现，作为参照"""
+    dp = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(len(a)):
+        for j in range(len(b)):
+            if a[i] == b[j]:
+                dp[i + 1][j + 1] = dp[i][j] + 1
+            else:
+                dp[i + 1][j + 1] = max(dp[i][j + 1], dp[i + 1][j])
+    return dp[len(a)][len(b)]
+
+
+def random_strings(rng, count, alphabet, max_length):
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, max_length))) for _ in range(count)]
+
+
+ALPHABETS = ['ab', 'abcdefg', 'flask笔记本应用视频', 'ａｂé中文字']
+
+
+def test_scores_match_dynamic_programming():
+    rng = random.Random(20240601)
+    pairs = [('', ''), ('', 'abc'), ('abc', ''), ('笔记本', '笔记本应用'), ('a' * 200, 'a' * 130)]
+    for alphabet in ALPHABETS:
+        # 长度超过 64 时位向量跨越多个机器字
+        for a, b in zip(random_strings(rng, 60, alphabet, 150), random_strings(rng, 60, alphabet, 150)):
+            pairs.append((a, b))
+    for a, b in pairs:
+        expected = dp_lcs(a, b)
+        assert lcs_engine.lcs_length(a, b) == expected, (a, b)
+        assert lcs_engine.compile_query(a).score(b) == expected, (a, b)
+
+
+@pytest.mark.parametrize('limit', [None, 1, 3, 10, 100])
+def test_top_k_matches_stable_sort(limit):
+    rng = random.Random(7)
+    for alphabet in ALPHABETS:
+        # 短字母表、短文本产生大量同分
+        items = random_strings(rng, 150, alphabet, 12) + random_strings(rng, 20, alphabet, 90)
+        for query in random_strings(rng, 8, alphabet, 6) + ['', alphabet * 12]:
+            scored = [(dp_lcs(query, item), item) for item in items]
+            expected = sorted([entry for entry in scored if entry[0] > 0], key=lambda x: x[0], reverse=True)
+            if limit is not None:
+                expected = expected[:limit]
+            assert lcs_engine.top_k(query, items, lambda item: item, limit=limit) == expected, query
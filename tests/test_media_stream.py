@@ -0,0 +1,97 @@
+import os
+
+import pytest
+from flask import Flask
+
+import media_stream
+
+DATA = bytes(range(256)) * 4
+ETAG = 'abc123'
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(DATA)
+    app = Flask(__name__)
+    app.config['OFFLOAD'] = None
+
+    @app.route('/file')
+    def media():
+        return media_stream.send_media(str(path), etag=ETAG, offload=app.config['OFFLOAD'],
+                                       accel_path='/protected/video.mp4')
+
+    client = app.test_client()
+    client.path = str(path)
+    return client
+
+
+def get(client, **headers):
+    return client.get('/file', headers=headers)
+
+
+def test_full_file(client):
+    response = get(client)
+    assert response.status_code == 200 and response.data == DATA
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['ETag'] == '"%s"' % ETAG
+
+
+@pytest.mark.parametrize('header, start, end', [
+    ('bytes=0-99', 0, 99),
+    ('bytes=100-', 100, len(DATA) - 1),
+    ('bytes=1000-5000', 1000, len(DATA) - 1),
+    ('bytes=-24', len(DATA) - 24, len(DATA) - 1),
+    ('bytes=-5000', 0, len(DATA) - 1),
+])
+def test_partial_content(client, header, start, end):
+    response = get(client, Range=header)
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes %d-%d/%d' % (start, end, len(DATA))
+    assert response.headers['Content-Length'] == str(end - start + 1)
+    assert response.data == DATA[start:end + 1]
+
+
+@pytest.mark.parametrize('header', ['bytes=1024-', 'bytes=5000-6000', 'bytes=-0'])
+def test_unsatisfiable_range(client, header):
+    response = get(client, Range=header)
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */%d' % len(DATA)
+
+
+@pytest.mark.parametrize('header', ['bytes=5-2', 'bytes=0-1,5-6', 'items=0-1', 'bytes=-'])
+def test_invalid_range_ignored(client, header):
+    response = get(client, Range=header)
+    assert response.status_code == 200 and response.data == DATA
+
+
+def test_if_range(client):
+    response = get(client, Range='bytes=0-9', **{'If-Range': '"%s"' % ETAG})
+    assert response.status_code == 206 and response.data == DATA[:10]
+    # 校验器过期（或是弱 ETag）时返回完整的新文件
+    for stale in ('"old"', 'W/"%s"' % ETAG):
+        response = get(client, Range='bytes=0-9', **{'If-Range': stale})
+        assert response.status_code == 200 and response.data == DATA
+
+
+@pytest.mark.parametrize('header', ['"%s"' % ETAG, 'W/"%s"' % ETAG, '"other", "%s"' % ETAG, '*'])
+def test_if_none_match(client, header):
+    response = get(client, **{'If-None-Match': header})
+    assert response.status_code == 304 and response.data == b''
+    assert response.headers['ETag'] == '"%s"' % ETAG
+
+
+def test_if_none_match_other_etag(client):
+    assert get(client, **{'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_offload_headers(client):
+    client.application.config['OFFLOAD'] = 'x-accel'
+    response = get(client, Range='bytes=0-9')
+    assert response.headers['X-Accel-Redirect'] == '/protected/video.mp4'
+    assert response.data == b'' and response.mimetype == 'video/mp4'
+
+    client.application.config['OFFLOAD'] = 'x-sendfile'
+    response = get(client)
+    assert response.headers['X-Sendfile'] == os.path.abspath(client.path)
+    assert response.data == b''
@@ -0,0 +1,83 @@
+import re
+
+import pytest
+from flask import Flask
+
+import metrics
+
+SAMPLE_RE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'registry', None)
+    app = Flask(__name__)
+    app.config.update(METRICS_ENABLED=True, METRICS_DATABASE=str(tmp_path / 'metrics.db'),
+                      METRICS_FLUSH_INTERVAL=0)
+
+    @app.route('/a')
+    def a():
+        return 'a'
+
+    @app.route('/b')
+    def b():
+        return 'b'
+
+    metrics.install(app)
+    return app.test_client()
+
+
+def histogram(text, family):
+    """返回 [(样本名, 去掉 le 的标签, le, 值)]，保持输出顺序"""
+    samples = []
+    for line in text.splitlines():
+        match = SAMPLE_RE.match(line)
+        if match and match.group(1).startswith(family + '_'):
+            rest, le = metrics._split_le(match.group(2) or '')
+            samples.append((match.group(1)[len(family):], rest, le, float(match.group(3))))
+    return samples
+
+
+def test_histogram_buckets_ordered_and_cumulative(client):
+    for url in ('/a', '/a', '/b', '/a'):
+        client.get(url)
+    text = client.get('/metrics').get_data(as_text=True)
+    samples = histogram(text, 'http_request_duration_seconds')
+
+    series = {}
+    for suffix, rest, le, value in samples:
+        series.setdefault(rest, []).append((suffix, le, value))
+    assert set(series) == {'endpoint="a"', 'endpoint="b"'}
+
+    for rest, rows in series.items():
+        # 同一序列的样本连续输出：全部 _bucket，然后 _sum、_count
+        positions = [i for i, sample in enumerate(samples) if sample[1] == rest]
+        assert positions == list(range(positions[0], positions[0] + len(positions)))
+        suffixes = [suffix for suffix, _, _ in rows]
+        assert suffixes == ['_bucket'] * (len(metrics.BUCKETS) + 1) + ['_sum', '_count']
+
+        buckets = [(le, value) for suffix, le, value in rows if suffix == '_bucket']
+        bounds = [le for le, _ in buckets]
+        assert bounds == sorted(bounds) and bounds[-1] == float('inf')
+        counts = [value for _, value in buckets]
+        assert counts == sorted(counts)
+        assert counts[-1] == rows[-1][2]
+
+    assert series['endpoint="a"'][-1][2] == 3
+    assert series['endpoint="b"'][-1][2] == 1
+
+
+def test_fork_does_not_recount_inherited_cache_hits(tmp_path):
+    registry = metrics.Registry(str(tmp_path / 'metrics.db'), flush_interval=0)
+    stats = {'hits': 5, 'misses': 2}
+    registry.watch_cache('user', lambda: dict(stats))
+    registry.flush()
+
+    registry._pid = -1  # 相当于 fork 出的子进程第一次使用
+    registry.flush()
+    stats['hits'] += 1
+    registry.flush()
+
+    text = registry.render()
+    assert 'cache_hits_total{cache="user"} 6.0' in text
+    assert 'cache_misses_total{cache="user"} 2.0' in text
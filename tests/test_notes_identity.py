@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+import perf
+from conftest import load_app
+
+
+@pytest.fixture
+def notes(tmp_path, monkeypatch):
+    module = load_app('Flask-notes-app.py', tmp_path, monkeypatch)
+    perf.install(module.app, force=True)
+    with module.app.app_context():
+        module.init_db()
+        db = module.get_db()
+        db.execute("INSERT INTO users (username, password) VALUES ('alice', 'hash')")
+        db.commit()
+        user = module.get_user_by_id(1)
+    return module, module.app.test_client(), user
+
+
+def login(module, client, user, username=None):
+    """写入会话：用户 ID 与签名的身份声明；username 不为空时篡改声明中的用户名"""
+    payload = [user['id'], user['username'], module.password_version(user), int(time.time())]
+    claim = payload + [module.sign_claim(payload)]
+    if username is not None:
+        claim[1] = username
+    with client.session_transaction() as session:
+        session['user_id'] = user['id']
+        session['identity'] = claim
+
+
+def user_queries(client, url='/'):
+    statements = []
+    perf.statement_listeners.append(lambda sql, parameters, seconds: statements.append(sql))
+    try:
+        assert client.get(url).status_code == 200
+    finally:
+        perf.statement_listeners.pop()
+    return sum('FROM users' in sql for sql in statements)
+
+
+def test_valid_claim_skips_user_lookup(notes):
+    module, client, user = notes
+    login(module, client, user)
+    assert user_queries(client) == 0
+    assert user_queries(client, '/search?q=x') == 0
+
+
+def test_claims_disabled_loads_user_once(notes):
+    module, client, user = notes
+    module.app.config['IDENTITY_CLAIMS'] = False
+    login(module, client, user)
+    assert user_queries(client) == 1
+    assert user_queries(client, '/search?q=x') == 1
+
+
+def test_tampered_claim_falls_back_to_one_lookup(notes):
+    module, client, user = notes
+    login(module, client, user, username='mallory')
+    assert user_queries(client) == 1
+    # 查库后重新签发了有效声明
+    assert user_queries(client) == 0
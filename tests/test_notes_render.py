@@ -0,0 +1,44 @@
+import pytest
+
+from conftest import load_app
+
+
+@pytest.fixture
+def notes(tmp_path, monkeypatch):
+    module = load_app('Flask-notes-app.py', tmp_path, monkeypatch)
+    module.app.config['IDENTITY_CLAIMS'] = False
+    with module.app.app_context():
+        module.init_db()
+        db = module.get_db()
+        db.execute("INSERT INTO users (username, password) VALUES ('alice', 'hash')")
+        db.commit()
+    client = module.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return module, client
+
+
+def test_prerender_on_save_is_not_a_miss(notes):
+    module, client = notes
+    client.post('/note/new', data={'title': 't', 'content': '# hello'})
+    client.post('/note/1/edit', data={'title': 't', 'content': '# hello again'})
+    stats = module.render_cache_stats()
+    assert (stats['renders'], stats['misses'], stats['hit_rate']) == (2, 0, 0.0)
+
+    for _ in range(3):
+        assert b'hello again' in client.get('/note/1').data
+    stats = module.render_cache_stats()
+    assert (stats['memory_hits'], stats['misses'], stats['renders']) == (3, 0, 2)
+    assert stats['hit_rate'] == 1.0
+
+
+def test_view_without_cached_html_counts_a_miss(notes):
+    module, client = notes
+    client.post('/note/new', data={'title': 't', 'content': 'body'})
+    module.render_cache.clear()
+    module.app.config['MARKDOWN_PERSIST'] = False
+    client.get('/note/1')
+    client.get('/note/1')
+    stats = module.render_cache_stats()
+    assert (stats['memory_hits'], stats['misses']) == (1, 1)
+    assert stats['hit_rate'] == 0.5
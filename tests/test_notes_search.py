@@ -0,0 +1,85 @@
+import pytest
+
+import perf
+from conftest import load_app
+
+
+@pytest.fixture(params=['Flask-notes-app.py', '笔记本应用.py'])
+def notes(request, tmp_path, monkeypatch):
+    module = load_app(request.param, tmp_path, monkeypatch)
+    module.app.config['IDENTITY_CLAIMS'] = False
+    perf.install(module.app, force=True)
+    with module.app.app_context():
+        module.init_db()
+        db = module.get_db()
+        db.executemany('INSERT INTO users (username, password) VALUES (?, ?)', [('alice', 'x'), ('bob', 'x')])
+        db.commit()
+    client = module.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return module, client
+
+
+def search(module, query, user_id=1):
+    """返回 (命中的笔记 ID, 是否走了全文索引)"""
+    statements = []
+    perf.statement_listeners.append(lambda sql, parameters, seconds: statements.append(sql))
+    try:
+        with module.app.app_context():
+            ids = [row['id'] for row in module.search_notes(user_id, query)]
+    finally:
+        perf.statement_listeners.pop()
+    return ids, any('notes_fts' in sql for sql in statements)
+
+
+def test_index_follows_insert_edit_delete(notes):
+    module, client = notes
+    client.post('/note/new', data={'title': 'Flask 入门', 'content': '路由与模板渲染'})
+    client.post('/note/new', data={'title': '购物清单', 'content': 'apples and pears'})
+    assert search(module, 'Flask') == ([1], True)
+    assert search(module, '模板渲') == ([1], True)
+    assert search(module, 'pears') == ([2], True)
+
+    client.post('/note/2/edit', data={'title': '购物清单', 'content': 'bananas'})
+    assert search(module, 'pears') == ([], True)
+    assert search(module, 'banana') == ([2], True)
+
+    client.post('/note/1/delete')
+    assert search(module, 'Flask') == ([], True)
+    assert search(module, '模板渲') == ([], True)
+
+
+def test_short_query_uses_like(notes):
+    module, client = notes
+    client.post('/note/new', data={'title': '笔记', 'content': 'Go 语言'})
+    client.post('/note/new', data={'title': 'other', 'content': '100%_done'})
+    assert search(module, '笔记') == ([1], False)
+    assert search(module, 'go') == ([1], False)
+    # 通配符按字面匹配
+    assert search(module, '%_') == ([2], False)
+    client.post('/note/1/delete')
+    assert search(module, '笔记') == ([], False)
+
+
+def test_results_limited_to_owner(notes):
+    module, client = notes
+    client.post('/note/new', data={'title': 'shared words', 'content': 'secret'})
+    assert search(module, 'secret', user_id=2) == ([], True)
+    assert search(module, 'se', user_id=2) == ([], False)
+
+
+def test_rebuild_fts(notes):
+    module, client = notes
+    with module.app.app_context():
+        db = module.get_db()
+        # 模拟升级前的数据库：笔记写入时还没有同步触发器
+        db.executescript('DROP TRIGGER notes_fts_ai;')
+        db.execute("INSERT INTO notes (user_id, title, content) VALUES (1, 'legacy note', 'written before fts')")
+        db.commit()
+    assert search(module, 'legacy') == ([], True)
+
+    result = module.app.test_cli_runner().invoke(args=['rebuild-fts'])
+    assert result.exit_code == 0, result.output
+    assert search(module, 'legacy') == ([1], True)
+    assert search(module, 'before fts') == ([1], True)
+    assert search(module, 'itt') == ([1], True)
@@ -0,0 +1,46 @@
+import sqlite_session
+
+
+def worker(path):
+    """同一会话库上的另一个“进程”：各自的连接和读缓存"""
+    return sqlite_session.SQLiteSessionInterface(path, sweep_interval=0)
+
+
+def test_write_elsewhere_invalidates_only_that_session(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    a, b = worker(path), worker(path)
+    for sid in ('s1', 's2', 's3'):
+        a._store(sid, b'{"v": 1}', 2 ** 40)
+    for sid in ('s1', 's2', 's3'):
+        b._load(sid)
+    assert b.reads == 3
+
+    a._store('s2', b'{"v": 2}', 2 ** 40)
+    assert b._load('s2')[0] == b'{"v": 2}'
+    assert b._load('s1')[0] == b'{"v": 1}'
+    assert b._load('s3')[0] == b'{"v": 1}'
+    assert b.reads == 4
+    assert b.stats()['invalidated'] == 1
+
+    a._delete('s3')
+    assert b._load('s3') is None
+    assert b._load('s1') is not None
+    assert b.reads == 5
+
+
+def test_pruned_change_log_clears_whole_cache(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    a, b = worker(path), worker(path)
+    a._store('s1', b'{}', 2 ** 40)
+    a._store('s2', b'{}', 2 ** 40)
+    b._load('s1')
+    b._load('s2')
+
+    a._store('s2', b'{"v": 2}', 2 ** 40)
+    a._store('s2', b'{"v": 3}', 2 ** 40)
+    # b 还没读到的日志被清理掉了：只能整体作废
+    a.change_retention = -10
+    a.sweep()
+    a._store('s2', b'{"v": 4}', 2 ** 40)
+    b._load('s1')
+    assert b.reads == 3
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from conftest import load_app
+
+DIGEST = 'ab' * 32
+
+
+@pytest.fixture
+def vidhub(tmp_path, monkeypatch):
+    module = load_app('VidHub.py', tmp_path, monkeypatch)
+    with module.app.app_context():
+        module.init_db()
+        module.db.session.add(module.User(username='owner', password_hash='x'))
+        module.db.session.add(module.Blob(sha256=DIGEST, size=4, refcount=2))
+        for i in range(2):
+            module.db.session.add(module.Video(title='v%d' % i, filename='v.mp4', user_id=1, sha256=DIGEST,
+                                               meta_status='ready'))
+        module.db.session.commit()
+    source = tmp_path / 'upload'
+    source.write_bytes(b'data')
+    module.blobs.put(str(source), DIGEST)
+    client = module.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+    return module, client
+
+
+def refcount(module):
+    with module.app.app_context():
+        blob = module.db.session.get(module.Blob, DIGEST)
+        return blob and blob.refcount
+
+
+def test_file_removed_only_with_last_reference(vidhub):
+    module, client = vidhub
+    assert client.post('/delete_video', data={'video_id': 1}).status_code == 200
+    assert os.path.exists(module.blobs.path(DIGEST)) and refcount(module) == 1
+    assert client.post('/delete_video', data={'video_id': 2}).status_code == 200
+    assert not os.path.exists(module.blobs.path(DIGEST)) and refcount(module) is None
+
+
+def test_failed_commit_keeps_file(vidhub):
+    module, client = vidhub
+    client.post('/delete_video', data={'video_id': 1})
+
+    def fail():
+        raise RuntimeError('commit failed')
+    module.db.session.commit = fail
+    try:
+        assert client.post('/delete_video', data={'video_id': 2}).status_code == 500
+    finally:
+        del module.db.session.commit
+
+    # 事务回滚后引用和文件都还在，视频仍能播放
+    assert refcount(module) == 1
+    assert os.path.exists(module.blobs.path(DIGEST))
+    assert client.get('/videos/2/file').status_code == 200
+
+
+def test_migrate_shared_legacy_file(tmp_path, monkeypatch):
+    module = load_app('VidHub.py', tmp_path, monkeypatch)
+    with module.app.app_context():
+        module.init_db()
+        module.db.session.add(module.User(username='owner', password_hash='x'))
+        for i in range(3):
+            module.db.session.add(module.Video(title='v%d' % i, filename='same.mp4', user_id=1))
+        module.db.session.commit()
+    os.makedirs('uploads/1')
+    with open('uploads/1/same.mp4', 'wb') as f:
+        f.write(b'legacy')
+
+    result = module.app.test_cli_runner().invoke(args=['migrate-blobs'])
+    assert '已迁移 3 个视频' in result.output
+
+    with module.app.app_context():
+        digests = {video.sha256 for video in module.Video.query.all()}
+        assert len(digests) == 1
+        digest = digests.pop()
+        assert module.db.session.get(module.Blob, digest).refcount == 3
+    assert os.path.exists(module.blobs.path(digest))
+    client = module.app.test_client()
+    assert all(client.get('/videos/%d/file' % i).status_code == 200 for i in (1, 2, 3))
@@ -0,0 +1,35 @@
+import media_pipeline
+from conftest import load_app
+
+DIGEST = 'cd' * 32
+
+
+def test_pending_videos_requeued_on_first_request(tmp_path, monkeypatch):
+    module = load_app('VidHub.py', tmp_path, monkeypatch)
+    monkeypatch.setattr(module, 'video_extractor', media_pipeline.StubExtractor())
+    with module.app.app_context():
+        module.init_db()
+        module.db.session.add(module.User(username='owner', password_hash='x'))
+        module.db.session.add(module.Video(title='old', filename='v.mp4', user_id=1, sha256=DIGEST))
+        module.db.session.commit()
+    source = tmp_path / 'upload'
+    source.write_bytes(b'data')
+    module.blobs.put(str(source), DIGEST)
+
+    # 不经过 __main__：第一个请求启动流水线并补交未处理的视频
+    module.app.test_client().get('/login')
+    module.media_jobs.join()
+    with module.app.app_context():
+        video = module.db.session.get(module.Video, 1)
+        assert (video.meta_status, video.size) == ('ready', 4)
+
+
+def test_on_start_runs_once_per_process():
+    calls = []
+    pipeline = media_pipeline.MediaPipeline(calls.append, workers=1,
+                                            on_start=lambda jobs: jobs.submit('requeued'))
+    pipeline.start()
+    pipeline.start()
+    pipeline.submit('new')
+    pipeline.join()
+    assert calls == ['requeued', 'new']
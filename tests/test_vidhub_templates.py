@@ -0,0 +1,25 @@
+from flask import render_template
+
+from conftest import load_app
+
+
+def test_user_videos_renders_with_and_without_metadata(tmp_path, monkeypatch):
+    module = load_app('VidHub.py', tmp_path, monkeypatch)
+    videos = [
+        {'id': 1, 'title': 'ready', 'meta_status': 'ready', 'duration': 3725.4, 'size': 3 * 1024 * 1024},
+        {'id': 2, 'title': 'pending', 'meta_status': 'pending', 'duration': None, 'size': None},
+        {'id': 3, 'title': 'legacy'},
+    ]
+    with module.app.test_request_context('/'):
+        html = render_template('user_videos.html', user={'username': 'demo'}, videos=videos)
+    assert '1:02:05' in html and '3.0 MB' in html
+    assert '处理中' in html and 'legacy' in html
+
+
+def test_filters_ignore_non_numbers(tmp_path, monkeypatch):
+    module = load_app('VidHub.py', tmp_path, monkeypatch)
+    for value in (None, '', 'abc'):
+        assert module.format_duration(value) == ''
+        assert module.format_filesize(value) == ''
+    assert module.format_duration(59.6) == '1:00'
+    assert module.format_filesize(512) == '512 B'
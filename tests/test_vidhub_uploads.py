@@ -0,0 +1,64 @@
+import hashlib
+
+import pytest
+
+import media_pipeline
+from conftest import load_app
+
+DATA = b'0123456789' * 10
+
+
+@pytest.fixture
+def vidhub(tmp_path, monkeypatch):
+    module = load_app('VidHub.py', tmp_path, monkeypatch)
+    monkeypatch.setattr(module, 'video_extractor', media_pipeline.StubExtractor())
+    with module.app.app_context():
+        module.init_db()
+        module.db.session.add(module.User(username='owner', password_hash='x'))
+        module.db.session.commit()
+    client = module.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+    response = client.post('/uploads/sessions', json={'title': 't', 'filename': 'v.mp4', 'size': len(DATA)})
+    return module, client, response.get_json()['id']
+
+
+def put(client, upload_id, offset, data):
+    response = client.put('/uploads/sessions/%s?offset=%d' % (upload_id, offset), data=data,
+                          content_type='application/octet-stream')
+    return response.status_code, response.get_json()
+
+
+def test_resume_with_stale_offset(vidhub):
+    module, client, upload_id = vidhub
+    assert put(client, upload_id, 0, DATA[:40]) == (200, {'status': 'success', 'offset': 40})
+    # 客户端没收到响应，用旧的偏移量重发：拒绝并告知已接收的字节数
+    status, body = put(client, upload_id, 0, DATA[:40])
+    assert (status, body['offset']) == (409, 40)
+    status, body = put(client, upload_id, 10, DATA[10:50])
+    assert (status, body['offset']) == (409, 40)
+    assert client.get('/uploads/sessions/' + upload_id).get_json()['offset'] == 40
+
+    assert put(client, upload_id, 40, DATA[40:])[0] == 200
+    response = client.post('/uploads/sessions/%s/finalize' % upload_id,
+                           json={'sha256': hashlib.sha256(DATA).hexdigest()})
+    assert response.status_code == 200
+
+
+def test_claim_held_by_another_worker(vidhub):
+    module, client, upload_id = vidhub
+    with module.app.app_context():
+        # 另一个 worker 进程正在写第一个分片
+        token = module.claim_upload(upload_id, 0)
+        assert token is not None
+        assert module.claim_upload(upload_id, 0) is None
+    status, body = put(client, upload_id, 0, DATA[:40])
+    assert status == 409 and body['offset'] == 0
+
+    # 占用超时后可以接手，原来的请求随后完成时不会再推进偏移量
+    module.app.config['UPLOAD_CLAIM_TIMEOUT'] = -1
+    assert put(client, upload_id, 0, DATA[:40]) == (200, {'status': 'success', 'offset': 40})
+    with module.app.app_context():
+        assert not module.release_upload(upload_id, token, 100)
+        upload = module.db.session.get(module.UploadSession, upload_id)
+        assert (upload.received, upload.writer) == (40, None)
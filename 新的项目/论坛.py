@@ -1,16 +1,41 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, abort
+from flask import Flask, render_template, redirect, url_for, flash, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, TextAreaField
 from wtforms.validators import DataRequired, Length, EqualTo, ValidationError
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import func, select, tuple_, update
+from sqlalchemy.orm import joinedload
 from datetime import datetime
+import os
+import sys
+
+# 共用模块位于仓库根目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lcs_engine
+import caching
+import perf
+import metrics
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret-key'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['POSTS_PER_PAGE'] = 20       # 首页、用户页每页的说说数
+app.config['INLINE_COMMENTS'] = 3       # 每条说说随页面直接渲染的评论数，其余按需加载
+app.config['COMMENTS_PER_PAGE'] = 20    # 评论接口每页条数
+app.config['PERF_ENABLED'] = False      # 请求级性能采样（见 perf.py），关闭时不注册任何钩子
+app.config['PERF_SLOW_MS'] = 500        # 耗时超过该毫秒数的请求记入慢请求日志
+app.config['PERF_SLOW_QUERIES'] = 50    # SQL 条数超过该值的请求记入慢请求日志
+app.config['PERF_SLOW_QUERY_MS'] = 100  # 单条 SQL 超过该毫秒数时记入慢查询日志
+app.config['PERF_SERVER_TIMING'] = False  # 在响应头 Server-Timing 中附带分项耗时，只应在调试时打开
+app.config['METRICS_ENABLED'] = False   # Prometheus 指标（见 metrics.py），/metrics 输出所有 worker 的合计
+app.config['METRICS_DATABASE'] = 'metrics.db'  # 各 worker 定期把增量合并进这个共享的 SQLite 文件
+app.config['METRICS_FLUSH_INTERVAL'] = 5  # 合并间隔（秒）
+app.config['METRICS_TOKEN'] = None      # 抓取时须带 "Authorization: Bearer <令牌>"；为 None 时只允许本机直接访问
+perf.install(app)
+metrics.install(app)
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
@@ -20,6 +45,9 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), unique=True, index=True, nullable=False)
     password_hash = db.Column(db.String(128))
+    # 冗余计数，在发表说说/评论的同一事务中维护；可用 flask repair-counters 全量重算
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     comments = db.relationship('Comment', backref='author', lazy='dynamic')
     def set_password(self, password): self.password_hash = generate_password_hash(password)
@@ -31,7 +59,11 @@ class Post(db.Model):
     content = db.Column(db.String(140))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     comments = db.relationship('Comment', backref='post', lazy='dynamic')
+    # 游标分页按 (timestamp, id) 定位：首页直接用 timestamp 上的索引（SQLite 的索引隐含 rowid），
+    # 用户页用 (user_id, timestamp, id) 复合索引
+    __table_args__ = (db.Index('ix_post_user_timestamp_id', 'user_id', 'timestamp', 'id'),)
     def __repr__(self): return f'<Post {self.content[:20]}>'
 
 class Comment(db.Model):
@@ -40,10 +72,67 @@ class Comment(db.Model):
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
+    __table_args__ = (db.Index('ix_comment_post_timestamp_id', 'post_id', 'timestamp', 'id'),)
     def __repr__(self): return f'<Comment {self.content[:20]}>'
 
+def add_missing_columns():
+    """为升级前已存在的表补上模型中新增的列（ALTER TABLE ADD COLUMN），返回新增的列名"""
+    inspector = db.inspect(db.engine)
+    added = []
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = 'ALTER TABLE "%s" ADD COLUMN "%s" %s' % (
+                    table.name, column.name, column.type.compile(dialect=db.engine.dialect))
+                if column.server_default is not None:
+                    ddl += " NOT NULL DEFAULT '%s'" % column.server_default.arg
+                conn.exec_driver_sql(ddl)
+                added.append('%s.%s' % (table.name, column.name))
+    return added
+
+def repair_counters():
+    """从明细数据全量重算冗余计数，各用一条带相关子查询的 UPDATE"""
+    db.session.execute(update(Post).values(comment_count=select(func.count(Comment.id))
+                                           .where(Comment.post_id == Post.id).scalar_subquery()))
+    db.session.execute(update(User).values(
+        post_count=select(func.count(Post.id)).where(Post.user_id == User.id).scalar_subquery(),
+        comment_count=select(func.count(Comment.id)).where(Comment.user_id == User.id).scalar_subquery()))
+    db.session.commit()
+    # 缓存的用户快照里带着旧的计数
+    user_cache.clear()
+
+def init_db():
+    """建表，并为升级前已存在的表补上新增的列和索引"""
+    db.create_all()
+    if add_missing_columns():
+        repair_counters()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+@app.cli.command('repair-counters')
+def repair_counters_command():
+    """重算说说评论数、用户说说数与评论数"""
+    init_db()
+    repair_counters()
+    print('计数已重算')
+
+# 跨请求的用户缓存，缓存列值快照，命中时不查询数据库
+user_cache = caching.LRUCache(maxsize=1024, ttl=300)
+metrics.watch_cache('user', user_cache.stats)
+
 @login_manager.user_loader
-def load_user(user_id): return User.query.get(int(user_id))
+def load_user(user_id):
+    data = user_cache.get(int(user_id))
+    if data is not None:
+        return caching.orm_restore(db.session, User, data)
+    user = User.query.get(int(user_id))
+    if user is not None:
+        user_cache.set(user.id, caching.orm_snapshot(user))
+    return user
 
 # ---- 表单 ----
 class RegisterForm(FlaskForm):
@@ -73,24 +162,75 @@ class SearchUserForm(FlaskForm):
     submit = SubmitField('搜索')
 
 # ---- 辅助函数 ----
+def fold_case(s):
+    # 逐字符转小写，与原先逐字符比较 .lower() 的语义保持一致
+    return [c.lower() for c in s]
+
 def lcs_length(s1, s2):
-    m, n = len(s1), len(s2)
-    dp = [[0]*(n+1) for _ in range(m+1)]
-    for i in range(1,m+1):
-        for j in range(1,n+1):
-            if s1[i-1].lower() == s2[j-1].lower(): dp[i][j] = dp[i-1][j-1] + 1
-            else: dp[i][j] = max(dp[i-1][j], dp[i][j-1])
-    return dp[m][n]
+    return lcs_engine.lcs_length(fold_case(s1), fold_case(s2))
+
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+@app.template_global()
+def encode_cursor(row):
+    """游标即一页最后一条记录的 (timestamp, id)"""
+    return '%s_%d' % (row.timestamp.strftime(CURSOR_TIME_FORMAT), row.id)
+
+def decode_cursor(value):
+    try:
+        stamp, ident = value.split('_')
+        return datetime.strptime(stamp, CURSOR_TIME_FORMAT), int(ident)
+    except ValueError:
+        abort(400)
+
+def seek(query, model, cursor, limit, newest_first=True):
+    """
+    按 (timestamp, id) 做游标分页，返回 (本页记录, 下一页游标)。
+    用行值比较从复合索引上直接定位，不使用 OFFSET，翻到多深代价都一样。
+    """
+    key = tuple_(model.timestamp, model.id)
+    if cursor:
+        bound = tuple_(*decode_cursor(cursor), types=(model.timestamp.type, model.id.type))
+        query = query.filter(key < bound if newest_first else key > bound)
+    if newest_first:
+        query = query.order_by(model.timestamp.desc(), model.id.desc())
+    else:
+        query = query.order_by(model.timestamp.asc(), model.id.asc())
+    rows = query.limit(limit + 1).all()
+    # 多取的一行只用来判断是否还有下一页
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def load_comments(posts):
+    """
+    一次查询取出这些说说各自最早的几条评论（连同评论作者），与说说条数无关。
+    返回 {post_id: [评论, ...]}；评论总数直接读 post.comment_count。
+    """
+    ids = [post.id for post in posts if post.comment_count]
+    comments = {post.id: [] for post in posts}
+    if not ids:
+        return comments
+    rank = func.row_number().over(partition_by=Comment.post_id,
+                                  order_by=(Comment.timestamp.asc(), Comment.id.asc())).label('rank')
+    ranked = db.session.query(Comment.id, rank).filter(Comment.post_id.in_(ids)).subquery()
+    rows = (Comment.query.options(joinedload(Comment.author))
+            .join(ranked, ranked.c.id == Comment.id)
+            .filter(ranked.c.rank <= app.config['INLINE_COMMENTS'])
+            .order_by(Comment.timestamp.asc(), Comment.id.asc()).all())
+    for comment in rows:
+        comments[comment.post_id].append(comment)
+    return comments
 
 # ---- 视图 ----
 
 @app.route('/')
 @login_required
 def index():
-    posts = Post.query.order_by(Post.timestamp.asc()).all() # 时间升序
-    comment_forms = {}
-    for post in posts: comment_forms[post.id] = CommentForm(prefix=f'c{post.id}')
-    return render_template('index.html', posts=posts, comment_forms=comment_forms)
+    # 最新的在前；作者随说说一起 JOIN 取出
+    posts, next_cursor = seek(Post.query.options(joinedload(Post.author)), Post,
+                              request.args.get('cursor'), app.config['POSTS_PER_PAGE'])
+    return render_template('index.html', posts=posts, next_cursor=next_cursor, comments=load_comments(posts),
+                           comment_form=CommentForm())
 
 @app.route('/register', methods=['GET','POST'])
 def register():
@@ -101,6 +241,8 @@ def register():
         new_user.set_password(form.password.data)
         db.session.add(new_user)
         db.session.commit()
+        # SQLite 可能复用已删除用户的 ID，清掉可能残留的旧缓存
+        user_cache.invalidate(new_user.id)
         flash('注册成功，欢迎！')
         return redirect(url_for('login'))
     return render_template('register.html', form=form)
@@ -132,7 +274,11 @@ def post():
     if form.validate_on_submit():
         p = Post(content=form.content.data, author=current_user)
         db.session.add(p)
+        # 计数用 SQL 自增，与插入同一事务提交，不依赖可能过期的缓存快照
+        db.session.execute(update(User).where(User.id == current_user.id)
+                           .values(post_count=User.post_count + 1))
         db.session.commit()
+        user_cache.invalidate(current_user.id)
         flash('发表成功！')
         return redirect(url_for('index'))
     return render_template('post.html', form=form)
@@ -141,19 +287,38 @@ def post():
 @login_required
 def user_posts(username):
     user = User.query.filter_by(username=username).first_or_404()
-    posts = user.posts.order_by(Post.timestamp.asc()).all()
-    comment_forms = {post.id: CommentForm(prefix=f'c{post.id}') for post in posts}
-    return render_template('user_posts.html', posts=posts, user=user, comment_forms=comment_forms)
+    posts, next_cursor = seek(user.posts, Post, request.args.get('cursor'), app.config['POSTS_PER_PAGE'])
+    return render_template('user_posts.html', posts=posts, user=user, next_cursor=next_cursor,
+                           comments=load_comments(posts), comment_form=CommentForm())
+
+@app.route('/post/<int:post_id>/comments')
+@login_required
+def post_comments(post_id):
+    """按时间升序分页返回某条说说的评论（JSON），cursor 为上一页最后一条评论的位置"""
+    query = Comment.query.options(joinedload(Comment.author)).filter_by(post_id=post_id)
+    comments, next_cursor = seek(query, Comment, request.args.get('cursor'),
+                                 app.config['COMMENTS_PER_PAGE'], newest_first=False)
+    return jsonify(comments=[{
+        'id': comment.id,
+        'author': comment.author.username,
+        'content': comment.content,
+        'timestamp': comment.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+    } for comment in comments], next_cursor=next_cursor)
 
 @app.route('/post/<int:post_id>/comment', methods=['POST'])
 @login_required
 def add_comment(post_id):
     post = Post.query.get_or_404(post_id)
-    form = CommentForm(prefix=f'c{post_id}')
+    form = CommentForm()
     if form.validate_on_submit():
         comment = Comment(content=form.content.data, author=current_user, post=post)
         db.session.add(comment)
+        db.session.execute(update(Post).where(Post.id == post_id)
+                           .values(comment_count=Post.comment_count + 1))
+        db.session.execute(update(User).where(User.id == current_user.id)
+                           .values(comment_count=User.comment_count + 1))
         db.session.commit()
+        user_cache.invalidate(current_user.id)
         flash('评论成功！')
     else:
         flash('评论内容不能为空。')
@@ -166,22 +331,19 @@ def search():
     if form.validate_on_submit():
         keyword = form.username.data.strip()
         users = User.query.all()
-        candidates = []
-        for u in users:
-            score = lcs_length(keyword, u.username)
-            candidates.append((score,u))
-        candidates.sort(key=lambda x:x[0], reverse=True)
-        if not candidates or candidates[0][0] == 0:
+        # 只需要得分最高的一个用户（同分取最先出现的），交给 top_k 剪枝
+        with perf.timer('lcs'):
+            best = lcs_engine.top_k(fold_case(keyword), users, lambda u: fold_case(u.username), limit=1)
+        if not best:
             flash(f'用户 "{keyword}" 不存在。')
             return render_template('search.html', form=form)
-        max_score = candidates[0][0]
-        best_users = [u for score,u in candidates if score == max_score]
-        return redirect(url_for('user_posts', username=best_users[0].username))
+        return redirect(url_for('user_posts', username=best[0][1].username))
     return render_template('search.html', form=form)
 
 # ---- 运行 ----
 if __name__ == '__main__':
-    db.create_all()
+    with app.app_context():
+        init_db()
     app.run(debug=True)
 
 
@@ -245,11 +407,44 @@ if __name__ == '__main__':
 </div>
 
 <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"></script>
+<script>
+// 按需加载评论：每次从接口取下一页，追加到评论列表末尾
+document.addEventListener('click', function (event) {
+  var button = event.target.closest('.load-comments');
+  if (!button) return;
+  button.disabled = true;
+  fetch(button.dataset.url + '?cursor=' + encodeURIComponent(button.dataset.cursor))
+    .then(function (response) { return response.json(); })
+    .then(function (data) {
+      var list = document.getElementById(button.dataset.target);
+      data.comments.forEach(function (comment) {
+        var item = document.createElement('div');
+        item.className = 'mb-2';
+        var author = document.createElement('strong');
+        author.textContent = comment.author;
+        var time = document.createElement('small');
+        time.className = 'text-muted';
+        time.textContent = ' ' + comment.timestamp;
+        var content = document.createElement('p');
+        content.className = 'mb-0';
+        content.textContent = comment.content;
+        item.append(author, time, content);
+        list.appendChild(item);
+      });
+      if (data.next_cursor) {
+        button.dataset.cursor = data.next_cursor;
+        button.disabled = false;
+      } else {
+        button.remove();
+      }
+    });
+});
+</script>
 </body>
 </html>
 ---
 
-### 2. 首页 index.html — 列出所有说说和评论区
+### 2. 首页 index.html — 分页列出说说和评论区
 {% extends 'base.html' %}
 
 {% block title %}首页 - Flask博客{% endblock %}
@@ -267,43 +462,54 @@ if __name__ == '__main__':
     <hr>
     <h6>评论：</h6>
 
-    {% if post.comments.count() == 0 %}
+    {% if post.comment_count == 0 %}
       <p class="text-muted">还没有评论哦~</p>
     {% else %}
-      {% for comment in post.comments.order_by('timestamp asc') %}
+      <div id="comments-{{ post.id }}">
+      {% for comment in comments[post.id] %}
       <div class="mb-2">
         <strong>{{ comment.author.username }}</strong>
         <small class="text-muted">{{ comment.timestamp.strftime('%Y-%m-%d %H:%M:%S') }}</small>
         <p class="mb-0">{{ comment.content }}</p>
       </div>
       {% endfor %}
+      </div>
+      {% if post.comment_count > comments[post.id]|length %}
+      <button type="button" class="btn btn-link btn-sm p-0 load-comments" data-target="comments-{{ post.id }}"
+        data-url="{{ url_for('post_comments', post_id=post.id) }}" data-cursor="{{ encode_cursor(comments[post.id][-1]) if comments[post.id] else '' }}">
+        查看更多评论（共 {{ post.comment_count }} 条）
+      </button>
+      {% endif %}
     {% endif %}
 
     <form method="post" action="{{ url_for('add_comment', post_id=post.id) }}" class="mt-3">
-      {{ comment_forms[post.id].hidden_tag() }}
+      {{ comment_form.hidden_tag() }}
       <div class="mb-3">
-        {{ comment_forms[post.id].content(class="form-control", rows="2", placeholder="写评论...") }}
-        {% if comment_forms[post.id].content.errors %}
-          <div class="form-error">{{ comment_forms[post.id].content.errors[0] }}</div>
-        {% endif %}
+        {{ comment_form.content(class="form-control", rows="2", placeholder="写评论...", id="comment-%d" % post.id) }}
       </div>
-      <button type="submit" class="btn btn-sm btn-primary">{{ comment_forms[post.id].submit.label.text }}</button>
+      <button type="submit" class="btn btn-sm btn-primary">{{ comment_form.submit.label.text }}</button>
     </form>
   </div>
 </div>
 {% else %}
 <p>还没有说说，快去发表吧！</p>
 {% endfor %}
+
+<nav class="mb-4">
+  {% if request.args.cursor %}<a href="{{ url_for('index') }}" class="btn btn-outline-primary btn-sm">回到最新</a>{% endif %}
+  {% if next_cursor %}<a href="{{ url_for('index', cursor=next_cursor) }}" class="btn btn-outline-primary btn-sm">更早的说说</a>{% endif %}
+</nav>
 {% endblock %}
 ---
 
-### 3. 用户说说页 user_posts.html — 显示某用户的所有说说和评论
+### 3. 用户说说页 user_posts.html — 分页显示某用户的说说和评论
 {% extends 'base.html' %}
 
 {% block title %}{{ user.username }} 的说说{% endblock %}
 
 {% block content %}
-<h2 class="mb-4">{{ user.username }} 的说说</h2>
+<h2 class="mb-1">{{ user.username }} 的说说</h2>
+<p class="text-muted mb-4">共 {{ user.post_count }} 条说说，{{ user.comment_count }} 条评论</p>
 
 {% for post in posts %}
 <div class="card mb-4">
@@ -314,33 +520,43 @@ if __name__ == '__main__':
     <hr>
     <h6>评论：</h6>
 
-    {% if post.comments.count() == 0 %}
+    {% if post.comment_count == 0 %}
       <p class="text-muted">还没有评论哦~</p>
     {% else %}
-      {% for comment in post.comments.order_by('timestamp asc') %}
+      <div id="comments-{{ post.id }}">
+      {% for comment in comments[post.id] %}
       <div class="mb-2">
         <strong>{{ comment.author.username }}</strong>
         <small class="text-muted">{{ comment.timestamp.strftime('%Y-%m-%d %H:%M:%S') }}</small>
         <p class="mb-0">{{ comment.content }}</p>
       </div>
       {% endfor %}
+      </div>
+      {% if post.comment_count > comments[post.id]|length %}
+      <button type="button" class="btn btn-link btn-sm p-0 load-comments" data-target="comments-{{ post.id }}"
+        data-url="{{ url_for('post_comments', post_id=post.id) }}" data-cursor="{{ encode_cursor(comments[post.id][-1]) if comments[post.id] else '' }}">
+        查看更多评论（共 {{ post.comment_count }} 条）
+      </button>
+      {% endif %}
     {% endif %}
 
     <form method="post" action="{{ url_for('add_comment', post_id=post.id) }}" class="mt-3">
-      {{ comment_forms[post.id].hidden_tag() }}
+      {{ comment_form.hidden_tag() }}
       <div class="mb-3">
-        {{ comment_forms[post.id].content(class="form-control", rows="2", placeholder="写评论...") }}
-        {% if comment_forms[post.id].content.errors %}
-          <div class="form-error">{{ comment_forms[post.id].content.errors[0] }}</div>
-        {% endif %}
+        {{ comment_form.content(class="form-control", rows="2", placeholder="写评论...", id="comment-%d" % post.id) }}
       </div>
-      <button type="submit" class="btn btn-sm btn-primary">{{ comment_forms[post.id].submit.label.text }}</button>
+      <button type="submit" class="btn btn-sm btn-primary">{{ comment_form.submit.label.text }}</button>
     </form>
   </div>
 </div>
 {% else %}
 <p>该用户还没有发表说说。</p>
 {% endfor %}
+
+<nav class="mb-4">
+  {% if request.args.cursor %}<a href="{{ url_for('user_posts', username=user.username) }}" class="btn btn-outline-primary btn-sm">回到最新</a>{% endif %}
+  {% if next_cursor %}<a href="{{ url_for('user_posts', username=user.username, cursor=next_cursor) }}" class="btn btn-outline-primary btn-sm">更早的说说</a>{% endif %}
+</nav>
 {% endblock %}
 
 ---